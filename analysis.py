@@ -1,8 +1,13 @@
-import duckdb
 import logging
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
+from concurrent.futures import ThreadPoolExecutor
+
+import columnar
+import session
+import storage_stats
+from query_cache import cached_query
 
 
 logging.basicConfig(
@@ -12,108 +17,95 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-# obtaining single largest carbon trip (all fields of the trip) out of 2015-2024 or respective year range
-def single_largest_carbon_trip_year(color, years=range(2024, 2025), db_path='./emissions.duckdb'):
+# independent analysis queries run side by side in run_analyses
+MAX_WORKERS = 4
+
+
+# the fields every largest-trip result carries, in the order pretty_print_largest_carbon_trip prints them
+TRIP_FIELDS = [
+    "pickup_ts",
+    "dropoff_ts",
+    "trip_distance_mi",
+    "passenger_count",
+    "trip_year",
+    "hour_of_day",
+    "day_of_week",
+    "week_of_year",
+    "month_of_year",
+    "avg_mph",
+    "trip_co2_kgs",
+    "vehicle_type",
+]
+
+# top_co2_trips (dbt marts) keeps the top_k heaviest trips per (vehicle_type, trip_year)
+TOP_TRIPS_TABLE = "top_co2_trips"
+
+
+# obtaining the n largest carbon trips (all fields of each trip) out of 2015-2024 or respective year range, heaviest first.
+# merges the per-year lists in top_co2_trips when they go at least n deep, otherwise sorts data_transformation
+@cached_query
+def top_carbon_trips(color, n=10, years=range(2024, 2025), db_path=None):
     con = None
+    color_lower = color.lower()
 
     try:
-        con = duckdb.connect(database=db_path, read_only=True)
-        logger.info(f"Connected to DuckDB for largest CO2 trip: color={color}, years={list(years)}")
+        con = session.cursor(db_path, read_only=True)
+        logger.info(f"Connected to DuckDB for top {n} CO2 trips: color={color}, years={list(years)}")
+
+        if color_lower not in COLORS:
+            print("no table found to reference or pull data")
+            logger.warning("no table found to reference or pull data")
+            return None
 
-        largest_trip = {}
-        color_lower = color.lower()
         start_year = min(years)
         end_year = max(years) + 1
-        sql_query = ""
 
-        if color_lower.lower() == 'yellow':
-            sql_query = f"""
-                SELECT
-                    pickup_ts,
-                    dropoff_ts,
-                    trip_distance_mi,
-                    passenger_count,
-                    trip_year,
-                    hour_of_day,
-                    day_of_week,
-                    week_of_year,
-                    month_of_year,
-                    avg_mph,
-                    trip_co2_kgs,
-                    vehicle_type
-                FROM data_transformation
-                WHERE vehicle_type = 'yellow_taxi'
+        top_k = None
+        if relation_exists(con, TOP_TRIPS_TABLE):
+            top_k = con.execute(f"SELECT MIN(top_k) FROM {TOP_TRIPS_TABLE}").fetchone()[0]
+
+        if top_k is not None and top_k >= n:
+            table = TOP_TRIPS_TABLE
+            where = f"""vehicle_type = '{color_lower}_taxi'
+                    AND trip_year >= {start_year}
+                    AND trip_year <  {end_year}"""
+        else:
+            table = "data_transformation"
+            where = f"""vehicle_type = '{color_lower}_taxi'
                     AND pickup_ts >= TIMESTAMP '{start_year}-01-01'
                     AND pickup_ts <  TIMESTAMP '{end_year}-01-01'
-                    AND trip_co2_kgs IS NOT NULL
-                ORDER BY trip_co2_kgs DESC, trip_distance_mi DESC, dropoff_ts ASC
-                LIMIT 1
-            """
-            
-        elif color_lower == 'green':
-            sql_query = f"""
-                SELECT
-                    pickup_ts,
-                    dropoff_ts,
-                    trip_distance_mi,
-                    passenger_count,
-                    trip_year,
-                    hour_of_day,
-                    day_of_week,
-                    week_of_year,
-                    month_of_year,
-                    avg_mph,
-                    trip_co2_kgs,
-                    vehicle_type
-                FROM data_transformation
-                WHERE vehicle_type = 'green_taxi'
-                    AND pickup_ts >= TIMESTAMP '{start_year}-01-01'
-                    AND pickup_ts <  TIMESTAMP '{end_year}-01-01'
-                    AND trip_co2_kgs IS NOT NULL
-                ORDER BY trip_co2_kgs DESC, trip_distance_mi DESC, dropoff_ts ASC
-                LIMIT 1
-            """
+                    AND trip_co2_kgs IS NOT NULL"""
+            storage_stats.log_row_group_skips(con, f"top_carbon_trips {color_lower}", table,
+                                              [f"{color_lower}_taxi"], start_year, end_year)
+
+        rows = con.execute(f"""
+            SELECT {", ".join(TRIP_FIELDS)}
+            FROM {table}
+            WHERE {where}
+            ORDER BY trip_co2_kgs DESC, trip_distance_mi DESC, dropoff_ts ASC
+            LIMIT {int(n)}
+        """).fetchall()
 
-        if not sql_query:
-            print("no table found to reference or pull data")
-            logger.warning("no table found to reference or pull data")
-            return None
-
-        try:
-            row = con.execute(sql_query).fetchone()
-        except Exception as e:
-            logger.warning(f"can't find table")
-            return None
-        
-        if row:
-            trip_co2 = row[10]
-            if trip_co2 is not None:
-                largest_trip = {
-                    "pickup_ts": row[0],
-                    "dropoff_ts": row[1],
-                    "trip_distance_mi": row[2],
-                    "passenger_count": row[3],
-                    "trip_year": row[4],
-                    "hour_of_day": row[5],
-                    "day_of_week": row[6],
-                    "week_of_year": row[7],
-                    "month_of_year": row[8],
-                    "avg_mph": row[9],
-                    "trip_co2_kgs": row[10],
-                    "vehicle_type": row[11],
-                }
-
-        return largest_trip
+        return [dict(zip(TRIP_FIELDS, row)) for row in rows]
 
     except Exception as e:
-        print(f"Error in finding single largest carbon trip in the year in years={list(years)} for {color_lower}: {e}")
-        logger.warning(f"Error in finding single largest carbon trip in the year in years={list(years)} for {color_lower}: {e}")
+        print(f"Error in finding the top {n} carbon trips in years={list(years)} for {color_lower}: {e}")
+        logger.warning(f"Error in finding the top {n} carbon trips in years={list(years)} for {color_lower}: {e}")
         return None
 
     finally:
         if con:
             con.close()
 
+
+
+# obtaining single largest carbon trip (all fields of the trip) out of 2015-2024 or respective year range
+def single_largest_carbon_trip_year(color, years=range(2024, 2025), db_path=None):
+    trips = top_carbon_trips(color, 1, years, db_path)
+    if trips is None:
+        return None
+    return trips[0] if trips else {}
+
 # printing the above largest carbon trip out of all years yellow and for green in pretty way with bullet points
 def pretty_print_largest_carbon_trip(color, largest_carbon, years=range(2024, 2025)):
     start_year = min(years)
@@ -133,61 +125,177 @@ def pretty_print_largest_carbon_trip(color, largest_carbon, years=range(2024, 20
 
 
 
-# obtaining heaviest and lightest carbon hours ou tof the year range 2015-2024, or whatever is input
-def carbon_heavy_light_hour (years=range(2024, 2025), db_path='./emissions.duckdb'):
-    con = None
+# co2_rollup (dbt marts) holds co2 sums/counts per vehicle_type, year, month, week, day of week and hour -
+# if it's been built the breakdown queries read it instead of every trip in data_transformation
+ROLLUP_TABLE = "co2_rollup"
 
-    try:
-        start_year = min(years)
-        end_year = max(years) + 1
-        con = duckdb.connect(database=db_path, read_only=True)
-        logger.info(f"Connected to DuckDB for heavy and light carbon hours: years={list(years)}")
+COLORS = ("yellow", "green")
 
-        result_yellow = None
-        result_green = None
+# every breakdown co2_breakdowns knows: avg co2 per trip by hour / day of week / week / month, total co2 per year-month
+ALL_BREAKDOWNS = ("hour", "dow", "week", "month", "year_month")
+BREAKDOWN_COLUMNS = {
+    "hour": ("hour_of_day",),
+    "dow": ("day_of_week",),
+    "week": ("week_of_year",),
+    "month": ("month_of_year",),
+    "year_month": ("trip_year", "month_of_year"),
+}
 
-        result_yellow = con.execute(f""" 
-            SELECT
-                hour_of_day,
-                AVG(trip_co2_kgs) AS avg_co2_per_trip
-            FROM data_transformation
-            WHERE vehicle_type = 'yellow_taxi'
-                AND pickup_ts >= TIMESTAMP '{start_year}-01-01'
-                AND pickup_ts <  TIMESTAMP '{end_year}-01-01'
-                AND trip_co2_kgs IS NOT NULL
-            GROUP BY hour_of_day
-            ORDER BY hour_of_day;
-        """).fetchall()
+GROUPING_COLUMNS = ("hour_of_day", "day_of_week", "week_of_year", "trip_year", "month_of_year")
 
-        result_green = con.execute(f"""
-            SELECT
-                hour_of_day,
-                AVG(trip_co2_kgs) AS avg_co2_per_trip
-            FROM data_transformation
-            WHERE vehicle_type = 'green_taxi'
+# dim_calendar (dbt dims) - short labels and sort order for day_of_week / month_of_year come from it
+CALENDAR_DIM = "dim_calendar"
+DOW_DIM = f"(SELECT DISTINCT day_of_week, day_abbrev, day_index FROM {CALENDAR_DIM})"
+MONTH_DIM = f"(SELECT DISTINCT month_of_year, month_abbrev FROM {CALENDAR_DIM})"
+# same labels as the dim_day_of_week / dim_month seeds behind it, used inline when it hasn't been built yet
+DOW_DIM_FALLBACK = """(SELECT * FROM (VALUES
+    ('Sunday', 'Sun', 0), ('Monday', 'Mon', 1), ('Tuesday', 'Tue', 2), ('Wednesday', 'Wed', 3),
+    ('Thursday', 'Thu', 4), ('Friday', 'Fri', 5), ('Saturday', 'Sat', 6)
+) AS t(day_of_week, day_abbrev, day_index))"""
+MONTH_DIM_FALLBACK = """(SELECT * FROM (VALUES
+    (1, 'Jan'), (2, 'Feb'), (3, 'Mar'), (4, 'Apr'), (5, 'May'), (6, 'Jun'),
+    (7, 'Jul'), (8, 'Aug'), (9, 'Sep'), (10, 'Oct'), (11, 'Nov'), (12, 'Dec')
+) AS t(month_of_year, month_abbrev))"""
+
+
+def relation_exists(con, name):
+    return con.execute("""
+        SELECT COUNT(*) FROM information_schema.tables
+        WHERE table_schema = 'main' AND table_name = ?
+    """, [name]).fetchone()[0] > 0
+
+
+# where the co2 numbers come from - table, WHERE clause and the avg/sum expressions to use (color=None is both colors).
+# both give the same answers: avg over the rollup is SUM(co2_kgs_sum) / SUM(co2_trip_count)
+def co2_source(con, color, years):
+    start_year = min(years)
+    end_year = max(years) + 1
+    colors = [color.lower()] if color else COLORS
+    vehicle_types = ", ".join(f"'{c}_taxi'" for c in colors)
+
+    if relation_exists(con, ROLLUP_TABLE):
+        return {
+            "table": ROLLUP_TABLE,
+            "where": f"""vehicle_type IN ({vehicle_types})
+                AND trip_year >= {start_year}
+                AND trip_year <  {end_year}
+                AND co2_trip_count > 0""",
+            "avg": "SUM(co2_kgs_sum) / SUM(co2_trip_count)",
+            "sum": "SUM(co2_kgs_sum)",
+        }
+
+    return {
+        "table": "data_transformation",
+        "where": f"""vehicle_type IN ({vehicle_types})
                 AND pickup_ts >= TIMESTAMP '{start_year}-01-01'
                 AND pickup_ts <  TIMESTAMP '{end_year}-01-01'
-                AND trip_co2_kgs IS NOT NULL
-            GROUP BY hour_of_day
-            ORDER BY hour_of_day;
-        """).fetchall()
+                AND trip_co2_kgs IS NOT NULL""",
+        "avg": "AVG(trip_co2_kgs)",
+        "sum": "SUM(trip_co2_kgs)",
+    }
 
-        if not result_yellow or not result_green:
-            logger.warning("One of the color result sets is empty.")
-            return None
 
-        yellow_hour_min = min(result_yellow, key=lambda x: x[1])
-        yellow_hour_max = max(result_yellow, key=lambda x: x[1])
 
-        green_hour_min = min(result_green, key=lambda x: x[1])
-        green_hour_max = max(result_green, key=lambda x: x[1])
+# analysis engine - every requested breakdown for both colors out of one GROUPING SETS scan, kept as numpy columns
+# returns {"yellow": {"hour": {"label": array, "value": array}, "dow": {...}, ...}, "green": {...}}, or None on error
+#   hour/dow/week/month -> label, value = avg co2 per trip, sorted the way the old per-breakdown queries sorted them
+#   year_month          -> year, month, value = total co2 kg
+@cached_query
+def co2_breakdowns(years=range(2024, 2025), db_path=None, breakdowns=ALL_BREAKDOWNS):
+    con = None
 
-        return yellow_hour_min, yellow_hour_max, green_hour_min, green_hour_max
+    try:
+        con = session.cursor(db_path, read_only=True)
+        logger.info(f"Connected to DuckDB for co2 breakdowns {list(breakdowns)}: years={list(years)}")
+
+        src = co2_source(con, None, years)
+        if src["table"] == "data_transformation":
+            storage_stats.log_row_group_skips(con, "co2_breakdowns", src["table"],
+                                              [f"{c}_taxi" for c in COLORS], min(years), max(years) + 1)
+        grouping_sets = ", ".join(
+            "(vehicle_type, " + ", ".join(BREAKDOWN_COLUMNS[b]) + ")" for b in breakdowns
+        )
+
+        # GROUPING()/the column itself only for columns some requested set groups by, the rest are constant
+        grouped = {col for b in breakdowns for col in BREAKDOWN_COLUMNS[b]}
+        select_cols = []
+        for col in GROUPING_COLUMNS:
+            if col in grouped:
+                select_cols.append(f"GROUPING({col}) = 0 AS by_{col}, {col}")
+            else:
+                # typed so the column still fetches as a (masked) array and joins against the lookups
+                null_type = "VARCHAR" if col == "day_of_week" else "INTEGER"
+                select_cols.append(f"false AS by_{col}, NULL::{null_type} AS {col}")
+        select_list = ",\n                ".join(select_cols)
+
+        has_calendar = relation_exists(con, CALENDAR_DIM)
+        dow_dim = DOW_DIM if has_calendar else DOW_DIM_FALLBACK
+        month_dim = MONTH_DIM if has_calendar else MONTH_DIM_FALLBACK
+
+        # labels and sort order joined on after grouping - a handful of rows, not every trip.
+        # each row only has its own set's columns filled, so one ORDER BY sorts every set (NULLs go last);
+        # a day the lookup doesn't know goes after Saturday
+        cols = columnar.fetch_columns(con, f"""
+            WITH grouped AS (
+                SELECT
+                    vehicle_type,
+                    {select_list},
+                    {src['avg']} AS avg_co2_per_trip,
+                    {src['sum']} AS total_co2_kgs
+                FROM {src['table']}
+                WHERE {src['where']}
+                GROUP BY GROUPING SETS ({grouping_sets})
+            )
+            SELECT
+                grouped.*,
+                dow.day_abbrev,
+                dow.day_index,
+                mon.month_abbrev
+            FROM grouped
+            LEFT JOIN {dow_dim} AS dow ON grouped.day_of_week = dow.day_of_week
+            LEFT JOIN {month_dim} AS mon ON grouped.month_of_year = mon.month_of_year
+            ORDER BY grouped.hour_of_day, COALESCE(dow.day_index, 7), grouped.week_of_year, grouped.trip_year, grouped.month_of_year;
+        """)
+
+        # split the columns by color and grouping set with boolean masks
+        flags = {col: columnar.filled(cols[f"by_{col}"], False) for col in GROUPING_COLUMNS}
+        # a day the lookup doesn't know keeps its full name
+        day_labels = np.where(np.ma.getmaskarray(cols["day_abbrev"]),
+                              columnar.filled(cols["day_of_week"], None), columnar.filled(cols["day_abbrev"], None))
+        week = columnar.filled(cols["week_of_year"], 0)
+        month_known = ~np.ma.getmaskarray(cols["month_abbrev"])
+        sets = {
+            "hour": (flags["hour_of_day"], cols["hour_of_day"]),
+            "dow": (flags["day_of_week"], day_labels),
+            "week": (flags["week_of_year"] & (week >= 1) & (week <= 52), cols["week_of_year"]),
+            "month": (flags["month_of_year"] & ~flags["trip_year"] & month_known, cols["month_abbrev"]),
+        }
+
+        vehicle_types = cols["vehicle_type"].astype(str)
+        avg_co2 = columnar.filled(cols["avg_co2_per_trip"], np.nan)
+        total_co2 = columnar.filled(cols["total_co2_kgs"], np.nan)
+
+        results = {color: {} for color in COLORS}
+        for color in COLORS:
+            is_color = vehicle_types == f"{color}_taxi"
+            for b in breakdowns:
+                if b == "year_month":
+                    mask = is_color & flags["trip_year"] & flags["month_of_year"]
+                    results[color][b] = {
+                        "year": columnar.filled(cols["trip_year"], 0)[mask],
+                        "month": columnar.filled(cols["month_of_year"], 0)[mask],
+                        "value": total_co2[mask],
+                    }
+                else:
+                    set_mask, labels = sets[b]
+                    mask = is_color & set_mask
+                    results[color][b] = {"label": columnar.filled(labels, None)[mask], "value": avg_co2[mask]}
+
+        return results
 
-    
     except Exception as e:
-        print(f"Error in finding the heavy and light carbon hours={list(years)}: {e}")
-        logger.warning(f"Error in finding the heavy and light carbon hours={list(years)}: {e}")
+        print(f"Error in computing co2 breakdowns={list(years)}: {e}")
+        logger.warning(f"Error in computing co2 breakdowns={list(years)}: {e}")
         return None
 
     finally:
@@ -195,343 +303,113 @@ def carbon_heavy_light_hour (years=range(2024, 2025), db_path='./emissions.duckd
             con.close()
 
 
+# helper for the heavy/light functions below - min and max of one breakdown for yellow then green.
+# expected=(count, "days") warns when either color came back with fewer labels than that
+def heavy_light(breakdown, years, db_path, breakdowns=None, expected=None):
+    if breakdowns is None:
+        breakdowns = co2_breakdowns(years, db_path, (breakdown,))
+    if breakdowns is None:
+        return None
 
-# obtaining the heaviest and lightest carbon day of week (Mon to Sun) in respective year range
-def carbon_heavy_light_DOW (years=range(2024, 2025), db_path='./emissions.duckdb'):
-    con = None
-
-    try:
-        con = duckdb.connect(database=db_path, read_only=True)
-        logger.info(f"Connected to DuckDB for heavy and light carbon DOW: years={list(years)}")
+    result_yellow = breakdowns["yellow"][breakdown]
+    result_green = breakdowns["green"][breakdown]
 
-        start_year = min(years)
-        end_year = max(years) + 1
+    # argmin/argmax over the value column - (label, value) pairs like before
+    yellow = columnar.extremes(result_yellow["label"], result_yellow["value"])
+    green = columnar.extremes(result_green["label"], result_green["value"])
 
-        result_yellow = None
-        result_green = None
+    if yellow is None or green is None:
+        logger.warning("One of the color result sets is empty.")
+        return None
 
-        result_yellow = con.execute(f""" 
-            SELECT
-                CASE day_of_week
-                    WHEN 'Sunday'    THEN 'Sun'
-                    WHEN 'Monday'    THEN 'Mon'
-                    WHEN 'Tuesday'   THEN 'Tue'
-                    WHEN 'Wednesday' THEN 'Wed'
-                    WHEN 'Thursday'  THEN 'Thu'
-                    WHEN 'Friday'    THEN 'Fri'
-                    WHEN 'Saturday'  THEN 'Sat'
-                    ELSE day_of_week
-                END AS dow_abbrev,
-                AVG(trip_co2_kgs) AS avg_co2_per_trip
-            FROM data_transformation
-            WHERE vehicle_type = 'yellow_taxi'
-                AND pickup_ts >= TIMESTAMP '{start_year}-01-01'
-                AND pickup_ts <  TIMESTAMP '{end_year}-01-01'
-                AND trip_co2_kgs IS NOT NULL
-            GROUP BY 1
-            ORDER BY CASE
-                WHEN dow_abbrev='Sun' THEN 1
-                WHEN dow_abbrev='Mon' THEN 2
-                WHEN dow_abbrev='Tue' THEN 3
-                WHEN dow_abbrev='Wed' THEN 4
-                WHEN dow_abbrev='Thu' THEN 5
-                WHEN dow_abbrev='Fri' THEN 6
-                WHEN dow_abbrev='Sat' THEN 7
-            END;
-        """).fetchall()
+    if expected and (len(result_yellow["value"]) < expected[0] or len(result_green["value"]) < expected[0]):
+        logger.warning(f"Some {expected[1]} are missing in results.")
 
-        result_green = con.execute(f"""
-            SELECT
-                CASE day_of_week
-                    WHEN 'Sunday'    THEN 'Sun'
-                    WHEN 'Monday'    THEN 'Mon'
-                    WHEN 'Tuesday'   THEN 'Tue'
-                    WHEN 'Wednesday' THEN 'Wed'
-                    WHEN 'Thursday'  THEN 'Thu'
-                    WHEN 'Friday'    THEN 'Fri'
-                    WHEN 'Saturday'  THEN 'Sat'
-                    ELSE day_of_week
-                END AS dow_abbrev,
-                AVG(trip_co2_kgs) AS avg_co2_per_trip
-            FROM data_transformation
-            WHERE vehicle_type = 'green_taxi'
-                AND pickup_ts >= TIMESTAMP '{start_year}-01-01'
-                AND pickup_ts <  TIMESTAMP '{end_year}-01-01'
-                AND trip_co2_kgs IS NOT NULL
-            GROUP BY 1
-            ORDER BY CASE
-                WHEN dow_abbrev='Sun' THEN 1
-                WHEN dow_abbrev='Mon' THEN 2
-                WHEN dow_abbrev='Tue' THEN 3
-                WHEN dow_abbrev='Wed' THEN 4
-                WHEN dow_abbrev='Thu' THEN 5
-                WHEN dow_abbrev='Fri' THEN 6
-                WHEN dow_abbrev='Sat' THEN 7
-            END;
-        """).fetchall()
+    yellow_min, yellow_max = yellow
+    green_min, green_max = green
 
-        if not result_yellow or not result_green:
-            logger.warning("One of the color result sets is empty.")
-            return None
-        
-        if len(result_yellow) < 7 or len(result_green) < 7:
-            logger.warning("Some days are missing in results.")
+    return yellow_min, yellow_max, green_min, green_max
 
-        yellow_DOW_min = min(result_yellow, key=lambda x: x[1])
-        yellow_DOW_max = max(result_yellow, key=lambda x: x[1])
 
-        green_DOW_min = min(result_green, key=lambda x: x[1])
-        green_DOW_max = max(result_green, key=lambda x: x[1])
 
-        return yellow_DOW_min, yellow_DOW_max, green_DOW_min, green_DOW_max
+# obtaining heaviest and lightest carbon hours ou tof the year range 2015-2024, or whatever is input
+# pass breakdowns (from co2_breakdowns) to reuse an earlier scan, otherwise this runs its own
+def carbon_heavy_light_hour (years=range(2024, 2025), db_path=None, breakdowns=None):
+    try:
+        logger.info(f"heavy and light carbon hours: years={list(years)}")
+        return heavy_light("hour", years, db_path, breakdowns)
 
     except Exception as e:
-        print(f"Error in finding the heavy and light carbon DOW={list(years)}: {e}")
-        logger.warning(f"Error in finding the heavy and light carbon DOW={list(years)}: {e}")
+        print(f"Error in finding the heavy and light carbon hours={list(years)}: {e}")
+        logger.warning(f"Error in finding the heavy and light carbon hours={list(years)}: {e}")
         return None
 
-    finally:
-        if con:
-            con.close()
-
 
 
-# obtaining the heaviest and lightest carbon week (1-52, not 1-2015, 1-2016, etc.) in respective year range
-def carbon_heavy_light_week (years=range(2024, 2025), db_path='./emissions.duckdb'):
-    con = None
-
+# obtaining the heaviest and lightest carbon day of week (Mon to Sun) in respective year range
+def carbon_heavy_light_DOW (years=range(2024, 2025), db_path=None, breakdowns=None):
     try:
-        start_year = min(years)
-        end_year = max(years) + 1
-        con = duckdb.connect(database=db_path, read_only=True)
-        logger.info(f"Connected to DuckDB for heavy and light carbon weeks: years={list(years)}")
-
-        result_yellow = None
-        result_green = None
-
-        result_yellow = con.execute(f""" 
-            SELECT
-                week_of_year,
-                AVG(trip_co2_kgs) AS avg_co2_per_trip
-            FROM data_transformation
-            WHERE vehicle_type = 'yellow_taxi'
-                AND pickup_ts >= TIMESTAMP '{start_year}-01-01'
-                AND pickup_ts <  TIMESTAMP '{end_year}-01-01'
-                AND trip_co2_kgs IS NOT NULL
-                AND week_of_year BETWEEN 1 AND 52
-            GROUP BY week_of_year
-            ORDER BY week_of_year;
-        """).fetchall()
+        logger.info(f"heavy and light carbon DOW: years={list(years)}")
+        return heavy_light("dow", years, db_path, breakdowns, expected=(7, "days"))
 
-        result_green = con.execute(f"""
-            SELECT
-                week_of_year,
-                AVG(trip_co2_kgs) AS avg_co2_per_trip
-            FROM data_transformation
-            WHERE vehicle_type = 'green_taxi'
-                AND pickup_ts >= TIMESTAMP '{start_year}-01-01'
-                AND pickup_ts <  TIMESTAMP '{end_year}-01-01'
-                AND trip_co2_kgs IS NOT NULL
-                AND week_of_year BETWEEN 1 AND 52
-            GROUP BY week_of_year
-            ORDER BY week_of_year;
-        """).fetchall()
-
-        if not result_yellow or not result_green:
-            logger.warning("One of the color result sets is empty.")
-            return None
+    except Exception as e:
+        print(f"Error in finding the heavy and light carbon DOW={list(years)}: {e}")
+        logger.warning(f"Error in finding the heavy and light carbon DOW={list(years)}: {e}")
+        return None
 
-        yellow_week_min = min(result_yellow, key=lambda x: x[1])
-        yellow_week_max = max(result_yellow, key=lambda x: x[1])
 
-        green_week_min = min(result_green, key=lambda x: x[1])
-        green_week_max = max(result_green, key=lambda x: x[1])
 
-        return yellow_week_min, yellow_week_max, green_week_min, green_week_max
+# obtaining the heaviest and lightest carbon week (1-52, not 1-2015, 1-2016, etc.) in respective year range
+def carbon_heavy_light_week (years=range(2024, 2025), db_path=None, breakdowns=None):
+    try:
+        logger.info(f"heavy and light carbon weeks: years={list(years)}")
+        return heavy_light("week", years, db_path, breakdowns)
 
     except Exception as e:
         print(f"Error in finding the heavy and light carbon weeks={list(years)}: {e}")
         logger.warning(f"Error in finding the heavy and light carbon weeks={list(years)}: {e}")
         return None
 
-    finally:
-        if con:
-            con.close()
-
 
 
 # obtaining the heaviest and lightest carbon day of month (1-12, not jan-2015, jan-2016, etc.) in respective year range
-def carbon_heavy_light_month (years=range(2024, 2025), db_path='./emissions.duckdb'):
-    con = None
-
+def carbon_heavy_light_month (years=range(2024, 2025), db_path=None, breakdowns=None):
     try:
-        start_year = min(years)
-        end_year = max(years) + 1
-        con = duckdb.connect(database=db_path, read_only=True)
-        logger.info(f"Connected to DuckDB for heavy and light carbon months: years={list(years)}")
-
-        result_yellow = None
-        result_green = None
-
-        result_yellow = con.execute(f""" 
-            SELECT
-                CASE month_of_year
-                    WHEN 1 THEN 'Jan'
-                    WHEN 2 THEN 'Feb'
-                    WHEN 3 THEN 'Mar'
-                    WHEN 4 THEN 'Apr'
-                    WHEN 5 THEN 'May'
-                    WHEN 6 THEN 'Jun'
-                    WHEN 7 THEN 'Jul'
-                    WHEN 8 THEN 'Aug'
-                    WHEN 9 THEN 'Sep'
-                    WHEN 10 THEN 'Oct'
-                    WHEN 11 THEN 'Nov'
-                    WHEN 12 THEN 'Dec'
-                    ELSE CAST(month_of_year AS VARCHAR)
-                END AS mo_abbrev,
-                AVG(trip_co2_kgs) AS avg_co2_per_trip
-            FROM data_transformation
-            WHERE vehicle_type = 'yellow_taxi'
-                AND pickup_ts >= TIMESTAMP '{start_year}-01-01'
-                AND pickup_ts <  TIMESTAMP '{end_year}-01-01'
-                AND trip_co2_kgs IS NOT NULL
-                AND month_of_year BETWEEN 1 AND 12
-            GROUP BY mo_abbrev
-            ORDER BY CASE
-                WHEN mo_abbrev='Jan' THEN 1
-                WHEN mo_abbrev='Feb' THEN 2
-                WHEN mo_abbrev='Mar' THEN 3
-                WHEN mo_abbrev='Apr' THEN 4
-                WHEN mo_abbrev='May' THEN 5
-                WHEN mo_abbrev='Jun' THEN 6
-                WHEN mo_abbrev='Jul' THEN 7
-                WHEN mo_abbrev='Aug' THEN 8
-                WHEN mo_abbrev='Sep' THEN 9
-                WHEN mo_abbrev='Oct' THEN 10
-                WHEN mo_abbrev='Nov' THEN 11
-                WHEN mo_abbrev='Dec' THEN 12
-            END;
-        """).fetchall()
-
-        result_green = con.execute(f"""
-            SELECT
-                CASE month_of_year
-                    WHEN 1    THEN 'Jan'
-                    WHEN 2    THEN 'Feb'
-                    WHEN 3   THEN 'Mar'
-                    WHEN 4 THEN 'Apr'
-                    WHEN 5  THEN 'May'
-                    WHEN 6    THEN 'Jun'
-                    WHEN 7  THEN 'Jul'
-                    WHEN 8  THEN 'Aug'
-                    WHEN 9  THEN 'Sep'
-                    WHEN 10  THEN 'Oct'
-                    WHEN 11  THEN 'Nov'
-                    WHEN 12  THEN 'Dec'
-                    ELSE CAST(month_of_year AS VARCHAR)
-                END AS mo_abbrev,
-                AVG(trip_co2_kgs) AS avg_co2_per_trip
-            FROM data_transformation
-            WHERE vehicle_type = 'green_taxi'
-                AND pickup_ts >= TIMESTAMP '{start_year}-01-01'
-                AND pickup_ts <  TIMESTAMP '{end_year}-01-01'
-                AND trip_co2_kgs IS NOT NULL
-                AND month_of_year BETWEEN 1 AND 12
-            GROUP BY mo_abbrev
-            ORDER BY CASE
-                WHEN mo_abbrev='Jan' THEN 1
-                WHEN mo_abbrev='Feb' THEN 2
-                WHEN mo_abbrev='Mar' THEN 3
-                WHEN mo_abbrev='Apr' THEN 4
-                WHEN mo_abbrev='May' THEN 5
-                WHEN mo_abbrev='Jun' THEN 6
-                WHEN mo_abbrev='Jul' THEN 7
-                WHEN mo_abbrev='Aug' THEN 8
-                WHEN mo_abbrev='Sep' THEN 9
-                WHEN mo_abbrev='Oct' THEN 10
-                WHEN mo_abbrev='Nov' THEN 11
-                WHEN mo_abbrev='Dec' THEN 12
-            END;
-
-        """).fetchall()
-
-        if not result_yellow or not result_green:
-            logger.warning("One of the color result sets is empty.")
-            return None
-
-        if len(result_yellow) < 12 or len(result_green) < 12:
-            logger.warning("Some months are missing in results.")
-
-        yellow_mo_min = min(result_yellow, key=lambda x: x[1])
-        yellow_mo_max = max(result_yellow, key=lambda x: x[1])
-
-        green_mo_min = min(result_green, key=lambda x: x[1])
-        green_mo_max = max(result_green, key=lambda x: x[1])
-
-        return yellow_mo_min, yellow_mo_max, green_mo_min, green_mo_max
+        logger.info(f"heavy and light carbon months: years={list(years)}")
+        return heavy_light("month", years, db_path, breakdowns, expected=(12, "months"))
 
     except Exception as e:
         print(f"Error in finding the heavy and light carbon months={list(years)}: {e}")
         logger.warning(f"Error in finding the heavy and light carbon months={list(years)}: {e}")
         return None
 
-    finally:
-        if con:
-            con.close()
-
 
 
 # plotting co2 sum totals of all years' months for all years - x axis from 2015-2024 (or respective timeframe), y-axis is summation of co2 in kgs
-def plot_co2_month_by_co2totals(years=range(2024, 2025), db_path='./emissions.duckdb'):
-    con = None
-
+def plot_co2_month_by_co2totals(years=range(2024, 2025), db_path=None, breakdowns=None):
     try:
         start_year = min(years)
         end_year = max(years) + 1
-        con = duckdb.connect(database=db_path, read_only=True)
-        logger.info(f"Connected to DuckDB for heavy and light carbon months: years={list(years)}")
+        logger.info(f"plotting monthly co2 totals: years={list(years)}")
 
-        month_totalco2_yellow = con.execute(f"""
-            SELECT
-                trip_year AS yr,
-                month_of_year AS mo,
-                SUM(trip_co2_kgs) AS total_co2_kgs
-            FROM data_transformation
-            WHERE vehicle_type = 'yellow_taxi'
-                AND pickup_ts >= TIMESTAMP '{start_year}-01-01'
-                AND pickup_ts <  TIMESTAMP '{end_year}-01-01'
-                AND trip_co2_kgs IS NOT NULL
-            GROUP BY yr, mo
-            ORDER BY yr, mo;
-        """).fetchall()
+        if breakdowns is None:
+            breakdowns = co2_breakdowns(years, db_path, ("year_month",))
+        if breakdowns is None:
+            return None
 
-        month_totalco2_green = con.execute(f"""
-            SELECT
-                trip_year AS yr,
-                month_of_year AS mo,
-                SUM(trip_co2_kgs) AS total_co2_kgs
-            FROM data_transformation
-            WHERE vehicle_type = 'green_taxi'
-                AND pickup_ts >= TIMESTAMP '{start_year}-01-01'
-                AND pickup_ts <  TIMESTAMP '{end_year}-01-01'
-                AND trip_co2_kgs IS NOT NULL
-            GROUP BY yr, mo
-            ORDER BY yr, mo;
-        """).fetchall()
+        month_totalco2_yellow = breakdowns["yellow"]["year_month"]
+        month_totalco2_green = breakdowns["green"]["year_month"]
 
 
         # plotting yellow        
         fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 10), dpi=150, sharex=True, constrained_layout=True)
 
-        years_list = list(range(start_year, end_year))
-        grid = [(yr, mo) for yr in years_list for mo in range(1, 13)]
+        # the year-month grid filled in one numpy scatter (months without trips at 0), labels only built for the ticks
         abbr = ['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec']
-        x_labels = [f"{yr}-{abbr[mo-1]}" for (yr, mo) in grid]
-        x_pos = list(range(len(grid)))
+        x_pos = np.arange((end_year - start_year) * 12)
 
-        y_dict = {(int(yr), int(mo)): float(val) for (yr, mo, val) in month_totalco2_yellow} 
-        y_series = [y_dict.get(key, 0.0) for key in grid]
+        y_series = columnar.month_grid(month_totalco2_yellow["year"], month_totalco2_yellow["month"],
+                                       month_totalco2_yellow["value"], start_year, end_year)
         ax1.plot(x_pos, y_series, marker='o', color='#FFCE1B', label='yellow')
 
         ax1.spines['top'].set_visible(False)
@@ -540,7 +418,8 @@ def plot_co2_month_by_co2totals(years=range(2024, 2025), db_path='./emissions.du
         max_labels = 24 
         step = max(1, len(x_pos) // max_labels)
         tick_idx = x_pos[::step]
-        ax1.set_xticks(tick_idx, [x_labels[i] for i in tick_idx], rotation=45, ha='right')
+        tick_labels = [f"{start_year + i // 12}-{abbr[i % 12]}" for i in tick_idx]
+        ax1.set_xticks(tick_idx, tick_labels, rotation=45, ha='right')
 
         ax1.set_ylabel('Total CO2 (kg)')
         ax1.legend()
@@ -548,13 +427,13 @@ def plot_co2_month_by_co2totals(years=range(2024, 2025), db_path='./emissions.du
         # plotting green
         # plt.figure(figsize=(10,6), dpi=150)
 
-        g_dict = {(int(yr), int(mo)): float(val) for (yr, mo, val) in month_totalco2_green}
-        g_series = [g_dict.get(key, 0.0) for key in grid]
+        g_series = columnar.month_grid(month_totalco2_green["year"], month_totalco2_green["month"],
+                                       month_totalco2_green["value"], start_year, end_year)
         ax2.plot(x_pos, g_series, marker='o', color='#008000', label='green')
 
         ax2.spines['top'].set_visible(False)
         ax2.spines['right'].set_visible(False)
-        ax2.set_xticks(tick_idx, [x_labels[i] for i in tick_idx], rotation=45, ha='right')
+        ax2.set_xticks(tick_idx, tick_labels, rotation=45, ha='right')
         ax2.set_xlabel('Month')
         ax2.set_ylabel('Total CO2 (kg)')
         ax2.legend()
@@ -613,21 +492,42 @@ def plot_co2_month_by_co2totals(years=range(2024, 2025), db_path='./emissions.du
         logger.warning(f"Unable to plot the months and co2 totals={list(years)}: {e}")
         return None
 
-    finally:
-        if con:
-            con.close()
 
 
+# every query __main__ needs - the two largest trips and the breakdowns scan - dispatched together on a thread pool.
+# each function takes its own cursor off the one read-only session connection, so they share duckdb's caches.
+# returns {"largest_yellow": ..., "largest_green": ..., "breakdowns": ...}; parallel=False runs them one by one
+def run_analyses(years=range(2024, 2025), db_path=None, parallel=True, max_workers=MAX_WORKERS):
+    jobs = {
+        "largest_yellow": (single_largest_carbon_trip_year, ("yellow", years, db_path)),
+        "largest_green": (single_largest_carbon_trip_year, ("green", years, db_path)),
+        "breakdowns": (co2_breakdowns, (years, db_path)),
+    }
+    logger.info(f"running {len(jobs)} analysis queries {'in parallel' if parallel else 'serially'}: years={list(years)}")
 
-# Call all methods from analysis.py here
-if __name__ == "__main__":
-    # years = range(2023, 2025) # testing
-    years = range(2015, 2025)
+    if not parallel:
+        return {name: func(*args) for name, (func, args) in jobs.items()}
+
+    # open the shared connection up front rather than have the workers race to
+    session.connect(db_path, read_only=True)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {name: pool.submit(func, *args) for name, (func, args) in jobs.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+
+# the printed report __main__ runs (pipeline.py runs it too) - the largest trips, the heavy/light
+# hour/DOW/week/month and the monthly plot, all off one run_analyses()
+def report(years=range(2024, 2025)):
+    # the largest trips and every hour/DOW/week/month/plot breakdown (one scan for both colors) at once,
+    # the functions below just read from the results
+    results = run_analyses(years)
+    breakdowns = results["breakdowns"]
 
     # SINGLE LARGEST CARBON TRIP OF THE YEARS - YELLOW THEN GREEN:
     print("1. Single largest carbon trip of year(s):\n")
-    yellow_largest_carbon = single_largest_carbon_trip_year('yellow', years)
-    green_largest_carbon  = single_largest_carbon_trip_year('green',  years)
+    yellow_largest_carbon = results["largest_yellow"]
+    green_largest_carbon  = results["largest_green"]
     pretty_print_largest_carbon_trip("yellow", yellow_largest_carbon, years)
     print("\n")
     pretty_print_largest_carbon_trip("green",  green_largest_carbon,  years)
@@ -635,7 +535,7 @@ if __name__ == "__main__":
 
     # MIN AND MAX CARBON HOURS (AVERAGES) - YELLOW THEN GREEN:
     print("2. Carbon heavy and light hours for rides, yellow then green:")
-    results_hours = carbon_heavy_light_hour(years)
+    results_hours = carbon_heavy_light_hour(years, breakdowns=breakdowns)
     if not results_hours:
         print("no CO2 for hours results given")
         logger.warning("no CO2 for hours results given")
@@ -649,7 +549,7 @@ if __name__ == "__main__":
 
     # MIN AND MAX CARBON DOW (AVERAGES) - YELLOW THEN GREEN:
     print("3. Carbon heavy and light days of week for rides, yellow then green:")
-    results_DOW = carbon_heavy_light_DOW(years)
+    results_DOW = carbon_heavy_light_DOW(years, breakdowns=breakdowns)
     if not results_DOW:
         print("no CO2 for DOW results given")
         logger.warning("no CO2 for DOW results given")
@@ -663,7 +563,7 @@ if __name__ == "__main__":
 
     # MIN AND MAX CARBON WEEKS (AVERAGES) - YELLOW THEN GREEN:
     print("4. Carbon heavy and light weeks of years for rides, yellow then green:")
-    results_weeks = carbon_heavy_light_week(years)
+    results_weeks = carbon_heavy_light_week(years, breakdowns=breakdowns)
     if not results_weeks:
         print("no CO2 for weeks results given")
         logger.warning("no CO2 for weeks results given")
@@ -677,7 +577,7 @@ if __name__ == "__main__":
 
     # MIN AND MAX CARBON MONTHS (AVERAGES) - YELLOW THEN GREEN:
     print("5. Carbon heavy and light months of years for rides, yellow then green:")
-    results_months = carbon_heavy_light_month(years)
+    results_months = carbon_heavy_light_month(years, breakdowns=breakdowns)
     if not results_months:
         print("no CO2 for months results given")
         logger.warning("no CO2 for months results given")
@@ -692,6 +592,14 @@ if __name__ == "__main__":
     # PLOTTING FOR MONTH BY CO2 (Matplotlib.pyplot)
     print("6. plotting the yellow and green months b CO2 levels totals...")
     logger.info("plotting the yellow and green months b CO2 levels totals:")
-    plot_co2_month_by_co2totals(years)
+    plot_co2_month_by_co2totals(years, breakdowns=breakdowns)
     print("Plotting finished! Should be in this directory as a png.")
     logger.info("Finished subroutine in plotting the yellow and green months b CO2 levels totals.")
+    return results
+
+
+# Call all methods from analysis.py here
+if __name__ == "__main__":
+    # years = range(2023, 2025) # testing
+    years = range(2015, 2025)
+    report(years)
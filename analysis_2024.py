@@ -1,9 +1,12 @@
-import duckdb
 import logging
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+import session
+import storage_stats
+from query_cache import cached_query
+
 
 logging.basicConfig(
     level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
@@ -13,12 +16,15 @@ logger = logging.getLogger(__name__)
 
 
 
+@cached_query
 def single_largest_carbon_trip_year(color, years=range(2024, 2025), db_path='./emissions2024.duckdb'):
     con = None
 
     try:
-        con = duckdb.connect(database=db_path, read_only=True)
+        con = session.cursor(db_path, read_only=True)
         logger.info(f"Connected to DuckDB for largest CO2 trip: color={color}, years={list(years)}")
+        storage_stats.log_row_group_skips(con, f"largest trip {color.lower()}", "data_transformation",
+                                          [f"{color.lower()}_taxi"], min(years), max(years) + 1)
 
         largest_trip = ""
         largest_co2 = -1.0
@@ -133,14 +139,18 @@ def pretty_print_largest_carbon_trip(color, largest_carbon, years=range(2024, 20
 
 
 
+@cached_query
 def carbon_heavy_light_hour (years=range(2024, 2025), db_path='./emissions2024.duckdb'):
     con = None
 
     try:
         start_year = min(years)
         end_year = max(years) + 1
-        con = duckdb.connect(database=db_path, read_only=True)
+        con = session.cursor(db_path, read_only=True)
         logger.info(f"Connected to DuckDB for heavy and light carbon hours: years={list(years)}")
+        for vehicle_type in ("yellow_taxi", "green_taxi"):
+            storage_stats.log_row_group_skips(con, f"heavy and light carbon hours {vehicle_type}", "data_transformation",
+                                              [vehicle_type], min(years), max(years) + 1)
 
         result_yellow = None
         result_green = None
@@ -195,12 +205,16 @@ def carbon_heavy_light_hour (years=range(2024, 2025), db_path='./emissions2024.d
 
 
 
+@cached_query
 def carbon_heavy_light_DOW (years=range(2024, 2025), db_path='./emissions2024.duckdb'):
     con = None
 
     try:
-        con = duckdb.connect(database=db_path, read_only=True)
+        con = session.cursor(db_path, read_only=True)
         logger.info(f"Connected to DuckDB for heavy and light carbon DOW: years={list(years)}")
+        for vehicle_type in ("yellow_taxi", "green_taxi"):
+            storage_stats.log_row_group_skips(con, f"heavy and light carbon DOW {vehicle_type}", "data_transformation",
+                                              [vehicle_type], min(years), max(years) + 1)
 
         result_yellow = None
         result_green = None
@@ -282,14 +296,18 @@ def carbon_heavy_light_DOW (years=range(2024, 2025), db_path='./emissions2024.du
 
 
 
+@cached_query
 def carbon_heavy_light_week (years=range(2024, 2025), db_path='./emissions2024.duckdb'):
     con = None
 
     try:
         start_year = min(years)
         end_year = max(years) + 1
-        con = duckdb.connect(database=db_path, read_only=True)
+        con = session.cursor(db_path, read_only=True)
         logger.info(f"Connected to DuckDB for heavy and light carbon weeks: years={list(years)}")
+        for vehicle_type in ("yellow_taxi", "green_taxi"):
+            storage_stats.log_row_group_skips(con, f"heavy and light carbon weeks {vehicle_type}", "data_transformation",
+                                              [vehicle_type], min(years), max(years) + 1)
 
         result_yellow = None
         result_green = None
@@ -343,14 +361,18 @@ def carbon_heavy_light_week (years=range(2024, 2025), db_path='./emissions2024.d
 
 
 
+@cached_query
 def carbon_heavy_light_month (years=range(2024, 2025), db_path='./emissions2024.duckdb'):
     con = None
 
     try:
         start_year = min(years)
         end_year = max(years) + 1
-        con = duckdb.connect(database=db_path, read_only=True)
+        con = session.cursor(db_path, read_only=True)
         logger.info(f"Connected to DuckDB for heavy and light carbon months: years={list(years)}")
+        for vehicle_type in ("yellow_taxi", "green_taxi"):
+            storage_stats.log_row_group_skips(con, f"heavy and light carbon months {vehicle_type}", "data_transformation",
+                                              [vehicle_type], min(years), max(years) + 1)
 
         result_yellow = None
         result_green = None
@@ -459,14 +481,19 @@ def carbon_heavy_light_month (years=range(2024, 2025), db_path='./emissions2024.
 
 
 
-def plot_co2_month_by_co2totals(years=range(2024, 2025), db_path='./emissions2024.duckdb'):
+# monthly co2 totals for yellow then green - split out of the plot so the numbers can be cached
+@cached_query
+def monthly_co2_totals(years=range(2024, 2025), db_path='./emissions2024.duckdb'):
     con = None
 
     try:
         start_year = min(years)
         end_year = max(years) + 1
-        con = duckdb.connect(database=db_path, read_only=True)
-        logger.info(f"Connected to DuckDB for heavy and light carbon months: years={list(years)}")
+        con = session.cursor(db_path, read_only=True)
+        logger.info(f"Connected to DuckDB for monthly co2 totals: years={list(years)}")
+        for vehicle_type in ("yellow_taxi", "green_taxi"):
+            storage_stats.log_row_group_skips(con, f"monthly co2 totals {vehicle_type}", "data_transformation",
+                                              [vehicle_type], min(years), max(years) + 1)
 
         month_totalco2_yellow = con.execute(f"""
             SELECT
@@ -494,6 +521,26 @@ def plot_co2_month_by_co2totals(years=range(2024, 2025), db_path='./emissions202
             ORDER BY month_of_year;
         """).fetchall()
 
+        return month_totalco2_yellow, month_totalco2_green
+
+    except Exception as e:
+        print(f"Error in finding the monthly co2 totals={list(years)}: {e}")
+        logger.error(f"Error in finding the monthly co2 totals={list(years)}: {e}")
+        return None
+
+    finally:
+        if con:
+            con.close()
+
+
+
+def plot_co2_month_by_co2totals(years=range(2024, 2025), db_path='./emissions2024.duckdb'):
+    try:
+        totals = monthly_co2_totals(years, db_path)
+        if totals is None:
+            return None
+        month_totalco2_yellow, month_totalco2_green = totals
+
 
         # plotting yellow        
         fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 10), dpi=150, sharex=True, constrained_layout=True)
@@ -575,10 +622,6 @@ def plot_co2_month_by_co2totals(years=range(2024, 2025), db_path='./emissions202
         logger.error(f"Unable to plot the months and co2 totals={list(years)}: {e}")
         return None
 
-    finally:
-        if con:
-            con.close()
-
 
 
 # Call all methods from analysis.py here
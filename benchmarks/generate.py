@@ -0,0 +1,256 @@
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+import duckdb
+
+
+# no basicConfig here - generator messages land in the benchmark run's log
+logger = logging.getLogger(__name__)
+
+
+# synthetic TLC trip files for benchmarks - same file names and columns as cloudfront's
+# {color}_tripdata_{year}-{month}.parquet, so load.py can read them through a file:// TLC_BASE_URL.
+# deterministic: the same rows/years/seed always write the same trips (no duckdb random(), see HASH_MACROS)
+DATA_DIR = Path(__file__).resolve().parent / "data"
+DEFAULT_YEARS = (2024,)
+DEFAULT_SEED = 3022
+# share of the trips that are yellow (close to 2015-2024, where green is a small slice)
+YELLOW_SHARE = 0.85
+# every DUPLICATE_EVERY-th trip is written twice (clean.py's DISTINCT drops the copy)
+DUPLICATE_EVERY = 100
+
+# slices of the [0, 1) "kind" draw that become the dirty rows clean.py filters out, the rest are ordinary trips
+DIRTY_ROWS = {
+    "zero_passengers": (0.000, 0.020),
+    "null_passengers": (0.020, 0.025),
+    "zero_miles": (0.025, 0.035),
+    "over_100_miles": (0.035, 0.040),
+    "over_24_hours": (0.040, 0.045),
+}
+
+# column order and types of the TLC files (2024 layout)
+YELLOW_COLUMNS = [
+    ("VendorID", "INTEGER"),
+    ("tpep_pickup_datetime", "TIMESTAMP"),
+    ("tpep_dropoff_datetime", "TIMESTAMP"),
+    ("passenger_count", "BIGINT"),
+    ("trip_distance", "DOUBLE"),
+    ("RatecodeID", "BIGINT"),
+    ("store_and_fwd_flag", "VARCHAR"),
+    ("PULocationID", "INTEGER"),
+    ("DOLocationID", "INTEGER"),
+    ("payment_type", "BIGINT"),
+    ("fare_amount", "DOUBLE"),
+    ("extra", "DOUBLE"),
+    ("mta_tax", "DOUBLE"),
+    ("tip_amount", "DOUBLE"),
+    ("tolls_amount", "DOUBLE"),
+    ("improvement_surcharge", "DOUBLE"),
+    ("total_amount", "DOUBLE"),
+    ("congestion_surcharge", "DOUBLE"),
+    ("Airport_fee", "DOUBLE"),
+]
+GREEN_COLUMNS = [
+    ("VendorID", "INTEGER"),
+    ("lpep_pickup_datetime", "TIMESTAMP"),
+    ("lpep_dropoff_datetime", "TIMESTAMP"),
+    ("store_and_fwd_flag", "VARCHAR"),
+    ("RatecodeID", "BIGINT"),
+    ("PULocationID", "INTEGER"),
+    ("DOLocationID", "INTEGER"),
+    ("passenger_count", "BIGINT"),
+    ("trip_distance", "DOUBLE"),
+    ("fare_amount", "DOUBLE"),
+    ("extra", "DOUBLE"),
+    ("mta_tax", "DOUBLE"),
+    ("tip_amount", "DOUBLE"),
+    ("tolls_amount", "DOUBLE"),
+    ("ehail_fee", "DOUBLE"),
+    ("improvement_surcharge", "DOUBLE"),
+    ("total_amount", "DOUBLE"),
+    ("payment_type", "BIGINT"),
+    ("trip_type", "BIGINT"),
+    ("congestion_surcharge", "DOUBLE"),
+]
+COLUMNS = {"yellow": YELLOW_COLUMNS, "green": GREEN_COLUMNS}
+TIMESTAMP_PREFIX = {"yellow": "tpep", "green": "lpep"}
+
+# u(i, k, seed) is a uniform [0, 1) draw for trip i, stream k - murmur3's 32 bit finalizer in plain integer math,
+# so the files don't change between duckdb versions the way hash() or random() could
+HASH_MACROS = """
+    CREATE OR REPLACE MACRO mix(v, m, s) AS xor((v * m) % 4294967296, ((v * m) % 4294967296) >> s);
+    CREATE OR REPLACE MACRO fmix32(x) AS mix(mix(xor(x, x >> 16), 2246822519::UBIGINT, 13), 3266489917::UBIGINT, 16);
+    CREATE OR REPLACE MACRO u(i, k, seed) AS
+        fmix32((i::UBIGINT * 2654435761 + k::UBIGINT * 1013904223 + seed::UBIGINT * 374761393) % 4294967296)
+            / 4294967296.0;
+"""
+
+
+# "100k" / "1M" / "2.5M" / "100000" -> rows
+def parse_scale(scale):
+    text = str(scale).strip().lower().replace("_", "")
+    multiplier = {"k": 1_000, "m": 1_000_000, "b": 1_000_000_000}.get(text[-1:], 1)
+    number = text[:-1] if text[-1:] in ("k", "m", "b") else text
+    return int(float(number) * multiplier)
+
+
+def tripdata_name(color, year, month):
+    return f"{color}_tripdata_{year}-{month:02d}.parquet"
+
+
+# (color, year, month) -> trips before duplicates for that file, adding up to roughly rows overall
+def month_row_counts(rows, years):
+    months = [(year, month) for year in years for month in range(1, 13)]
+    counts = {}
+    for color, share in (("yellow", YELLOW_SHARE), ("green", 1.0 - YELLOW_SHARE)):
+        # rows includes the duplicate copies, so generate a little fewer distinct trips
+        color_rows = rows * share / (1.0 + 1.0 / DUPLICATE_EVERY)
+        per_month = int(color_rows // len(months))
+        extra = int(round(color_rows)) - per_month * len(months)
+        for i, (year, month) in enumerate(months):
+            counts[(color, year, month)] = per_month + (1 if i < extra else 0)
+    return counts
+
+
+# SELECT for one color-month of trips: n trips starting at trip number offset (so every file draws different trips)
+def month_select_sql(color, year, month, n, offset, seed):
+    prefix = TIMESTAMP_PREFIX[color]
+    dirty = {name: f"(kind >= {lo} AND kind < {hi})" for name, (lo, hi) in DIRTY_ROWS.items()}
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    fields = {
+        "VendorID": "(1 + floor(u(i, 1, {seed}) * 2))::INTEGER",
+        f"{prefix}_pickup_datetime": "pickup",
+        f"{prefix}_dropoff_datetime": f"""CASE
+                WHEN {dirty['over_24_hours']} THEN pickup + to_minutes((1441 + floor(u(i, 2, {{seed}}) * 2880))::BIGINT)
+                ELSE pickup + to_seconds((120 + trip_distance / mph * 3600)::BIGINT)
+            END""",
+        "passenger_count": f"""CASE
+                WHEN {dirty['zero_passengers']} THEN 0
+                WHEN {dirty['null_passengers']} THEN NULL
+                ELSE 1 + floor(pow(u(i, 3, {{seed}}), 3) * 6)
+            END::BIGINT""",
+        "trip_distance": "trip_distance",
+        "RatecodeID": "CASE WHEN u(i, 4, {seed}) < 0.95 THEN 1 ELSE 2 END::BIGINT",
+        "store_and_fwd_flag": "CASE WHEN u(i, 5, {seed}) < 0.995 THEN 'N' ELSE 'Y' END",
+        "PULocationID": "(1 + floor(u(i, 6, {seed}) * 265))::INTEGER",
+        "DOLocationID": "(1 + floor(u(i, 7, {seed}) * 265))::INTEGER",
+        "payment_type": "CASE WHEN u(i, 8, {seed}) < 0.75 THEN 1 ELSE 2 END::BIGINT",
+        "fare_amount": "fare",
+        "extra": "CASE WHEN hour(pickup) >= 20 OR hour(pickup) < 6 THEN 1.0 ELSE 0.0 END",
+        "mta_tax": "0.5",
+        "tip_amount": "round(fare * 0.2 * u(i, 9, {seed}), 2)",
+        "tolls_amount": "CASE WHEN trip_distance > 15 THEN 6.94 ELSE 0.0 END",
+        "improvement_surcharge": "1.0",
+        "total_amount": "round(fare + 1.5 + fare * 0.1, 2)",
+        "congestion_surcharge": "2.5",
+        "Airport_fee": "CASE WHEN trip_distance > 15 THEN 1.75 ELSE 0.0 END",
+        "ehail_fee": "NULL",
+        "trip_type": "1",
+    }
+    select_list = ",\n            ".join(
+        f"CAST({fields[name].format(seed=seed)} AS {data_type}) AS {name}" for name, data_type in COLUMNS[color]
+    )
+
+    return f"""
+        WITH draws AS (
+            SELECT
+                range + {offset} AS i,
+                u(range + {offset}, 0, {seed}) AS kind,
+                TIMESTAMP '{year}-{month:02d}-01'
+                    + to_seconds(floor(u(range + {offset}, 10, {seed})
+                        * date_diff('second', TIMESTAMP '{year}-{month:02d}-01', TIMESTAMP '{next_year}-{next_month:02d}-01'))::BIGINT)
+                    AS pickup,
+                6 + u(range + {offset}, 11, {seed}) * 24 AS mph
+            FROM range({n})
+        ),
+        trips AS (
+            SELECT
+                *,
+                CASE
+                    WHEN {dirty['zero_miles']} THEN 0.0
+                    WHEN {dirty['over_100_miles']} THEN round(100.5 + u(i, 12, {seed}) * 500, 2)
+                    ELSE round(0.3 + pow(u(i, 12, {seed}), 3) * 30, 2)
+                END AS trip_distance
+            FROM draws
+        ),
+        priced AS (
+            SELECT *, round(3.0 + trip_distance * 2.5, 2) AS fare FROM trips
+        ),
+        rows_out AS (
+            SELECT
+            {select_list}
+            , i
+            FROM priced
+        )
+        SELECT * EXCLUDE (i) FROM rows_out
+        UNION ALL
+        SELECT * EXCLUDE (i) FROM rows_out WHERE i % {DUPLICATE_EVERY} = 0
+    """
+
+
+# write every color-month file for rows/years/seed into out_dir (default data/<rows>_<seed>) and a manifest.json
+# next to them - a directory whose manifest already matches is left alone. returns (out_dir, manifest)
+def generate(rows, years=DEFAULT_YEARS, seed=DEFAULT_SEED, out_dir=None, threads=None):
+    years = [int(y) for y in years]
+    out_dir = Path(out_dir or DATA_DIR / f"{rows}_{seed}")
+    manifest_path = out_dir / "manifest.json"
+    params = {"rows": rows, "years": years, "seed": seed, "duplicate_every": DUPLICATE_EVERY,
+              "dirty_rows": DIRTY_ROWS, "yellow_share": YELLOW_SHARE}
+
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("params") == json.loads(json.dumps(params)):
+            logger.info(f"synthetic trips for {rows} rows already in {out_dir}")
+            return out_dir, manifest
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    con = duckdb.connect(config={"threads": threads} if threads else {})
+    started = time.perf_counter()
+    files = {}
+
+    try:
+        con.execute(HASH_MACROS)
+        offset = 0
+        for (color, year, month), n in month_row_counts(rows, years).items():
+            name = tripdata_name(color, year, month)
+            tmp_path = out_dir / f"{name}.tmp"
+            written = con.execute(f"""
+                COPY ({month_select_sql(color, year, month, n, offset, seed)})
+                TO '{tmp_path}' (FORMAT parquet, COMPRESSION zstd);
+            """).fetchone()[0]
+            tmp_path.replace(out_dir / name)
+            files[name] = written
+            offset += n
+            logger.info(f"wrote {written} synthetic trips to {name}")
+
+    finally:
+        con.close()
+
+    manifest = {
+        "params": params,
+        "files": files,
+        "total_rows": sum(files.values()),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    return out_dir, manifest
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="write synthetic TLC yellow/green trip parquet files")
+    parser.add_argument("rows", help="total trips incl. dirty rows and duplicates, e.g. 100k, 1M, 100M")
+    parser.add_argument("--years", type=int, nargs="+", default=list(DEFAULT_YEARS))
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--out-dir", default=None)
+    args = parser.parse_args()
+
+    out_dir, manifest = generate(parse_scale(args.rows), args.years, args.seed, args.out_dir)
+    print(f"{manifest['total_rows']} trips in {len(manifest['files'])} files under {out_dir}")
@@ -0,0 +1,289 @@
+import argparse
+import json
+import logging
+import math
+import sys
+from pathlib import Path
+
+import duckdb
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+# benchmark history - every run.py result recorded in a local duckdb file, one row per (run, scale, repeat, step),
+# keyed by commit and scale, and a regression gate comparing two commits:
+#   python benchmarks/history.py record benchmarks/results/*.json
+#   python benchmarks/history.py compare --baseline <commit> --candidate <commit>   (exit 1 on a regression)
+HISTORY_DB = Path(__file__).resolve().parent / "history.duckdb"
+TABLE = "benchmark_history"
+# a step is a regression when it got slower by more than THRESHOLD and Welch's t-test says that's not noise
+ALPHA = 0.05
+THRESHOLD = 0.05
+METRICS = ("seconds", "peak_rss_bytes")
+# peak_rss_bytes is only compared for runs that measured each step's own peak ("step") - older results files
+# recorded the process's peak so far ("process"), which after the heaviest step says nothing about the step itself
+COMPARABLE_RSS_SCOPE = "step"
+# per-stage rows added next to the steps: total seconds and the highest peak memory of the stage
+STAGE_TOTAL = "(stage total)"
+
+
+def connect(db_path=None):
+    con = duckdb.connect(str(db_path or HISTORY_DB))
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABLE} (
+            run_id          VARCHAR,
+            created_at_utc  TIMESTAMP,
+            commit          VARCHAR,
+            scale           VARCHAR,
+            rows            BIGINT,
+            repeat          INTEGER,
+            stage           VARCHAR,
+            step            VARCHAR,
+            seconds         DOUBLE,
+            peak_rss_bytes  BIGINT,
+            error           VARCHAR,
+            python          VARCHAR,
+            duckdb          VARCHAR,
+            platform        VARCHAR,
+            peak_rss_scope  VARCHAR,
+            PRIMARY KEY (run_id, scale, repeat, stage, step)
+        );
+    """)
+    # histories recorded before peak_rss_scope existed - their rows stay NULL, i.e. not comparable
+    con.execute(f"ALTER TABLE {TABLE} ADD COLUMN IF NOT EXISTS peak_rss_scope VARCHAR")
+    return con
+
+
+# the commit a result is filed under - a dirty tree gets its own key so it never mixes with the clean commit's runs
+def commit_key(git):
+    commit = git.get("commit") or "nogit"
+    return f"{commit}-dirty" if git.get("dirty") else commit
+
+
+# rows for one run.py results file, step rows plus one stage total per (scale, repeat, stage)
+def result_rows(results):
+    run_id = f"{results['created_at_utc']}_{results['git'].get('commit')}"
+    env = results.get("environment", {})
+    common = (run_id, results["created_at_utc"], commit_key(results["git"]))
+
+    rows = []
+    for run in results["runs"]:
+        stages = {}
+        for t in run["timings"]:
+            rows.append((*common, run["scale"], run["rows"], run["repeat"], t["stage"], t["step"],
+                         t["seconds"], t.get("peak_rss_bytes"), t.get("error")))
+            total = stages.setdefault(t["stage"], {"seconds": 0.0, "peak_rss_bytes": None, "error": None})
+            total["seconds"] += t["seconds"]
+            if t.get("peak_rss_bytes") is not None:
+                total["peak_rss_bytes"] = max(total["peak_rss_bytes"] or 0, t["peak_rss_bytes"])
+            total["error"] = total["error"] or t.get("error")
+        for stage, total in stages.items():
+            rows.append((*common, run["scale"], run["rows"], run["repeat"], stage, STAGE_TOTAL,
+                         round(total["seconds"], 6), total["peak_rss_bytes"], total["error"]))
+
+    rss_scope = results.get("peak_rss_scope", "process")
+    return [(*row, env.get("python"), env.get("duckdb"), env.get("platform"), rss_scope) for row in rows]
+
+
+# add results files to the history (recording the same file twice just replaces its rows)
+def record(paths, db_path=None):
+    con = connect(db_path)
+    try:
+        recorded = 0
+        for path in paths:
+            with open(path) as f:
+                rows = result_rows(json.load(f))
+            con.executemany(f"INSERT OR REPLACE INTO {TABLE} VALUES ({', '.join(['?'] * 15)})", rows)
+            recorded += len(rows)
+            logger.info(f"recorded {len(rows)} timings from {path}")
+        return recorded
+    finally:
+        con.close()
+
+
+# ---- Welch's t-test, without scipy ----
+
+# regularized incomplete beta I_x(a, b), continued fraction (Numerical Recipes' betacf)
+def incomplete_beta(x, a, b):
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1.0 - x))
+    if x >= (a + 1.0) / (a + b + 2.0):
+        return 1.0 - incomplete_beta(1.0 - x, b, a)
+
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    fraction = d
+    for m in range(1, 300):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            fraction *= c * d
+        if abs(c * d - 1.0) < 1e-12:
+            break
+    return front * fraction / a
+
+
+# P(T > t) for Student's t with df degrees of freedom
+def t_survival(t, df):
+    tail = 0.5 * incomplete_beta(df / (df + t * t), df / 2.0, 0.5)
+    return tail if t > 0 else 1.0 - tail
+
+
+def mean_variance(samples):
+    mean = sum(samples) / len(samples)
+    return mean, sum((s - mean) ** 2 for s in samples) / (len(samples) - 1)
+
+
+# one-sided Welch's t-test that candidate's mean is larger than baseline's - (t, df, p), None with < 2 samples a side
+def welch_t_test(baseline, candidate):
+    if len(baseline) < 2 or len(candidate) < 2:
+        return None
+    mean_b, var_b = mean_variance(baseline)
+    mean_c, var_c = mean_variance(candidate)
+    se_b, se_c = var_b / len(baseline), var_c / len(candidate)
+    if se_b + se_c == 0:
+        # no spread at all - any difference is real
+        return (math.inf if mean_c > mean_b else 0.0), math.inf, (0.0 if mean_c > mean_b else 1.0)
+    t = (mean_c - mean_b) / math.sqrt(se_b + se_c)
+    df = (se_b + se_c) ** 2 / ((se_b ** 2 / (len(baseline) - 1) if se_b else 0.0)
+                               + (se_c ** 2 / (len(candidate) - 1) if se_c else 0.0))
+    return t, df, t_survival(t, df)
+
+
+# ---- compare ----
+
+# commits in the history, newest recorded first
+def commits(con):
+    return [row[0] for row in con.execute(f"""
+        SELECT commit FROM {TABLE} GROUP BY commit ORDER BY MAX(created_at_utc) DESC
+    """).fetchall()]
+
+
+# the full key for a (possibly short) commit, or None
+def resolve_commit(con, commit):
+    matches = [c for c in commits(con) if c == commit or c.startswith(commit)]
+    if len(matches) > 1 and commit not in matches:
+        raise ValueError(f"commit {commit} is ambiguous in the history: {matches}")
+    return commit if commit in matches else (matches[0] if matches else None)
+
+
+# {(scale, stage, step): {metric: [samples]}} for one commit (no peak_rss_bytes samples from "process" scope runs)
+def samples(con, commit, scales=None):
+    rows = con.execute(f"""
+        SELECT scale, stage, step, seconds,
+               CASE WHEN peak_rss_scope = ? THEN peak_rss_bytes END AS peak_rss_bytes
+        FROM {TABLE}
+        WHERE commit = ? AND error IS NULL
+    """, [COMPARABLE_RSS_SCOPE, commit]).fetchall()
+
+    out = {}
+    for scale, stage, step, seconds, peak in rows:
+        if scales and scale not in scales:
+            continue
+        entry = out.setdefault((scale, stage, step), {metric: [] for metric in METRICS})
+        entry["seconds"].append(seconds)
+        if peak is not None:
+            entry["peak_rss_bytes"].append(float(peak))
+    return out
+
+
+# every (scale, stage, step, metric) both commits have runs for, with means, change and the test -
+# regression = slower/bigger by more than threshold and p < alpha
+def compare(baseline, candidate=None, scales=None, alpha=ALPHA, threshold=THRESHOLD, metrics=METRICS, db_path=None):
+    con = connect(db_path)
+    try:
+        if candidate is None:
+            candidate = commits(con)[0] if commits(con) else None
+        candidate = resolve_commit(con, candidate) if candidate else None
+        if baseline is None:
+            older = [c for c in commits(con) if c != candidate]
+            baseline = older[0] if older else None
+        else:
+            baseline = resolve_commit(con, baseline)
+        if baseline is None or candidate is None:
+            raise ValueError("need runs for two commits in the history to compare")
+
+        base_samples = samples(con, baseline, scales)
+        cand_samples = samples(con, candidate, scales)
+    finally:
+        con.close()
+
+    rows = []
+    for key in sorted(set(base_samples) & set(cand_samples)):
+        for metric in metrics:
+            base, cand = base_samples[key][metric], cand_samples[key][metric]
+            if not base or not cand:
+                continue
+            base_mean, cand_mean = sum(base) / len(base), sum(cand) / len(cand)
+            change = (cand_mean - base_mean) / base_mean if base_mean else 0.0
+            test = welch_t_test(base, cand)
+            p = test[2] if test else None
+            rows.append({
+                "scale": key[0], "stage": key[1], "step": key[2], "metric": metric,
+                "baseline_mean": base_mean, "candidate_mean": cand_mean, "change": change,
+                "baseline_n": len(base), "candidate_n": len(cand), "p_value": p,
+                "regression": p is not None and p < alpha and change > threshold,
+            })
+
+    return baseline, candidate, rows
+
+
+def format_value(metric, value):
+    return f"{value / 1024 ** 2:.1f}MB" if metric == "peak_rss_bytes" else f"{value:.3f}s"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark history and regression gate")
+    parser.add_argument("--db", default=None, help=f"history database (default {HISTORY_DB.name} next to this file)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="add run.py results files to the history")
+    record_parser.add_argument("results", nargs="+")
+
+    compare_parser = commands.add_parser("compare", help="exit 1 if candidate is significantly slower than baseline")
+    compare_parser.add_argument("--baseline", default=None, help="commit (prefix ok), default the one recorded before candidate")
+    compare_parser.add_argument("--candidate", default=None, help="commit (prefix ok), default the latest recorded")
+    compare_parser.add_argument("--scales", nargs="+", default=None)
+    compare_parser.add_argument("--alpha", type=float, default=ALPHA)
+    compare_parser.add_argument("--threshold", type=float, default=THRESHOLD, help="smallest relative slowdown that counts")
+    compare_parser.add_argument("--metrics", nargs="+", choices=METRICS, default=list(METRICS))
+    args = parser.parse_args()
+
+    if args.command == "record":
+        print(f"recorded {record(args.results, args.db)} rows")
+        sys.exit(0)
+
+    try:
+        baseline, candidate, rows = compare(args.baseline, args.candidate, args.scales, args.alpha,
+                                            args.threshold, args.metrics, args.db)
+    except ValueError as e:
+        sys.exit(f"can't compare: {e}")
+
+    print(f"baseline {baseline[:12]} vs candidate {candidate[:12]} (alpha={args.alpha}, threshold={args.threshold:.0%})")
+    untested = 0
+    for row in rows:
+        if row["p_value"] is None:
+            untested += 1
+        flag = "REGRESSION" if row["regression"] else ""
+        p = f"{row['p_value']:.4f}" if row["p_value"] is not None else "n/a"
+        print(f"{row['scale']:>6} {row['stage'] + '.' + row['step']:<55} {row['metric']:<15}"
+              f"{format_value(row['metric'], row['baseline_mean']):>10} -> "
+              f"{format_value(row['metric'], row['candidate_mean']):>10} {row['change']:>+8.1%}  p={p:<7} {flag}")
+
+    if untested:
+        print(f"\n{untested} comparisons had fewer than 2 runs on a side and weren't tested (run.py --repeat 3)")
+    regressions = [row for row in rows if row["regression"]]
+    if regressions:
+        print(f"\n{len(regressions)} significant regressions")
+        sys.exit(1)
+    print("\nno significant regressions")
@@ -0,0 +1,303 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from generate import DEFAULT_SEED, DEFAULT_YEARS, generate, parse_scale
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+# end to end timing of the pipeline stages on synthetic trips, all offline:
+#   python benchmarks/run.py --scales 100k 1M --repeat 3
+# every (scale, repeat) runs in a fresh worker process with its own temp emissions.duckdb and parquet mirror,
+# load.py reading the generated files through a file:// TLC_BASE_URL. results go to results/<utc time>_<commit>.json
+# (--record also files them in the benchmark history, see history.py). peak_rss_bytes is each step's own peak
+# (see profiling.StepMemory), not the process's peak so far
+BENCH_DIR = Path(__file__).resolve().parent
+PROJECT_DIR = BENCH_DIR.parent
+RESULTS_DIR = BENCH_DIR / "results"
+DEFAULT_SCALES = ("100k", "1M")
+VEHICLE_EMISSIONS_CSV = PROJECT_DIR / "data" / "vehicle_emissions.csv"
+
+
+# commit the benchmarked code is at, and whether the tree had uncommitted changes
+def git_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=PROJECT_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=PROJECT_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        return {"commit": commit, "dirty": bool(status)}
+    except Exception as e:
+        logger.warning(f"couldn't read git commit: {e}")
+        return {"commit": None, "dirty": None}
+
+
+def environment():
+    import duckdb
+
+    return {
+        "python": platform.python_version(),
+        "duckdb": duckdb.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "duckdb_settings": {name: os.environ[name] for name in ("DUCKDB_THREADS", "DUCKDB_MEMORY_LIMIT")
+                            if os.environ.get(name)},
+    }
+
+
+# ---- worker: runs inside the temp directory with EMISSIONS_DB / TLC_BASE_URL already pointing there ----
+
+# run one step, recording wall time and the step's own peak memory (stage functions log their own errors)
+def timed(timings, stage, step, func, *args, **kwargs):
+    import profiling
+
+    memory = profiling.StepMemory()
+    started = time.perf_counter()
+    error = None
+    value = None
+    try:
+        value = func(*args, **kwargs)
+    except Exception as e:
+        error = repr(e)
+        logger.warning(f"{stage}.{step} failed: {e}")
+    seconds = round(time.perf_counter() - started, 6)
+    timings.append({
+        "stage": stage,
+        "step": step,
+        "seconds": seconds,
+        "peak_rss_bytes": memory.stop(),
+        "error": error,
+    })
+    logger.info(f"{stage}.{step}: {seconds:.3f}s")
+    return value
+
+
+# rows in each of the tables after a stage - shows the dirty rows went where they should
+def row_counts(tables):
+    import session
+
+    counts = {}
+    con = session.cursor(read_only=True)
+    try:
+        for table in tables:
+            try:
+                counts[table] = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            except Exception:
+                counts[table] = None
+    finally:
+        con.close()
+    return counts
+
+
+# copy every loaded trip table aside (or, restore=True, put the copies back) so the step by step clean and the fused
+# one both start from the same loaded tables
+def snapshot_trip_tables(tables, restore=False):
+    import load
+    import session
+
+    con = session.cursor()
+    try:
+        for table in tables:
+            copy = f"{table}_bench_loaded"
+            if restore:
+                if load.table_exists(con, copy):
+                    con.execute(f"DROP TABLE IF EXISTS {table}")
+                    con.execute(f"ALTER TABLE {copy} RENAME TO {table}")
+            elif load.table_exists(con, table):
+                con.execute(f"CREATE OR REPLACE TABLE {copy} AS SELECT * FROM {table}")
+    finally:
+        con.close()
+
+
+# clean.py's step by step path (what clean.py runs with fused = False), one timed step per function -
+# drop_columns_*/remove_duplicates_yellow_green are what get_yellow_green_tables runs per table
+def clean_stepwise(timings, years):
+    import clean
+    import session
+
+    con = session.cursor()
+    try:
+        kept = []
+        for color, drop_columns in (("yellow", clean.drop_columns_yellow), ("green", clean.drop_columns_green)):
+            kept += timed(timings, "clean_stepwise", f"drop_columns_{color}",
+                          lambda: [t for t in (drop_columns(con, f"{color}_{year}") for year in years) if t]) or []
+        tables = timed(timings, "clean_stepwise", "remove_duplicates_yellow_green",
+                       lambda: [t for t in (clean.remove_duplicates_yellow_green(con, table) for table in kept) if t]) or []
+    finally:
+        con.close()
+
+    for func in (clean.zero_passengers_removed, clean.zero_miles_removed, clean.more_100mi_removed, clean.more_24hr_removed):
+        timed(timings, "clean_stepwise", func.__name__, func, tables)
+    return tables
+
+
+def run_worker(years, workdir):
+    # the stage modules read EMISSIONS_DB etc. when imported, so only now
+    sys.path.insert(0, str(PROJECT_DIR))
+    import analysis
+    import clean
+    import load
+    import transform
+    from mirror import ParquetMirror
+
+    # only the years given were generated - a gap between them has no trip tables to stage
+    generated_years = sorted(set(years))
+    years = range(min(years), max(years) + 1)
+    trip_tables = [f"{color}_{year}" for color in load.COLORS for year in years]
+    timings = []
+    counts = {}
+
+    mirror = ParquetMirror(root=Path(workdir) / "parquet_mirror")
+    timed(timings, "load", "load_parquet_files", load.load_parquet_files, years, mirror=mirror, politeness=0)
+    timed(timings, "load", "load_vehicle_emissions_csv", load.load_vehicle_emissions_csv, str(VEHICLE_EMISSIONS_CSV))
+    counts["load"] = row_counts(trip_tables)
+
+    # the step by step clean on a copy of the loaded tables first, then the fused one on the originals
+    snapshot_trip_tables(trip_tables)
+    clean_stepwise(timings, years)
+    counts["clean_stepwise"] = row_counts(trip_tables)
+    snapshot_trip_tables(trip_tables, restore=True)
+
+    tables = timed(timings, "clean", "clean_yellow_green_fused", clean.clean_yellow_green_fused, years) or []
+    timed(timings, "clean", "remove_duplicates_vehicle_emissions", clean.remove_duplicates_vehicle_emissions)
+    timed(timings, "clean", "tests", clean.tests, tables)
+    counts["clean"] = row_counts(trip_tables)
+
+    # the staging models only cover the generated years
+    dbt_vars = {"trip_years": generated_years}
+    timed(timings, "transform", "run_dbt", transform.run_dbt, dbt_vars=dbt_vars)
+    counts["transform"] = row_counts(["data_transformation", "co2_rollup", "top_co2_trips"])
+
+    # each heavy/light function without breakdowns= runs its own scan, as they would called on their own
+    for color in ("yellow", "green"):
+        timed(timings, "analysis", f"top_carbon_trips_{color}", analysis.top_carbon_trips, color, 10, years)
+        timed(timings, "analysis", f"single_largest_carbon_trip_year_{color}",
+              analysis.single_largest_carbon_trip_year, color, years)
+    timed(timings, "analysis", "co2_breakdowns", analysis.co2_breakdowns, years)
+    for name in ("carbon_heavy_light_hour", "carbon_heavy_light_DOW", "carbon_heavy_light_week",
+                 "carbon_heavy_light_month", "plot_co2_month_by_co2totals"):
+        timed(timings, "analysis", name, getattr(analysis, name), years)
+    timed(timings, "analysis", "run_analyses", analysis.run_analyses, years)
+
+    return {"timings": timings, "row_counts": counts}
+
+
+# ---- parent: generate, spawn a worker per (scale, repeat), collect ----
+
+def run_scale(scale, rows, years, seed, repeat, keep=False):
+    data_dir, manifest = generate(rows, years, seed)
+    runs = []
+
+    for i in range(repeat):
+        workdir = Path(tempfile.mkdtemp(prefix=f"emissions_bench_{scale}_"))
+        out_path = workdir / "worker.json"
+        env = dict(os.environ)
+        env.update({
+            "EMISSIONS_DB": str(workdir / "emissions.duckdb"),
+            "TLC_BASE_URL": data_dir.resolve().as_uri(),
+            # every repeat has to do the work, not read last run's answers
+            "QUERY_CACHE": "off",
+        })
+
+        logger.info(f"scale {scale} ({manifest['total_rows']} rows) run {i + 1}/{repeat} in {workdir}")
+        started = time.perf_counter()
+        try:
+            subprocess.run([sys.executable, str(Path(__file__).resolve()), "--worker", str(out_path),
+                            "--years", *[str(y) for y in years]], cwd=workdir, env=env, check=True)
+            with open(out_path) as f:
+                result = json.load(f)
+        finally:
+            if not keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        runs.append({
+            "scale": scale,
+            "rows": manifest["total_rows"],
+            "years": list(years),
+            "seed": seed,
+            "repeat": i,
+            "wall_seconds": round(time.perf_counter() - started, 3),
+            **result,
+        })
+
+    return runs
+
+
+def write_results(results, out_path=None):
+    if out_path is None:
+        stamp = results["created_at_utc"][:19].replace(":", "").replace("-", "")
+        commit = (results["git"]["commit"] or "nogit")[:8]
+        out_path = RESULTS_DIR / f"{stamp}_{commit}.json"
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "w") as f:
+        json.dump(results, f, indent=1)
+    return out_path
+
+
+# mean seconds per step and scale over the repeats
+def print_summary(results):
+    totals = {}
+    for run in results["runs"]:
+        for t in run["timings"]:
+            totals.setdefault((t["stage"], t["step"]), {}).setdefault(run["scale"], []).append(t["seconds"])
+
+    scales = list(dict.fromkeys(run["scale"] for run in results["runs"]))
+    print(f"{'step':<55}" + "".join(f"{scale:>12}" for scale in scales))
+    for (stage, step), by_scale in totals.items():
+        cells = "".join(
+            f"{sum(by_scale[s]) / len(by_scale[s]):>12.3f}" if s in by_scale else f"{'-':>12}" for s in scales
+        )
+        print(f"{stage + '.' + step:<55}{cells}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="time load/clean/transform/analysis on synthetic TLC trips")
+    parser.add_argument("--scales", nargs="+", default=list(DEFAULT_SCALES), help="e.g. 100k 1M 10M 100M")
+    parser.add_argument("--years", type=int, nargs="+", default=list(DEFAULT_YEARS))
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per scale (repeats give the history comparison its spread)")
+    parser.add_argument("--out", default=None, help="results file (default results/<utc time>_<commit>.json)")
+    parser.add_argument("--keep", action="store_true", help="keep each run's temp directory (db, logs, plot)")
+    parser.add_argument("--record", action="store_true", help="also add the results to the history (history.py)")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_worker(args.years, os.getcwd())
+        with open(args.worker, "w") as f:
+            json.dump(result, f, indent=1)
+        sys.exit(0)
+
+    results = {
+        "created_at_utc": datetime.now(timezone.utc).isoformat(),
+        "git": git_info(),
+        "environment": environment(),
+        # results files from before StepMemory have no scope and report the process's peak so far
+        "peak_rss_scope": "step",
+        "runs": [],
+    }
+    for scale in args.scales:
+        results["runs"] += run_scale(scale, parse_scale(scale), args.years, args.seed, args.repeat, args.keep)
+
+    out_path = write_results(results, args.out)
+    print_summary(results)
+    print(f"\nresults written to {out_path}")
+
+    if args.record:
+        import history
+
+        history.record([out_path])
+        print(f"recorded in {history.HISTORY_DB}")
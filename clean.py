@@ -1,6 +1,9 @@
-import duckdb
 import logging
 
+import lake
+import session
+from validation import validate_tables
+
 
 logging.basicConfig(
     level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
@@ -9,11 +12,15 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# the four columns each trip table is cut down to (load.INGEST_SCHEMA does this at ingest time by default)
+YELLOW_COLUMNS = ["tpep_pickup_datetime", "tpep_dropoff_datetime", "passenger_count", "trip_distance"]
+GREEN_COLUMNS = ["lpep_pickup_datetime", "lpep_dropoff_datetime", "passenger_count", "trip_distance"]
+
+
 # get yellow green tables for later
 def get_yellow_green_tables(years=(2024, 2025)):    
     tables = []
-    con = duckdb.connect(database='emissions.duckdb', read_only=False)
-    # con = duckdb.connect(database='emissionscopy.duckdb', read_only=False) # testing
+    con = session.cursor()
 
     try:
         for year in years:
@@ -41,10 +48,137 @@ def get_yellow_green_tables(years=(2024, 2025)):
     
 
 
+# fused version of get_yellow_green_tables + the four *_removed passes: one CREATE TABLE AS per table
+# (projection, every row filter and the dedup together) on one connection instead of ~6 rewrites/scans
+def clean_yellow_green_fused(years=(2024, 2025)):
+    tables = []
+    con = session.cursor()
+
+    try:
+        for color, columns in (("yellow", YELLOW_COLUMNS), ("green", GREEN_COLUMNS)):
+            for year in years:
+                table = clean_table_fused(con, f"{color}_{year}", columns)
+                if table:
+                    tables.append(table)
+
+        return tables
+
+    finally:
+        con.close()
+
+
+# helper method - every row filter from the *_removed methods as one WHERE clause (rows to keep)
+def fused_filter_sql(pickup, dropoff):
+    return f"""COALESCE(CAST(passenger_count AS INTEGER), 0) > 0
+                AND COALESCE(CAST(trip_distance AS DOUBLE), 0) > 0.0
+                AND COALESCE(CAST(trip_distance AS DOUBLE), 0) <= 100.0
+                AND NOT (
+                    {pickup} IS NOT NULL AND {dropoff} IS NOT NULL
+                    AND (
+                        date_diff('second', {pickup}, {dropoff}) <= 0
+                        OR date_diff('second', {pickup}, {dropoff}) > {24 * 3600}
+                    )
+                )"""
+
+
+# helper method - same result as drop_columns -> remove_duplicates -> zero passengers -> zero miles
+# -> over 100 miles -> over 24 hours, in a single pass. the filters are row-level so they can run before the DISTINCT
+def clean_table_fused(con, table, columns):
+    temp = f"{table}_clean"
+    pickup, dropoff, _, _ = columns
+
+    try:
+        con.execute("BEGIN TRANSACTION;")
+        con.execute(f"""
+            CREATE OR REPLACE TABLE {temp} AS
+            SELECT DISTINCT
+                {pickup},
+                {dropoff},
+                CAST(passenger_count AS INTEGER) AS passenger_count,
+                CAST(trip_distance  AS DOUBLE) AS trip_distance
+            FROM {table}
+            WHERE {fused_filter_sql(pickup, dropoff)};
+        """)
+        con.execute(f"DROP TABLE {table};")
+        con.execute(f"ALTER TABLE {temp} RENAME TO {table};")
+        con.execute("COMMIT;")
+        print(f"cleaned {table} in one pass")
+        logger.info(f"cleaned {table} in one pass (columns, duplicates, passengers, miles, 24 hours)")
+        return table
+
+    except Exception as e:
+        print(f"Issue cleaning {table} in one pass: {e}")
+        logger.warning(f"Issue cleaning {table} in one pass: {e}")
+
+        try:
+            con.execute("ROLLBACK;")
+        except Exception:
+            pass
+
+        try:
+            con.execute(f"DROP TABLE IF EXISTS {temp};")
+        except Exception:
+            pass
+
+        return None
+
+
+# lake version of the fused clean - reads lake/raw/color=/year=/ and writes lake/clean/color=/year=/month=
+# a trip that shows up in two months of the same year is kept once, under the first month (same as the year table dedup)
+def clean_lake_fused(years=(2024, 2025)):
+    tables = []
+    con = session.cursor()
+
+    try:
+        for color, columns in (("yellow", YELLOW_COLUMNS), ("green", GREEN_COLUMNS)):
+            for year in years:
+                if not lake.has_partitions("raw", color, year):
+                    logger.warning(f"no raw lake partitions for {color} {year}; skipping")
+                    continue
+
+                pickup, dropoff, _, _ = columns
+                try:
+                    row_count = lake.write_year_partitions(con, f"""
+                        SELECT
+                            {pickup},
+                            {dropoff},
+                            CAST(passenger_count AS INTEGER) AS passenger_count,
+                            CAST(trip_distance  AS DOUBLE) AS trip_distance,
+                            MIN(month) AS month
+                        FROM {lake.read_lake_sql("raw", color, year)}
+                        WHERE {fused_filter_sql(pickup, dropoff)}
+                        GROUP BY ALL
+                    """, "clean", color, year)
+                    print(f"cleaned {color} {year} into the lake ({row_count} rows)")
+                    logger.info(f"cleaned {color} {year} into the lake ({row_count} rows)")
+                    tables.append(f"{color}_{year}")
+
+                except Exception as e:
+                    print(f"Issue cleaning {color} {year} into the lake: {e}")
+                    logger.warning(f"Issue cleaning {color} {year} into the lake: {e}")
+
+        lake.register_views(con, "clean", years)
+        return tables
+
+    finally:
+        con.close()
+
+
+# helper method - True if load.py already projected the table down to these columns at ingest
+# (source_month is load's bookkeeping column, remove_duplicates_yellow_green leaves it out)
+def already_projected(con, table, wanted):
+    cols = [r[1] for r in con.execute(f"PRAGMA table_info('{table}')").fetchall()]
+    return bool(cols) and set(cols) - {"source_month"} == set(wanted)
+
+
 # helper method - drop yellow columns
 def drop_columns_yellow(con, table):
     temp = f"{table}_clean"
     try:
+        if already_projected(con, table, YELLOW_COLUMNS):
+            logger.info(f"{table} already projected at ingest, not rewriting columns")
+            return table
+
         # transaction begin/commit documentation: https://duckdb.org/docs/stable/sql/statements/transactions.html
         con.execute("BEGIN TRANSACTION;")
         con.execute(f"""
@@ -80,6 +214,10 @@ def drop_columns_yellow(con, table):
 def drop_columns_green(con, table):
     temp = f"{table}_clean"
     try:
+        if already_projected(con, table, GREEN_COLUMNS):
+            logger.info(f"{table} already projected at ingest, not rewriting columns")
+            return table
+
         con.execute("BEGIN TRANSACTION;")
         con.execute(f"""
             CREATE OR REPLACE TABLE {temp} AS
@@ -118,11 +256,14 @@ def drop_columns_green(con, table):
 def remove_duplicates_yellow_green(con, table):
     temp = f"{table}_rmduplicates"
     try:
+        cols = [r[1] for r in con.execute(f"PRAGMA table_info('{table}')").fetchall()]
+        select_cols = "* EXCLUDE (source_month)" if "source_month" in cols else "*"
+
         con.execute(f"""BEGIN TRANSACTION;""")
         con.execute(f"DROP TABLE IF EXISTS {temp};")
         con.execute(f"""
             CREATE OR REPLACE TABLE {temp} AS
-            SELECT DISTINCT * FROM {table};
+            SELECT DISTINCT {select_cols} FROM {table};
         """)
         con.execute(f"DROP TABLE {table};")
         con.execute(f"ALTER TABLE {temp} RENAME TO {table};")
@@ -152,8 +293,7 @@ def remove_duplicates_vehicle_emissions():
     con = None
 
     try:
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
-        # con = duckdb.connect(database='emissionscopy.duckdb', read_only=False)
+        con = session.cursor()
 
         logger.info("Connected to DuckDB, ready to remove duplicates for vehicle_emissions")
 
@@ -204,8 +344,7 @@ def zero_passengers_removed(tables):
     con = None
 
     try:
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
-        # con = duckdb.connect(database='emissionscopy.duckdb', read_only=False)
+        con = session.cursor()
         logger.info("Connected to DuckDB, ready to remove rides with zero passengers")
 
         # tables = get_yellow_green_tables(years)
@@ -246,8 +385,7 @@ def zero_miles_removed(tables):
     con = None
 
     try:
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
-        # con = duckdb.connect(database='emissionscopy.duckdb', read_only=False)
+        con = session.cursor()
         logger.info("Connected to DuckDB, ready to remove rides with zero miles")
 
         # tables = get_yellow_green_tables(years)
@@ -288,8 +426,7 @@ def more_100mi_removed(tables):
     con = None
 
     try:
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
-        # con = duckdb.connect(database='emissionscopy.duckdb', read_only=False)
+        con = session.cursor()
         logger.info("Connected to DuckDB, ready to remove rides with more than 100 miles")
 
         # tables = get_yellow_green_tables(years)
@@ -341,8 +478,7 @@ def more_24hr_removed(tables):
     con = None
 
     try:
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
-        # con = duckdb.connect(database='emissionscopy.duckdb', read_only=False)
+        con = session.cursor()
         logger.info("Connected to DuckDB, ready to remove rides with more than 24 hours")
 
         # tables = get_yellow_green_tables(years)
@@ -382,156 +518,26 @@ def more_24hr_removed(tables):
             con.close()
 
 
-# testing all methods above
+# testing all methods above - every check runs in one aggregate scan per table, tables in parallel
+# (see validation.py). returns the ValidationReport with per-check counts and scan timings
 def tests(tables):
-    con = None
-    failures = []
-    try:
-        con = duckdb.connect(database='emissions.duckdb', read_only=True)
-        # con = duckdb.connect(database='emissionscopy.duckdb', read_only=False)
-        logger.info("Running tests for above methods...")
-
-        # tables = get_yellow_green_tables(years)
-
-        for table in tables:
-            # 1. test to make sure table does exist
-            try:
-                con.execute(f"SELECT 1 FROM {table} LIMIT 1")
-            except Exception as e:
-                failures.append(f"[{table}] missing or unreadable: {e}")
-                logger.warning(f"{table} is missing or unreadable: {e}")
-                continue
-
-            # 2. test to make sure duplicates were removed
-            total_rows = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
-            distinct_rows = con.execute(f"SELECT COUNT(*) FROM (SELECT DISTINCT * FROM {table})").fetchone()[0]
-            if total_rows != distinct_rows:
-                failures.append(f"[{table}] duplicates remain: total={total_rows}, distinct={distinct_rows}")
-                logger.warning(f"issue arose in {table}, total rows isn't equal to non-duplicated rows !")
-            else:
-                logger.info(f"{table}'s num total rows == num non-duplicated rows !")
-
-
-            # 3. test to make sure there are more than 0 passengers per ride
-            bad_passenger = con.execute(
-                f"SELECT COUNT(*) FROM {table} WHERE passenger_count IS NULL OR passenger_count <= 0"
-            ).fetchone()[0]
-            if bad_passenger > 0:
-                failures.append(f"[{table}] passenger_count <= 0 rows: {bad_passenger}")
-                logger.warning(f"issue arose in {table}, there are at least 1 ride(s) with 0 passengers !")
-            else:
-                logger.info(f"all rides in {table} have at least 1 passenger !")
-
-
-            # 4. test to make sure trip distances are more than 0 AND not greater than 100
-            bad_distance = con.execute(
-                f"SELECT COUNT(*) FROM {table} WHERE trip_distance IS NULL OR trip_distance <= 0 OR trip_distance > 100"
-            ).fetchone()[0]
-            if bad_distance > 0:
-                failures.append(f"[{table}] out-of-bounds trip_distance rows: {bad_distance}")
-                logger.warning(f"issue arose in {table}, there exists at least 1 trip(s) where the ride is either 0 or less, or more than 100 miles !")
-            else:
-                logger.info(f"all rides in {table} are between 1 inclusive and 100 inclusive")
-
-
-            # 5. test to make sure hours calculated from start to drop off aren't 0 or less nor over 24 hrs
-            pickup, dropoff = None, None
-            cols = [row[1] for row in con.execute(f"PRAGMA table_info('{table}')").fetchall()]
-            if "tpep_pickup_datetime" in cols and "tpep_dropoff_datetime" in cols:
-                pickup, dropoff = "tpep_pickup_datetime", "tpep_dropoff_datetime"
-            elif "lpep_pickup_datetime" in cols and "lpep_dropoff_datetime" in cols:
-                pickup, dropoff = "lpep_pickup_datetime", "lpep_dropoff_datetime"
-
-            if pickup and dropoff:
-                dup_groups = con.execute(f"""
-                    SELECT COUNT(*) FROM (
-                        SELECT {pickup}, {dropoff}, passenger_count, trip_distance, COUNT(*) c
-                        FROM {table}
-                        GROUP BY {pickup}, {dropoff}, passenger_count, trip_distance
-                        HAVING COUNT(*) > 1
-                    )
-                """).fetchone()[0]
-                if dup_groups > 0:
-                    failures.append(f"[{table}] duplicate groups by key: {dup_groups}")
-                    logger.warning(f"issue arose in {table}: there exists at least 1 pair of duplicated items in table !")
-                else:
-                    logger.info(f"{table} has no duplicated values")
-
-            if pickup and dropoff:
-                null_ts = con.execute(f"""
-                    SELECT COUNT(*) FROM {table}
-                    WHERE {pickup} IS NULL OR {dropoff} IS NULL
-                """).fetchone()[0]
-                if null_ts:
-                    logger.warning(f"[{table}] rows with NULL {pickup}/{dropoff}: {null_ts}")
-
-                bad_time = con.execute(f"""
-                    SELECT COUNT(*)
-                    FROM {table}
-                    WHERE {pickup} IS NOT NULL
-                        AND {dropoff} IS NOT NULL
-                        AND (
-                            date_diff('second', {pickup}, {dropoff}) <= 0
-                            OR date_diff('second', {pickup}, {dropoff}) > {24*3600}
-                    )
-                """).fetchone()[0]
+    logger.info("Running tests for above methods...")
+    report = validate_tables(tables)
 
-                if bad_time > 0:
-                    failures.append(f"[{table}] out-of-bounds duration rows: {bad_time}")
-                    logger.warning(f"issue arose in {table}, there exists at least 1 trip(s) where the ride is either 0 or less hours, or more than 24 hrs !")
-                else:
-                    logger.info(f"all trips in {table} are either between 1 inclusive to 24 hours inclusive")
+    failures = report.failures()
 
-        # 6. testing vehicle_emissions table - smaller than other yellow green ones
-        table = "vehicle_emissions"
-        try:
-            con.execute(f"SELECT 1 FROM {table} LIMIT 1")
-            total_rows = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
-            distinct_rows = con.execute(f"SELECT COUNT(*) FROM (SELECT DISTINCT * FROM {table})").fetchone()[0]
-            if total_rows != distinct_rows:
-                failures.append(f"[{table}] duplicates remain: total={total_rows}, distinct={distinct_rows}")
-                logger.warning(f"issue arose: {table} has duplicates !")
-            else:
-                logger.info(f"{table} has no duplicates")
-
-            neg_co2 = con.execute(
-                f"SELECT COUNT(*) FROM {table} WHERE co2_grams_per_mile < 0"
-            ).fetchone()[0]
-            if neg_co2 > 0:
-                failures.append(f"[{table}] negative co2_grams_per_mile rows: {neg_co2}")
-                logger.warning(f"issue arose: {table} has negative co2_grams_per_mile !")
-            else: 
-                logger.info(f"{table} has no negative co2_grams_per_mile values")
-
-            unreasonable_years = con.execute(f"""
-                SELECT COUNT(*) FROM {table}
-                WHERE vehicle_year_avg IS NULL OR vehicle_year_avg < 1980 OR vehicle_year_avg > 2035
-            """).fetchone()[0]
-            if unreasonable_years > 0:
-                failures.append(f"[{table}] out-of-range/NULL vehicle_year_avg rows: {unreasonable_years}")
-                logger.warning(f"{table} has years less than 1980 or greater than 2035 !")
-            else:
-                logger.info(f"{table} has no years outside the range of 1980 to 2035")
-
-            logger.info(f"[{table}] tested OK")
-
-        except Exception as e:
-            failures.append(f"[{table}] missing or unreadable: {e}")
-            logger.warning(f"{table} is missing or unreadable")
-
-        # Final results print of all tests pass, or some fail :(
-        if failures:
-            print(f"tests have FAILED for {len(failures)} test cases in clean")
-            for f in failures:
-                print(" -", f)
-            logger.warning(f"tests have FAILED for all methods in clean with {len(failures)} failed tests ")
-        else:
-            print("tests have passed for all methods in clean")
-            logger.info("tests have passed for all methods in clean - nothing in list 'failures'")
+    # Final results print of all tests pass, or some fail :(
+    if failures:
+        print(f"tests have FAILED for {len(failures)} test cases in clean")
+        for f in failures:
+            print(" -", f)
+        logger.warning(f"tests have FAILED for all methods in clean with {len(failures)} failed tests ")
+    else:
+        print("tests have passed for all methods in clean")
+        logger.info("tests have passed for all methods in clean - nothing in list 'failures'")
 
-    finally:
-        if con:
-            con.close()
+    logger.info(f"validation took {report.total_seconds:.2f}s for {len(report.tables)} tables")
+    return report
 
 
 
@@ -540,22 +546,39 @@ if __name__ == "__main__":
     # get tables for later methods:
     years = range(2015, 2025) 
     # years = range(2023, 2025) # testing
-    tables = get_yellow_green_tables(years)
 
-    # remove duplicates vehicle_emissions (yellow green is in get_yellow_green_tables)
-    remove_duplicates_vehicle_emissions()
+    # fused = one pass per table, same results as the step by step methods below
+    fused = True
+    # store = "lake" if load.py wrote the trips to the partitioned parquet lake instead of year tables
+    store = "duckdb"
+
+    if store == "lake":
+        tables = clean_lake_fused(years)
+        remove_duplicates_vehicle_emissions()
+
+    elif fused:
+        tables = clean_yellow_green_fused(years)
+
+        # remove duplicates vehicle_emissions
+        remove_duplicates_vehicle_emissions()
+
+    else:
+        tables = get_yellow_green_tables(years)
+
+        # remove duplicates vehicle_emissions (yellow green is in get_yellow_green_tables)
+        remove_duplicates_vehicle_emissions()
 
-    # remove trips with 0 passengers
-    zero_passengers_removed(tables)
+        # remove trips with 0 passengers
+        zero_passengers_removed(tables)
 
-    # remove trips 0 miles in length
-    zero_miles_removed(tables)
+        # remove trips 0 miles in length
+        zero_miles_removed(tables)
 
-    # remove trips greater than 100 miles in length
-    more_100mi_removed(tables)
+        # remove trips greater than 100 miles in length
+        more_100mi_removed(tables)
 
-    # remove trips greater than 24 hours in length
-    more_24hr_removed(tables)
+        # remove trips greater than 24 hours in length
+        more_24hr_removed(tables)
 
     # include tests - all methods above !
     tests(tables)
\ No newline at end of file
@@ -0,0 +1,53 @@
+import numpy as np
+
+
+# columnar results for analysis.py - query results as numpy arrays straight off duckdb's column vectors
+# (no python tuple per row), and the min/max/gap-filling the reports need done on whole arrays.
+# stays cheap whether a series is 12 months or hundreds of thousands of hours
+
+
+# {column: numpy array} for a query. a column with NULLs comes back as a numpy masked array (mask = NULL)
+def fetch_columns(con, sql, params=None):
+    return con.execute(sql, params or []).fetchnumpy()
+
+
+# plain array with NULLs swapped for fill - for columns that are only NULL on rows a mask drops anyway
+def filled(column, fill):
+    return np.ma.filled(column, fill) if np.ma.isMaskedArray(column) else np.asarray(column)
+
+
+# numpy scalar -> python int/float/str, so results print and compare the same as fetchall() ones did
+def to_python(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+# (label, value) of the smallest and of the largest value - first one wins a tie, like min()/max() with a key.
+# None when there's nothing to pick from
+def extremes(labels, values):
+    values = np.ma.masked_invalid(np.ma.asarray(values, dtype=float))
+    if values.count() == 0:
+        return None
+    lo = int(values.argmin())
+    hi = int(values.argmax())
+    return (
+        (to_python(labels[lo]), to_python(values.data[lo])),
+        (to_python(labels[hi]), to_python(values.data[hi])),
+    )
+
+
+# values scattered onto a dense grid of size points by position, fill where nothing landed
+# (positions outside the grid are dropped)
+def fill_grid(positions, values, size, fill=0.0):
+    positions = filled(positions, -1).astype(np.int64)
+    values = filled(values, fill).astype(float)
+    grid = np.full(size, fill, dtype=float)
+    keep = (positions >= 0) & (positions < size)
+    grid[positions[keep]] = values[keep]
+    return grid
+
+
+# one point per month from January start_year up to (not including) end_year, months with no trips at 0
+def month_grid(years, months, values, start_year, end_year, fill=0.0):
+    # masked arithmetic keeps a NULL year/month masked, fill_grid then drops it
+    positions = (np.ma.asarray(years, dtype=np.int64) - start_year) * 12 + (np.ma.asarray(months, dtype=np.int64) - 1)
+    return fill_grid(positions, values, (end_year - start_year) * 12, fill)
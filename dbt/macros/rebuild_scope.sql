@@ -0,0 +1,55 @@
+-- partitions to rebuild on an incremental run, e.g. --vars '{rebuild_years: [2024], rebuild_months: [3]}'
+-- (rebuild_colors: [yellow] narrows it to one taxi color). unset = everything
+{% macro rebuild_scope(name) %}
+    {%- set value = var(name, none) -%}
+    {%- if value is none or value is sequence and value is not string -%}
+        {{ return(value) }}
+    {%- else -%}
+        {{ return([value]) }}
+    {%- endif -%}
+{% endmacro %}
+
+
+-- WHERE clause keeping only the rows whose (year, month) of pickup_ts are in the rebuild scope,
+-- plus the taxi color when a vehicle_type column is given (models past staging).
+-- by_month=false widens a month rebuild to its whole year, for models keyed on (vehicle_type, trip_year)
+{% macro rebuild_scope_filter(ts_column, vehicle_type_column=none, by_month=true) %}
+    {%- set years = rebuild_scope('rebuild_years') -%}
+    {%- set months = rebuild_scope('rebuild_months') if by_month else none -%}
+    {%- set colors = rebuild_scope('rebuild_colors') if vehicle_type_column else none -%}
+    {%- if years is not none or months is not none or colors is not none -%}
+        WHERE {{ ts_column }} IS NOT NULL
+        {%- if colors is not none %}
+            AND {{ vehicle_type_column }} IN ({% for c in colors %}'{{ c }}_taxi'{{ ", " if not loop.last }}{% endfor %})
+        {%- endif %}
+        {%- if years is not none %}
+            AND EXTRACT(YEAR FROM {{ ts_column }}) IN ({{ years | join(', ') }})
+        {%- endif %}
+        {%- if months is not none %}
+            AND EXTRACT(MONTH FROM {{ ts_column }}) IN ({{ months | join(', ') }})
+        {%- endif %}
+    {%- endif -%}
+{% endmacro %}
+
+
+-- pre-hook for the incremental models: delete every partition in the rebuild scope before the insert.
+-- delete+insert on its own only replaces the partitions that still have rows coming in, so a partition whose
+-- source rows were all removed would otherwise keep its old rows until a --full-refresh.
+-- unscoped incremental runs clear the whole table (everything is in scope); by_month=false clears whole years
+{% macro delete_rebuild_scope(by_month=true) %}
+    {%- if is_incremental() -%}
+        {%- set years = rebuild_scope('rebuild_years') -%}
+        {%- set months = rebuild_scope('rebuild_months') if by_month else none -%}
+        {%- set colors = rebuild_scope('rebuild_colors') -%}
+        DELETE FROM {{ this }} WHERE TRUE
+        {%- if colors is not none %}
+            AND vehicle_type IN ({% for c in colors %}'{{ c }}_taxi'{{ ", " if not loop.last }}{% endfor %})
+        {%- endif %}
+        {%- if years is not none %}
+            AND trip_year IN ({{ years | join(', ') }})
+        {%- endif %}
+        {%- if months is not none %}
+            AND month_of_year IN ({{ months | join(', ') }})
+        {%- endif %}
+    {%- endif -%}
+{% endmacro %}
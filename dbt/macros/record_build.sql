@@ -0,0 +1,19 @@
+-- main.build_info stamps each model and seed with the dbt invocation that last (re)built or (re)loaded it.
+-- query_cache.py fingerprints the database off this table, so a rebuild - or re-seeding dim_day_of_week / dim_month,
+-- whose labels and sort order co2_breakdowns joins in - invalidates cached analysis results
+
+-- on-run-start: created once up front, models run on parallel threads and would race to create it
+{% macro create_build_info() %}
+    CREATE TABLE IF NOT EXISTS main.build_info (
+        relation VARCHAR PRIMARY KEY,
+        invocation_id VARCHAR,
+        built_at_utc TIMESTAMP
+    );
+{% endmacro %}
+
+
+-- post-hook on every model and seed (dbt_project.yml sets it for both)
+{% macro record_build() %}
+    INSERT OR REPLACE INTO main.build_info
+    VALUES ('{{ this.identifier }}', '{{ invocation_id }}', now() AT TIME ZONE 'UTC');
+{% endmacro %}
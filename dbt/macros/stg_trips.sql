@@ -0,0 +1,30 @@
+-- one color-year of trips with the column names/types standardized across yellow and green -
+-- the body of every stg_trips_{color}_{year}.sql (models/staging/trips/, generated_models/staging/trips/)
+{% macro stg_trips(color, year) %}
+    -- standardizing more column names (especially pickup dropoff locations) - yellow && green
+    {%- set prefix = 'tpep' if color == 'yellow' else 'lpep' %}
+    SELECT
+        '{{ color }}_taxi' AS taxi_color,
+        TRY_CAST({{ prefix }}_pickup_datetime AS TIMESTAMP) AS pickup_ts,
+        TRY_CAST({{ prefix }}_dropoff_datetime AS TIMESTAMP) AS dropoff_ts,
+        TRY_CAST(trip_distance   AS DOUBLE) AS trip_distance_mi,
+        TRY_CAST(passenger_count AS INT) AS passenger_count
+    FROM {{ trip_relation(color, year) }}
+{% endmacro %}
+
+
+-- years staged: the trip_years list when it's set (transform.py passes the years that have tables),
+-- else trip_start_year..trip_end_year (both ends included)
+{% macro trip_years() %}
+    {%- set years = var('trip_years', none) -%}
+    {%- if years is not none -%}
+        {{ return(years | map('int') | list) }}
+    {%- endif -%}
+    {{ return(range(var('trip_start_year', 2015), var('trip_end_year', 2024) + 1)) }}
+{% endmacro %}
+
+
+-- a per color-year staging model outside the configured years is disabled rather than failing on a missing table
+{% macro trip_year_enabled(year) %}
+    {{ return(year in trip_years()) }}
+{% endmacro %}
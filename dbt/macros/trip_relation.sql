@@ -0,0 +1,9 @@
+-- where one color-year of cleaned trips lives: the {color}_{year} table in emissions.duckdb (default),
+-- or its color=/year=/month= partitions in the parquet lake when run with --vars '{trip_store: lake}'
+{% macro trip_relation(color, year) %}
+    {%- if var('trip_store', 'duckdb') == 'lake' -%}
+        read_parquet('{{ var("lake_dir", "../lake") }}/clean/color={{ color }}/year={{ year }}/month=*/*.parquet', hive_partitioning=true, union_by_name=true)
+    {%- else -%}
+        main.{{ color }}_{{ year }}
+    {%- endif -%}
+{% endmacro %}
@@ -0,0 +1,63 @@
+-- one row per day: ISO week, weekday name/abbreviation/index, month labels and US federal holiday flags.
+-- data_transformation joins on calendar_date so the date formatting happens once per day instead of once per trip,
+-- and analysis.py takes its weekday/month labels and sort order from here.
+-- labels come from the dim_day_of_week / dim_month seeds. holidays are on their actual date, not the observed weekday
+WITH days AS (
+    SELECT CAST(d AS DATE) AS calendar_date
+    FROM range(
+        DATE '{{ var("calendar_start_date", "2009-01-01") }}',
+        DATE '{{ var("calendar_end_date", "2030-12-31") }}' + INTERVAL 1 DAY,
+        INTERVAL 1 DAY
+    ) AS t(d)
+),
+
+parts AS (
+    SELECT
+        calendar_date,
+        EXTRACT(YEAR FROM calendar_date) AS calendar_year,
+        EXTRACT(MONTH FROM calendar_date) AS month_of_year,
+        EXTRACT(DAY FROM calendar_date) AS day_of_month,
+        CAST(STRFTIME(calendar_date, '%V') AS INT) AS iso_week,
+        STRFTIME(calendar_date, '%A') AS day_of_week
+    FROM days
+),
+
+labelled AS (
+    SELECT
+        parts.*,
+        dow.day_abbrev,
+        dow.day_index,
+        mon.month_abbrev,
+        mon.month_name
+    FROM parts
+    LEFT JOIN {{ ref('dim_day_of_week') }} AS dow USING (day_of_week)
+    LEFT JOIN {{ ref('dim_month') }} AS mon USING (month_of_year)
+)
+
+SELECT
+    calendar_date,
+    calendar_year,
+    month_of_year,
+    month_abbrev,
+    month_name,
+    day_of_month,
+    iso_week,
+    day_of_week,
+    day_abbrev,
+    day_index, -- 0 = Sunday .. 6 = Saturday
+    day_index IN (0, 6) AS is_weekend,
+    CASE
+        WHEN month_of_year = 1 AND day_of_month = 1 THEN 'New Year''s Day'
+        WHEN month_of_year = 1 AND day_abbrev = 'Mon' AND day_of_month BETWEEN 15 AND 21 THEN 'Martin Luther King Jr. Day'
+        WHEN month_of_year = 2 AND day_abbrev = 'Mon' AND day_of_month BETWEEN 15 AND 21 THEN 'Presidents'' Day'
+        WHEN month_of_year = 5 AND day_abbrev = 'Mon' AND day_of_month >= 25 THEN 'Memorial Day'
+        WHEN month_of_year = 6 AND day_of_month = 19 AND calendar_year >= 2021 THEN 'Juneteenth'
+        WHEN month_of_year = 7 AND day_of_month = 4 THEN 'Independence Day'
+        WHEN month_of_year = 9 AND day_abbrev = 'Mon' AND day_of_month <= 7 THEN 'Labor Day'
+        WHEN month_of_year = 10 AND day_abbrev = 'Mon' AND day_of_month BETWEEN 8 AND 14 THEN 'Columbus Day'
+        WHEN month_of_year = 11 AND day_of_month = 11 THEN 'Veterans Day'
+        WHEN month_of_year = 11 AND day_abbrev = 'Thu' AND day_of_month BETWEEN 22 AND 28 THEN 'Thanksgiving'
+        WHEN month_of_year = 12 AND day_of_month = 25 THEN 'Christmas Day'
+    END AS holiday_name,
+    holiday_name IS NOT NULL AS is_holiday
+FROM labelled
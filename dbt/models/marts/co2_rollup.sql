@@ -0,0 +1,28 @@
+-- co2 / distance / duration totals per (vehicle_type, year, month, week, day of week, hour) -
+-- a few thousand rows the analysis.py queries can answer from instead of scanning every trip.
+-- averages come back out as SUM(co2_kgs_sum) / SUM(co2_trip_count)
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key=['vehicle_type', 'trip_year', 'month_of_year'],
+    on_schema_change='fail',
+    pre_hook="{{ delete_rebuild_scope() }}"
+) }}
+
+SELECT
+    vehicle_type,
+    trip_year,
+    month_of_year,
+    week_of_year,
+    day_of_week,
+    hour_of_day,
+    COUNT(*) AS trip_count,
+    COUNT(trip_co2_kgs) AS co2_trip_count,
+    SUM(trip_co2_kgs) AS co2_kgs_sum,
+    SUM(trip_distance_mi) AS distance_mi_sum,
+    SUM(DATE_DIFF('second', pickup_ts, dropoff_ts) / 3600.0) AS duration_hours_sum
+FROM {{ ref('data_transformation') }}
+{% if is_incremental() %}
+{{ rebuild_scope_filter('pickup_ts', 'vehicle_type') }}
+{% endif %}
+GROUP BY ALL
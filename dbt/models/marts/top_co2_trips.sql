@@ -0,0 +1,42 @@
+-- the top_k (default 100) highest co2 trips per (vehicle_type, trip_year), ranked the same way
+-- single_largest_carbon_trip_year always sorted: trip_co2_kgs DESC, trip_distance_mi DESC, dropoff_ts ASC.
+-- analysis.top_carbon_trips() merges these per-year lists for any year range instead of sorting every trip.
+-- a month rebuild re-ranks the whole year it's in (trips leaving that month can let ones from other months back in)
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key=['vehicle_type', 'trip_year'],
+    on_schema_change='fail',
+    pre_hook="{{ delete_rebuild_scope(by_month=false) }}"
+) }}
+
+WITH trips AS (
+    SELECT *
+    FROM {{ ref('data_transformation') }}
+    {% if is_incremental() %}
+    {{ rebuild_scope_filter('pickup_ts', 'vehicle_type', by_month=false) }}
+    {% endif %}
+)
+
+SELECT
+    pickup_ts,
+    dropoff_ts,
+    trip_distance_mi,
+    passenger_count,
+    trip_year,
+    hour_of_day,
+    day_of_week,
+    week_of_year,
+    month_of_year,
+    avg_mph,
+    trip_co2_kgs,
+    vehicle_type,
+    ROW_NUMBER() OVER (
+        PARTITION BY vehicle_type, trip_year
+        ORDER BY trip_co2_kgs DESC, trip_distance_mi DESC, dropoff_ts ASC
+    ) AS co2_rank,
+    -- how deep this list goes, so readers know whether it can answer a top-n
+    {{ var('top_k', 100) }} AS top_k
+FROM trips
+WHERE trip_co2_kgs IS NOT NULL
+QUALIFY co2_rank <= {{ var('top_k', 100) }}
@@ -1,31 +1,14 @@
-{{ config(materialized='table') }}
-
-{% set years = range(2015, 2025) %}
+-- materialization comes from the staging_materialized var (dbt_project.yml) - a view unless you ask for a table.
+-- union of the per color-year staging models (models/staging/trips/, one stg_trips macro behind all of them)
 {% set colors = ['yellow', 'green'] %}
-{% set raw_schema = 'main' %}
 
+-- every color-year, whatever the rebuild_* vars say - data_transformation applies the rebuild scope to what it reads,
+-- so the view (or table) always covers all the staged years
 {% set selects = [] %}
 
 {% for color in colors %}
-    {% for year in years %}
-        {% set table_name = color ~ '_' ~ year %}
-        {% set fqtn = raw_schema ~ '.' ~ table_name %}
-
-        -- standardizing more column names (especially pickup dropoff locations) - yellow && green
-        {% do selects.append(
-            "SELECT
-                '" ~ color ~ "_taxi' AS taxi_color,
-                " ~ (
-                    "TRY_CAST(tpep_pickup_datetime AS TIMESTAMP) AS pickup_ts,
-                    TRY_CAST(tpep_dropoff_datetime AS TIMESTAMP) AS dropoff_ts,"
-                    if color == 'yellow' else
-                    "TRY_CAST(lpep_pickup_datetime AS TIMESTAMP) AS pickup_ts,
-                    TRY_CAST(lpep_dropoff_datetime AS TIMESTAMP) AS dropoff_ts,"
-                ) ~ "
-                TRY_CAST(trip_distance   AS DOUBLE) AS trip_distance_mi,
-                TRY_CAST(passenger_count AS INT) AS passenger_count
-            FROM " ~ fqtn
-        ) %}
+    {% for year in trip_years() %}
+        {% do selects.append("SELECT * FROM " ~ ref('stg_trips_' ~ color ~ '_' ~ year)) %}
     {% endfor %}
 {% endfor %}
 
@@ -34,4 +17,4 @@ WITH yellow_green_stg AS (
   {{ selects | join('\nUNION ALL\n') }}
 )
 
-SELECT * FROM yellow_green_stg
\ No newline at end of file
+SELECT * FROM yellow_green_stg
@@ -0,0 +1,4 @@
+-- green taxi trips for 2021 (written by transform.write_staging_models, body in macros/stg_trips.sql)
+{{ config(enabled=trip_year_enabled(2021)) }}
+
+{{ stg_trips('green', 2021) }}
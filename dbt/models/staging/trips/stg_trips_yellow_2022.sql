@@ -0,0 +1,4 @@
+-- yellow taxi trips for 2022 (written by transform.write_staging_models, body in macros/stg_trips.sql)
+{{ config(enabled=trip_year_enabled(2022)) }}
+
+{{ stg_trips('yellow', 2022) }}
@@ -1,10 +1,26 @@
-{{ config(materialized='table', pre_hook="SET TimeZone='America/New_York';") }}
+-- incremental: a run only replaces the (vehicle_type, trip_year, month_of_year) partitions in the rebuild scope,
+-- so e.g. --vars '{rebuild_years: [2024], rebuild_months: [3]}' rebuilds one month
+-- (first build / --full-refresh should run without rebuild_* vars so every partition is there)
+-- the delete_rebuild_scope pre-hook empties the scoped partitions first, so one whose source rows are all gone is dropped too
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key=['vehicle_type', 'trip_year', 'month_of_year'],
+    on_schema_change='fail',
+    pre_hook=["SET TimeZone='America/New_York';", "{{ delete_rebuild_scope() }}"]
+) }}
 
 
 
 WITH trips AS (
     SELECT *
     FROM {{ ref('stg_aggre_yellow_green') }}
+    -- the scope is applied here, not in staging, so stg_aggre_yellow_green always covers every staged year.
+    -- trips without a pickup time are kept with a NULL (trip_year, month_of_year) - no scope ever matches that key,
+    -- so only an unscoped run (which clears the whole table first) or a --full-refresh rebuilds those rows
+    {% if is_incremental() %}
+    {{ rebuild_scope_filter('pickup_ts', 'taxi_color') }}
+    {% endif %}
 ),
 
 
@@ -30,13 +46,14 @@ mph_calc AS (
 
 
 -- avg_mph, hour_of_day, day_of_week, week_of_year, month_of_year
+-- (weekday name and ISO week come from dim_calendar by pickup date - formatted per trip only for dates outside it)
 time_features AS (
     SELECT
         mph_calc.*, -- mph per trip (above)
         EXTRACT(YEAR FROM pickup_ts) AS trip_year, -- for using year later
         EXTRACT(HOUR FROM pickup_ts) AS hour_of_day, -- calculate trip hour
-        STRFTIME(pickup_ts, '%A')    AS day_of_week, -- calculate trip day of week
-        CAST(STRFTIME(CAST(pickup_ts AS DATE), '%V') AS INT) AS week_of_year, -- calculate week number
+        COALESCE(cal.day_of_week, STRFTIME(pickup_ts, '%A')) AS day_of_week, -- calculate trip day of week
+        COALESCE(cal.iso_week, CAST(STRFTIME(CAST(pickup_ts AS DATE), '%V') AS INT)) AS week_of_year, -- calculate week number
         EXTRACT(MONTH FROM CAST(pickup_ts AS DATE)) AS month_of_year, -- calculate month
         CASE lower(taxi_color)
             WHEN 'yellow_taxi' THEN 'yellow_taxi'
@@ -44,6 +61,8 @@ time_features AS (
             ELSE NULL
         END AS vehicle_type -- use in co2_factors in with_co2_factors
     FROM mph_calc
+    LEFT JOIN {{ ref('dim_calendar') }} AS cal
+        ON cal.calendar_date = CAST(mph_calc.pickup_ts AS DATE)
 ),
 
 
@@ -67,12 +86,24 @@ with_co2_factors AS (
 
 
 -- only want certain columns
+-- (compact_encodings: ENUMs for the two label columns and the smallest ints that fit the time parts - same values,
+-- a fraction of the bytes, and GROUP BYs on them hash fixed-width keys instead of strings)
 SELECT 
     pickup_ts,
     dropoff_ts,
     trip_distance_mi,
     passenger_count,
     
+{%- if var('compact_encodings', false) %}
+    CAST(trip_year AS SMALLINT) AS trip_year,
+    CAST(hour_of_day AS TINYINT) AS hour_of_day,
+    CAST(day_of_week AS ENUM('Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday')) AS day_of_week,
+    CAST(week_of_year AS TINYINT) AS week_of_year,
+    CAST(month_of_year AS TINYINT) AS month_of_year,
+    avg_mph,
+    trip_co2_kgs,
+    CAST(vehicle_type AS ENUM('yellow_taxi', 'green_taxi')) AS vehicle_type
+{%- else %}
     trip_year,
     hour_of_day,
     day_of_week,
@@ -81,5 +112,9 @@ SELECT
     avg_mph,
     trip_co2_kgs,
     vehicle_type
+{%- endif %}
     -- *
-FROM with_co2_factors
\ No newline at end of file
+FROM with_co2_factors
+-- stored clustered by color then pickup time, so the min/max zonemaps on vehicle_type / pickup_ts let a query for one
+-- color and a few years skip every other row group (incremental runs append each rebuilt month the same way)
+ORDER BY vehicle_type, pickup_ts
@@ -0,0 +1,107 @@
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+
+# no basicConfig here - lake messages land in whichever stage log imported it
+logger = logging.getLogger(__name__)
+
+
+# color=/year=/month= partitioned parquet copy of the trips, raw (load.py) and clean (clean.py)
+# - a one month re-run rewrites one file instead of a whole year table in emissions.duckdb
+LAKE_DIR = Path(__file__).resolve().parent / "lake"
+COMPRESSION = "zstd"
+
+
+def partition_dir(stage, color, year=None, month=None, lake_dir=None):
+    path = Path(lake_dir or LAKE_DIR) / stage / f"color={color}"
+    if year is not None:
+        path = path / f"year={year}"
+    if month is not None:
+        path = path / f"month={month}"
+    return path
+
+
+# glob over the lake for read_parquet - leave color/year as '*' to read across partitions
+def lake_glob(stage, color="*", year="*", lake_dir=None):
+    return str(Path(lake_dir or LAKE_DIR) / stage / f"color={color}" / f"year={year}" / "month=*" / "*.parquet")
+
+
+# read_parquet over a glob with the partition columns (color, year, month) exposed so filters on them prune files
+def read_lake_sql(stage, color="*", year="*", lake_dir=None):
+    return f"read_parquet('{lake_glob(stage, color, year, lake_dir)}', hive_partitioning=true, union_by_name=true)"
+
+
+# write one month partition - to a temp file first, then swapped in so readers never see half a file
+def write_month_partition(con, select_sql, stage, color, year, month, lake_dir=None):
+    out_dir = partition_dir(stage, color, year, month, lake_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    final_path = out_dir / "data_0.parquet"
+    tmp_path = out_dir / "data_0.parquet.tmp"
+
+    row_count = con.execute(f"""
+        COPY ({select_sql}) TO '{tmp_path}' (FORMAT parquet, COMPRESSION {COMPRESSION});
+    """).fetchone()[0]
+    os.replace(tmp_path, final_path)
+    return row_count
+
+
+# write a whole color-year split into month partitions (select_sql must have a month column),
+# built next to the old year directory and swapped in at the end
+def write_year_partitions(con, select_sql, stage, color, year, lake_dir=None):
+    year_dir = partition_dir(stage, color, year, lake_dir=lake_dir)
+    lake_root = Path(lake_dir or LAKE_DIR)
+    lake_root.mkdir(parents=True, exist_ok=True)
+    # staged in a temp directory next to the stages (not under stage/) so a year=* glob never picks up a half
+    # written directory - removed whole afterwards, whether the copy made it into place or not
+    staging_dir = Path(tempfile.mkdtemp(prefix=f"_tmp_{stage}_{color}_{year}_", dir=lake_root))
+    tmp_dir = staging_dir / "year"
+
+    try:
+        row_count = con.execute(f"""
+            COPY ({select_sql}) TO '{tmp_dir}' (FORMAT parquet, PARTITION_BY (month), COMPRESSION {COMPRESSION});
+        """).fetchone()[0]
+
+        if year_dir.exists():
+            shutil.rmtree(year_dir)
+        year_dir.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_dir, year_dir)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return row_count
+
+
+def has_partitions(stage, color, year, lake_dir=None):
+    year_dir = partition_dir(stage, color, year, lake_dir=lake_dir)
+    return year_dir.exists() and any(year_dir.glob("month=*/*.parquet"))
+
+
+# point the usual {color}_{year} names in emissions.duckdb at the lake so clean tests, dbt and
+# basic_data_summarizations keep working - a real table with that name gets replaced by the view
+def register_views(con, stage, years, colors=("yellow", "green"), lake_dir=None):
+    views = []
+    for color in colors:
+        for year in years:
+            name = f"{color}_{year}"
+            if not has_partitions(stage, color, year, lake_dir):
+                continue
+
+            table_type = con.execute("""
+                SELECT table_type FROM information_schema.tables
+                WHERE table_schema = 'main' AND table_name = ?
+            """, [name]).fetchone()
+            if table_type and table_type[0] == "BASE TABLE":
+                con.execute(f"DROP TABLE {name};")
+                logger.info(f"dropped table {name}, trips for it now live in the {stage} lake")
+
+            con.execute(f"""
+                CREATE OR REPLACE VIEW {name} AS
+                SELECT * EXCLUDE (color, year, month)
+                FROM {read_lake_sql(stage, color, year, lake_dir)};
+            """)
+            views.append(name)
+
+    logger.info(f"registered {len(views)} views over the {stage} lake")
+    return views
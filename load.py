@@ -1,7 +1,15 @@
-import duckdb
 import os
+import hashlib
+import json
 import logging
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import lake
+import profiling
+import session
+from mirror import ParquetMirror
 
 
 logging.basicConfig(
@@ -11,76 +19,71 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# TLC_BASE_URL=file:///some/dir reads {color}_tripdata_{year}-{month}.parquet from a local directory instead
+# (benchmarks/ points it at synthetic files)
+TLC_BASE_URL = os.environ.get("TLC_BASE_URL", "https://d37ci6vzurychx.cloudfront.net/trip-data").rstrip("/")
+COLORS = ["yellow", "green"]
+
+# bounded download pool + minimum seconds between request starts (used to be a flat sleep(45) per month)
+MAX_WORKERS = 4
+POLITENESS_SECONDS = 2.0
+
+MANIFEST_TABLE = "load_manifest"
+
+# only the columns clean/dbt actually use, cast while reading the parquet instead of storing all ~19 TLC columns
+# and having clean.py rewrite them away - set a color to None (or pass ingest_schema=None) to keep SELECT *
+INGEST_SCHEMA = {
+    "yellow": {
+        "tpep_pickup_datetime": "TIMESTAMP",
+        "tpep_dropoff_datetime": "TIMESTAMP",
+        "passenger_count": "INTEGER",
+        "trip_distance": "DOUBLE",
+    },
+    "green": {
+        "lpep_pickup_datetime": "TIMESTAMP",
+        "lpep_dropoff_datetime": "TIMESTAMP",
+        "passenger_count": "INTEGER",
+        "trip_distance": "DOUBLE",
+    },
+}
+
 
 # Loading yellow and green parquet files into emissions db
-def load_parquet_files(years=range(2024, 2025)):
+# concurrent=True downloads months on a bounded thread pool while the main thread inserts them in order,
+# so month N+1 is already downloading while month N is being inserted
+# files come through the local parquet mirror, so unchanged months are read from disk instead of cloudfront
+# (mirror=ParquetMirror(check_ttl=seconds) also skips the HEAD request for files checked that recently - pipeline.py does)
+# every month is recorded in load_manifest - re-runs only load missing, failed or changed months (force=True reloads all)
+# ingest_schema projects + casts columns per color at read time (see INGEST_SCHEMA)
+# store='lake' writes each month to lake/raw/color=/year=/month= parquet instead of the year tables,
+# and registers {color}_{year} views over it so the later stages still find their tables
+def load_parquet_files(years=range(2024, 2025), concurrent=True, max_workers=MAX_WORKERS, politeness=POLITENESS_SECONDS, mirror=None, force=False, ingest_schema=INGEST_SCHEMA, store="duckdb"):
     con = None
+    throttle = RequestThrottle(politeness)
+    if mirror is None:
+        mirror = ParquetMirror()
 
     try:
         # Connect to local DuckDB instance
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
+        con = session.cursor()
         logger.info("Connected to DuckDB instance for yellow green taxi parquets")
-        con.execute("INSTALL httpfs; LOAD httpfs;")
         con.execute("PRAGMA enable_object_cache=true;")
+        create_manifest(con)
 
         # con.execute("CREATE SCHEMA IF NOT EXISTS tlc;")
 
-        # year = "2024"
-        for year in years:
-            # uploading and populating yellow 2024 table from parquet
-            color = "yellow"
-            table_name = f"{color}_{year}"
-            con.execute(f"DROP TABLE IF EXISTS {table_name};")
-            con.execute(f"CREATE TABLE {table_name} AS SELECT * FROM read_parquet('https://d37ci6vzurychx.cloudfront.net/trip-data/{color}_tripdata_{year}-01.parquet', union_by_name=true);")
-            logger.info(f"Dropped if exists and created table {table_name} for month 01 in emissions db")
-
-            for month in range(2,13):
-                input_file = f"https://d37ci6vzurychx.cloudfront.net/trip-data/{color}_tripdata_{year}-{month:02d}.parquet"
-                logger.info(f"working on {input_file} now...")
-                
-                try:
-                    con.execute(f"""
-                        INSERT INTO {table_name}
-                        SELECT * FROM read_parquet('{input_file}', union_by_name=true);
-                    """)
-
-                    logger.info(f"Dropped if exists and created table {table_name} for month {month:02d} in emissions db")
-                    time.sleep(45)
-                except Exception as e:
-                    logger.warning(f"Skipping {input_file} due to error: {e}")
-                    continue
-
-            # table_count =  con.execute(f"SELECT COUNT(*) AS cnt FROM {table_name}").fetchone()[0]
-            # print(f"Count for table {table_name}: {table_count}")
-            # logger.info(f"Count for table {table_name}: {table_count}")
-            
+        # every (year, color, month) in the same order the serial loop used to go through them
+        jobs = [(year, color, month) for year in years for color in COLORS for month in range(1, 13)]
 
-            # uploading and populating green 2024 table from parquet
-            color = "green"
-            table_name = f"{color}_{year}"
-            con.execute(f"DROP TABLE IF EXISTS {table_name};")
-            con.execute(f"CREATE TABLE {table_name} AS SELECT * FROM read_parquet('https://d37ci6vzurychx.cloudfront.net/trip-data/{color}_tripdata_{year}-01.parquet', union_by_name=true);")
-            logger.info(f"Dropped if exists and created table {table_name} for month 01 in emissions db")
-
-
-            for month in range(2,13):
-                input_file = f"https://d37ci6vzurychx.cloudfront.net/trip-data/{color}_tripdata_{year}-{month:02d}.parquet"
-                logger.info(f"working on {input_file} now...")
-                
-                try:
-                    con.execute(f"""
-                        INSERT INTO {table_name}
-                        SELECT * FROM read_parquet('{input_file}', union_by_name=true);
-                    """)
-                    logger.info(f"Dropped if exists and created table {table_name} for month {month:02d} in emissions db")
-                    time.sleep(45)
-                except Exception as e:
-                    logger.warning(f"Skipping {input_file} due to error: {e}")
-                    continue
-
-            # table_count =  con.execute(f"SELECT COUNT(*) AS cnt FROM {table_name}").fetchone()[0]
-            # print(f"Count for table {table_name}: {table_count}")
-            # logger.info(f"Count for table {table_name}: {table_count}")
+        if concurrent:
+            load_months_concurrent(con, jobs, mirror, throttle, max_workers, force, ingest_schema, store)
+        else:
+            load_months_serial(con, jobs, mirror, throttle, force, ingest_schema, store)
+
+        if store == "lake":
+            lake.register_views(con, "raw", years, COLORS)
+
+        summarize_manifest(con, years)
 
         # con.execute("VACUUM;") # had issues with disc space - research said this would help?
         # logger.info("VACUUM completed")
@@ -94,6 +97,288 @@ def load_parquet_files(years=range(2024, 2025)):
             con.close()
 
 
+# one row per (color, year, month) - what was loaded, from which file, and whether it worked
+def create_manifest(con):
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+            color       VARCHAR,
+            year        INTEGER,
+            month       INTEGER,
+            source_url  VARCHAR,
+            fingerprint VARCHAR,
+            row_count   BIGINT,
+            status      VARCHAR,
+            error       VARCHAR,
+            updated_at  TIMESTAMP,
+            PRIMARY KEY (color, year, month)
+        );
+    """)
+
+
+def record_manifest(con, color, year, month, url, fingerprint, row_count, status, error=None):
+    con.execute(f"""
+        INSERT OR REPLACE INTO {MANIFEST_TABLE}
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, now());
+    """, [color, year, month, url, fingerprint, row_count, status, error])
+
+
+# True if the manifest says this month is already in the table from the same source file
+def month_up_to_date(con, color, year, month, fingerprint):
+    row = con.execute(f"""
+        SELECT status, fingerprint FROM {MANIFEST_TABLE}
+        WHERE color = ? AND year = ? AND month = ?
+    """, [color, year, month]).fetchone()
+    return row is not None and row[0] == "loaded" and row[1] == fingerprint
+
+
+def table_columns(con, table_name):
+    return [r[1] for r in con.execute(f"PRAGMA table_info('{table_name}')").fetchall()]
+
+
+def table_exists(con, table_name, table_type=None):
+    return con.execute("""
+        SELECT COUNT(*) FROM information_schema.tables
+        WHERE table_schema = 'main' AND table_name = ? AND table_type = COALESCE(?, table_type)
+    """, [table_name, table_type]).fetchone()[0] > 0
+
+
+# select list for one color - projected and cast if there's an ingest schema for it, otherwise every column
+def ingest_select_list(schema):
+    if not schema:
+        return "*"
+    return ", ".join(f"CAST({col} AS {col_type}) AS {col}" for col, col_type in schema.items())
+
+
+# changing the ingest schema (or where the month is stored) has to reload the months too,
+# so it goes into the fingerprint with the file hash
+def ingest_fingerprint(file_fingerprint, schema, store="duckdb"):
+    if file_fingerprint is None:
+        return None
+    schema_hash = hashlib.sha1(json.dumps(schema, sort_keys=True).encode()).hexdigest()[:8]
+    if store == "lake":
+        return f"{file_fingerprint}:{schema_hash}:lake"
+    return f"{file_fingerprint}:{schema_hash}"
+
+
+# can months be swapped in place - needs source_month, and the same columns the schema would produce
+def table_matches_schema(con, table_name, schema):
+    cols = table_columns(con, table_name)
+    if "source_month" not in cols:
+        return False
+    if schema and set(cols) != set(schema) | {"source_month"}:
+        return False
+    return True
+
+
+# helper method - swap one month of a year table inside a transaction (the caller commits), rows are tagged
+# with source_month so a changed month can be deleted and reloaded without touching the other eleven
+def insert_month(con, table_name, source, month, schema=None):
+    con.execute("BEGIN TRANSACTION;")
+    try:
+        return insert_month_rows(con, table_name, source, month, schema)
+
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+
+
+# the delete + insert of insert_month, in whatever transaction the caller has open
+def insert_month_rows(con, table_name, source, month, schema=None):
+    select_sql = f"SELECT {ingest_select_list(schema)}, {month} AS source_month FROM read_parquet('{source}', union_by_name=true)"
+
+    if table_exists(con, table_name):
+        con.execute(f"DELETE FROM {table_name} WHERE source_month = ?;", [month])
+    else:
+        con.execute(f"CREATE TABLE {table_name} AS {select_sql} LIMIT 0;")
+
+    return con.execute(f"INSERT INTO {table_name} BY NAME {select_sql};").fetchone()[0]
+
+
+# load one fetched month (or skip it if the manifest already has it) - always on the main thread
+def ingest_month(con, year, color, month, local_file, mirror, force, ingest_schema=None, store="duckdb", fetch_error=None):
+    table_name = f"{color}_{year}"
+    input_file = tlc_url(color, year, month)
+    schema = ingest_schema.get(color) if ingest_schema else None
+
+    if fetch_error is not None:
+        record_manifest(con, color, year, month, input_file, None, None, "failed", str(fetch_error))
+        logger.warning(f"Skipping {input_file} due to error: {fetch_error}")
+        return
+
+    fingerprint = ingest_fingerprint(mirror.fingerprint(input_file), schema, store)
+    if not force and month_up_to_date(con, color, year, month, fingerprint):
+        if store != "lake" or lake.partition_dir("raw", color, year, month).exists():
+            logger.info(f"{table_name} month {month:02d} already loaded from the same file, skipping")
+            return
+
+    if store == "lake":
+        ingest_month_lake(con, year, color, month, local_file, schema, fingerprint)
+        return
+
+    try:
+        # clean.py rewrites the year tables without source_month (and a schema change leaves the old columns),
+        # so one month can't be swapped in anymore - start that year over and reload the months we already had from the mirror
+        if table_exists(con, table_name) and not table_matches_schema(con, table_name, schema):
+            reload_year_table(con, color, year, month, mirror, schema)
+
+        row_count = insert_month(con, table_name, local_file, month, schema)
+        record_manifest(con, color, year, month, input_file, fingerprint, row_count, "loaded")
+        con.execute("COMMIT;")
+        logger.info(f"Loaded {row_count} rows into {table_name} for month {month:02d} in emissions db")
+
+    except Exception as e:
+        try:
+            con.execute("ROLLBACK;")
+        except Exception:
+            pass
+        record_manifest(con, color, year, month, input_file, fingerprint, None, "failed", str(e))
+        logger.warning(f"Skipping {input_file} due to error: {e}")
+
+
+# lake version of the above - one parquet file per month, nothing else in the year is touched
+def ingest_month_lake(con, year, color, month, local_file, schema, fingerprint):
+    input_file = tlc_url(color, year, month)
+    select_sql = f"SELECT {ingest_select_list(schema)} FROM read_parquet('{local_file}', union_by_name=true)"
+
+    try:
+        row_count = lake.write_month_partition(con, select_sql, "raw", color, year, month)
+        record_manifest(con, color, year, month, input_file, fingerprint, row_count, "loaded")
+        logger.info(f"Wrote {row_count} rows to the raw lake for {color} {year}-{month:02d}")
+
+    except Exception as e:
+        record_manifest(con, color, year, month, input_file, fingerprint, None, "failed", str(e))
+        logger.warning(f"Skipping {input_file} due to error: {e}")
+
+
+# drop a year table that lost its source_month tags (or has the wrong columns) and put back
+# every earlier month the manifest has as loaded. the earlier months' files are all fetched first, then the drop,
+# the manifest rows and the reload go in one transaction - if anything fails the table and manifest are left as they were
+def reload_year_table(con, color, year, before_month, mirror, schema=None):
+    table_name = f"{color}_{year}"
+    loaded = con.execute(f"""
+        SELECT month FROM {MANIFEST_TABLE}
+        WHERE color = ? AND year = ? AND month < ? AND status = 'loaded'
+        ORDER BY month
+    """, [color, year, before_month]).fetchall()
+
+    fetched = []
+    try:
+        for (month,) in loaded:
+            input_file = tlc_url(color, year, month)
+            local_file = mirror.fetch(input_file)
+            fetched.append((month, input_file, local_file))
+
+        logger.info(f"{table_name} can't take single-month reloads in its current shape, reloading the whole year")
+        con.execute("BEGIN TRANSACTION;")
+        try:
+            if table_exists(con, table_name, "VIEW"):
+                con.execute(f"DROP VIEW {table_name};")
+            con.execute(f"DROP TABLE IF EXISTS {table_name};")
+            con.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE color = ? AND year = ? AND month >= ?;", [color, year, before_month])
+
+            for month, input_file, local_file in fetched:
+                row_count = insert_month_rows(con, table_name, local_file, month, schema)
+                fingerprint = ingest_fingerprint(mirror.fingerprint(input_file), schema)
+                record_manifest(con, color, year, month, input_file, fingerprint, row_count, "loaded")
+            con.execute("COMMIT;")
+
+        except Exception:
+            con.execute("ROLLBACK;")
+            raise
+
+    finally:
+        for _, input_file, _ in fetched:
+            mirror.release(input_file)
+
+
+# how many months ended up loaded / failed for the years we just ran
+def summarize_manifest(con, years):
+    if not years:
+        return
+    rows = con.execute(f"""
+        SELECT status, COUNT(*), COALESCE(SUM(row_count), 0)
+        FROM {MANIFEST_TABLE}
+        WHERE year BETWEEN ? AND ?
+        GROUP BY status
+        ORDER BY status
+    """, [min(years), max(years)]).fetchall()
+    for status, months, row_count in rows:
+        print(f"load manifest: {months} months {status} ({row_count} rows)")
+        logger.info(f"load manifest: {months} months {status} ({row_count} rows)")
+
+
+# old one-at-a-time path, politeness limit instead of sleep(45) after every insert
+def load_months_serial(con, jobs, mirror, throttle, force=False, ingest_schema=None, store="duckdb"):
+    for year, color, month in jobs:
+        input_file = tlc_url(color, year, month)
+        logger.info(f"working on {input_file} now...")
+
+        try:
+            local_file = mirror.fetch(input_file, throttle)
+        except Exception as e:
+            ingest_month(con, year, color, month, None, mirror, force, ingest_schema, store, fetch_error=e)
+            continue
+        try:
+            ingest_month(con, year, color, month, local_file, mirror, force, ingest_schema, store)
+        finally:
+            mirror.release(input_file)
+
+
+# downloads run ahead on the pool (at most max_workers files in flight or waiting on disk),
+# inserts stay on this thread since the duckdb connection is single writer
+def load_months_concurrent(con, jobs, mirror, throttle, max_workers, force=False, ingest_schema=None, store="duckdb"):
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for i, job in enumerate(jobs[:max_workers]):
+            futures[i] = pool.submit(download_month, *job, mirror, throttle)
+
+        for i, (year, color, month) in enumerate(jobs):
+            # keep the window full - queue up the next download before we block on this one
+            next_i = i + max_workers
+            if next_i < len(jobs):
+                futures[next_i] = pool.submit(download_month, *jobs[next_i], mirror, throttle)
+
+            try:
+                local_file = futures.pop(i).result()
+            except Exception as e:
+                ingest_month(con, year, color, month, None, mirror, force, ingest_schema, store, fetch_error=e)
+                continue
+            # the file stays pinned in the mirror until it's inserted, so another download can't evict it first
+            try:
+                ingest_month(con, year, color, month, local_file, mirror, force, ingest_schema, store)
+            finally:
+                mirror.release(tlc_url(color, year, month))
+
+
+# url for one month of TLC trip data
+def tlc_url(color, year, month):
+    return f"{TLC_BASE_URL}/{color}_tripdata_{year}-{month:02d}.parquet"
+
+
+# get one month of trips onto local disk through the mirror - runs on the worker threads
+def download_month(year, color, month, mirror, throttle):
+    url = tlc_url(color, year, month)
+    logger.info(f"fetching {url} now...")
+    with profiling.span("load.download_month"):
+        return mirror.fetch(url, throttle)
+
+
+# spaces out request starts across all the download threads so we don't hammer cloudfront
+class RequestThrottle:
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.min_interval
+        if delay > 0:
+            time.sleep(delay)
+
+
 
 # Loading vehicle_emissions.csv into emissions db
 def load_vehicle_emissions_csv(file_name):
@@ -102,7 +387,7 @@ def load_vehicle_emissions_csv(file_name):
 
     try:
          # Connect to local DuckDB instance
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
+        con = session.cursor()
         logger.info("Connected to DuckDB instance for vehicle emissions csv table")
 
         # con.execute("CREATE SCHEMA IF NOT EXISTS tlc;")
@@ -134,7 +419,7 @@ def basic_data_summarizations(years=range(2024, 2025)):
     con = None
 
     try:
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
+        con = session.cursor()
         logger.info("Performing basic summarizations on green, yellow, and vehicle emissions tables in emissions db")
 
 
@@ -0,0 +1,288 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from pathlib import Path
+
+
+# no basicConfig here - mirror messages land in whichever stage log imported it (load.log)
+logger = logging.getLogger(__name__)
+
+
+# local on-disk copy of the TLC parquet files so re-runs don't go back to cloudfront
+MIRROR_DIR = Path(__file__).resolve().parent / "parquet_mirror"
+MIRROR_BUDGET_BYTES = 40 * 1024 ** 3  # all yellow + green 2015-2024 is roughly 30GB
+REQUEST_TIMEOUT = 300
+CHUNK_SIZE = 1024 * 1024
+
+
+# content-addressed store: objects/<sha256>.parquet holds the bytes once,
+# index.json maps each source url -> sha256, size, etag, last_modified, last_used, checked_at.
+# check_ttl=N trusts a copy checked against the source less than N seconds ago without another HEAD request
+class ParquetMirror:
+    def __init__(self, root=MIRROR_DIR, budget_bytes=MIRROR_BUDGET_BYTES, verify_hash=False, offline=False, check_ttl=0):
+        self.root = Path(root)
+        self.objects_dir = self.root / "objects"
+        self.tmp_dir = self.root / "tmp"
+        self.index_path = self.root / "index.json"
+        self.budget_bytes = budget_bytes
+        self.verify_hash = verify_hash
+        self.offline = offline
+        self.check_ttl = check_ttl
+        self._lock = threading.Lock()
+        # url -> fetches handed out and not released yet - eviction leaves these alone
+        self._pins = {}
+
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.entries = self._read_index()
+
+
+    # return a local path for url, downloading only if the mirrored copy is missing or stale.
+    # the file stays pinned (safe from eviction by other threads' downloads) until release(url)
+    def fetch(self, url, throttle=None):
+        with self._lock:
+            self._pins[url] = self._pins.get(url, 0) + 1
+        try:
+            return self._fetch(url, throttle)
+        except Exception:
+            self.release(url)
+            raise
+
+
+    # done reading the file fetch() returned for url - it can be evicted again
+    def release(self, url):
+        with self._lock:
+            count = self._pins.get(url, 0) - 1
+            if count > 0:
+                self._pins[url] = count
+            else:
+                self._pins.pop(url, None)
+
+
+    def _fetch(self, url, throttle=None):
+        cached = self.cached_path(url)
+
+        if self.offline:
+            if cached:
+                return cached
+            raise FileNotFoundError(f"{url} is not in the mirror and offline=True")
+
+        if cached and self.recently_checked(url):
+            return cached
+
+        # one politeness wait per fetch, before the HEAD - the download that may follow is the same visit.
+        # file:// urls never touch the network, so they don't wait at all
+        if throttle and not is_local_url(url):
+            throttle.wait()
+        try:
+            remote = remote_metadata(url)
+        except Exception as e:
+            # cloudfront unreachable - fall back to whatever we mirrored last time
+            if cached:
+                logger.warning(f"couldn't check {url} ({e}), using mirrored copy")
+                return cached
+            raise
+
+        if cached and self.is_fresh(url, remote):
+            self._touch(url, checked=True)
+            logger.info(f"mirror hit for {url}")
+            return cached
+
+        return self._download(url, remote)
+
+
+    # local path for url if the index has it and the object file is still on disk, else None
+    def cached_path(self, url):
+        with self._lock:
+            entry = self.entries.get(url)
+        if not entry:
+            return None
+        path = self.object_path(entry["sha256"])
+        if not path.exists() or path.stat().st_size != entry["size"]:
+            return None
+        return str(path)
+
+
+    # checked against the source within check_ttl seconds
+    def recently_checked(self, url):
+        if not self.check_ttl:
+            return False
+        with self._lock:
+            entry = self.entries.get(url)
+        checked_at = entry.get("checked_at") if entry else None
+        return checked_at is not None and time.time() - checked_at < self.check_ttl
+
+
+    # same size and (when the server gives one) same ETag as what we mirrored, optionally re-hash the bytes
+    def is_fresh(self, url, remote):
+        with self._lock:
+            entry = self.entries.get(url)
+        if not entry:
+            return False
+        if remote.get("size") is not None and remote["size"] != entry["size"]:
+            return False
+        if remote.get("etag") and entry.get("etag") and remote["etag"] != entry["etag"]:
+            return False
+        if remote.get("last_modified") and entry.get("last_modified") and not remote.get("etag"):
+            if remote["last_modified"] != entry["last_modified"]:
+                return False
+        if self.verify_hash and file_sha256(self.object_path(entry["sha256"])) != entry["sha256"]:
+            logger.warning(f"mirrored copy of {url} failed hash check, downloading again")
+            return False
+        return True
+
+
+    # sha256 of the mirrored copy of url - used as the source fingerprint downstream
+    def fingerprint(self, url):
+        with self._lock:
+            entry = self.entries.get(url)
+        return entry["sha256"] if entry else None
+
+
+    def object_path(self, sha256):
+        return self.objects_dir / f"{sha256}.parquet"
+
+
+    # stream to a temp file while hashing, then move into objects/ under its hash
+    def _download(self, url, remote):
+        tmp_path = self.tmp_dir / f"{uuid.uuid4().hex}.part"
+        digest = hashlib.sha256()
+        size = 0
+
+        logger.info(f"downloading {url} into mirror...")
+        try:
+            with urllib.request.urlopen(url, timeout=REQUEST_TIMEOUT) as response, open(tmp_path, "wb") as out:
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+
+            if remote.get("size") is not None and size != remote["size"]:
+                raise IOError(f"short download for {url}: got {size} of {remote['size']} bytes")
+
+            sha256 = digest.hexdigest()
+            final_path = self.object_path(sha256)
+            if final_path.exists():
+                tmp_path.unlink()
+            else:
+                os.replace(tmp_path, final_path)
+
+        except Exception:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise
+
+        with self._lock:
+            previous = self.entries.get(url)
+            self.entries[url] = {
+                "sha256": sha256,
+                "size": size,
+                "etag": remote.get("etag"),
+                "last_modified": remote.get("last_modified"),
+                "last_used": time.time(),
+                "checked_at": time.time(),
+            }
+            if previous and previous["sha256"] != sha256:
+                self._drop_object_locked(previous["sha256"])
+            self._evict_locked(keep=sha256)
+            self._write_index_locked()
+
+        logger.info(f"mirrored {url} as {sha256[:12]} ({size} bytes)")
+        return str(final_path)
+
+
+    def _touch(self, url, checked=False):
+        with self._lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return
+            entry["last_used"] = time.time()
+            if checked:
+                entry["checked_at"] = time.time()
+            self._write_index_locked()
+
+
+    # drop least recently used urls until the objects fit the byte budget
+    # (an object is only deleted once no url points at it anymore, pinned urls are skipped)
+    def _evict_locked(self, keep=None):
+        sizes = {}
+        for entry in self.entries.values():
+            sizes[entry["sha256"]] = entry["size"]
+        total = sum(sizes.values())
+
+        for url, entry in sorted(self.entries.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.budget_bytes:
+                break
+            if entry["sha256"] == keep or self._pins.get(url):
+                continue
+            del self.entries[url]
+            if self._drop_object_locked(entry["sha256"]):
+                total -= entry["size"]
+            logger.info(f"evicted {url} from mirror")
+
+
+    # delete an object file once no url in the index points at it anymore
+    def _drop_object_locked(self, sha256):
+        if any(e["sha256"] == sha256 for e in self.entries.values()):
+            return False
+        try:
+            self.object_path(sha256).unlink()
+        except FileNotFoundError:
+            pass
+        return True
+
+
+    def _read_index(self):
+        if not self.index_path.exists():
+            return {}
+        try:
+            with open(self.index_path) as f:
+                return json.load(f).get("entries", {})
+        except Exception as e:
+            logger.warning(f"mirror index unreadable, starting fresh: {e}")
+            return {}
+
+
+    # write to a temp file and swap so a crash mid-write doesn't lose the index
+    def _write_index_locked(self):
+        tmp_path = self.index_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"entries": self.entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+
+
+def is_local_url(url):
+    return urllib.parse.urlparse(url).scheme == "file"
+
+
+# size / etag / last-modified without downloading - HEAD for http(s), stat for file:// urls
+def remote_metadata(url):
+    if is_local_url(url):
+        stat = os.stat(urllib.request.url2pathname(urllib.parse.urlparse(url).path))
+        return {"size": stat.st_size, "etag": None, "last_modified": str(int(stat.st_mtime))}
+
+    request = urllib.request.Request(url, method="HEAD")
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+        length = response.headers.get("Content-Length")
+        return {
+            "size": int(length) if length is not None else None,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,363 @@
+import argparse
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+
+import analysis
+import clean
+import load
+import query_cache
+import session
+import transform
+from mirror import ParquetMirror, file_sha256
+
+
+# the stage modules above set up their own log files when imported - force this run's messages into one log
+logging.basicConfig(
+    level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+    filename='pipeline.log', force=True
+)
+logger = logging.getLogger(__name__)
+
+
+# load -> clean -> transform -> analysis in one go, only redoing the partitions whose inputs changed:
+#   python pipeline.py                       2015-2024, everything that's out of date
+#   python pipeline.py --years 2023 2024     first and last year (other years already in the db stay as they are)
+#   python pipeline.py --force               ignore the recorded state and run every stage over everything
+# partitions are (color, year, month) for load, (color, year) for clean (one table per year, deduped across it)
+# and (color, pickup year, pickup month) for transform. every stage records an input and an output fingerprint
+# per partition in pipeline_state, a partition is stale when its input fingerprint no longer matches the one
+# its last run recorded - and only stale partitions (and what depends on them) run again
+PROJECT_DIR = Path(__file__).resolve().parent
+STATE_TABLE = "pipeline_state"
+DEFAULT_YEARS = (2015, 2024)
+VEHICLE_EMISSIONS_CSV = PROJECT_DIR / "data" / "vehicle_emissions.csv"
+CLEAN_COLUMNS = {"yellow": clean.YELLOW_COLUMNS, "green": clean.GREEN_COLUMNS}
+# a mirrored month checked against cloudfront less than this long ago isn't checked again (HEAD requests are what
+# a no-op run would otherwise spend its time on, 2 seconds apart) - --mirror-ttl 0 checks every file
+MIRROR_CHECK_TTL_HOURS = 24
+# everything in the dbt project that changes what a build produces
+DBT_INPUTS = ("dbt_project.yml", "profiles.yml", "models", "macros", "seeds")
+# key for stage-wide rows (vehicle emissions, the dbt project, the analysis report)
+ALL = ("*", 0, 0)
+
+
+def fingerprint(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def file_hash(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(str(path.relative_to(PROJECT_DIR)).encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+# ---- state ----
+
+def create_state(con):
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            stage               VARCHAR,
+            color               VARCHAR,
+            year                INTEGER,
+            month               INTEGER,
+            input_fingerprint   VARCHAR,
+            output_fingerprint  VARCHAR,
+            updated_at_utc      TIMESTAMP,
+            PRIMARY KEY (stage, color, year, month)
+        );
+    """)
+
+
+# {(color, year, month): (input_fingerprint, output_fingerprint)} for one stage
+def read_state(con, stage):
+    rows = con.execute(f"""
+        SELECT color, year, month, input_fingerprint, output_fingerprint
+        FROM {STATE_TABLE} WHERE stage = ?
+    """, [stage]).fetchall()
+    return {(color, year, month): (input_fp, output_fp) for color, year, month, input_fp, output_fp in rows}
+
+
+# rows = {(color, year, month): (input_fingerprint, output_fingerprint)}
+def write_state(con, stage, rows):
+    if not rows:
+        return
+    con.executemany(f"""
+        INSERT OR REPLACE INTO {STATE_TABLE}
+        VALUES (?, ?, ?, ?, ?, ?, now() AT TIME ZONE 'UTC');
+    """, [[stage, *key, input_fp, output_fp] for key, (input_fp, output_fp) in rows.items()])
+
+
+# ---- load: (color, year, month) ----
+
+# load.py already skips months the manifest has from the same file, so this just runs it and reads the manifest back -
+# a month changed when its ingest fingerprint (file sha + ingest schema) or row count isn't what was recorded last time
+def run_load(con, years, mirror, force):
+    csv_fp = file_hash([VEHICLE_EMISSIONS_CSV])
+    emissions_state = read_state(con, "load_emissions").get(ALL)
+    if force or emissions_state is None or emissions_state[0] != csv_fp or not load.table_exists(con, "vehicle_emissions"):
+        load.load_vehicle_emissions_csv(str(VEHICLE_EMISSIONS_CSV))
+        if clean.remove_duplicates_vehicle_emissions():
+            rows = con.execute("SELECT COUNT(*) FROM vehicle_emissions").fetchone()[0]
+            write_state(con, "load_emissions", {ALL: (csv_fp, str(rows))})
+            logger.info(f"vehicle emissions (re)loaded, {rows} rows")
+    else:
+        print("load: vehicle_emissions up to date")
+
+    # load_parquet_files takes its own cursor and commits per month
+    load.load_parquet_files(years, mirror=mirror, force=force)
+
+    manifest = con.execute(f"""
+        SELECT color, year, month, fingerprint, row_count
+        FROM {load.MANIFEST_TABLE}
+        WHERE year BETWEEN ? AND ? AND status = 'loaded'
+    """, [min(years), max(years)]).fetchall()
+    loaded = {(color, year, month): (fp, str(row_count)) for color, year, month, fp, row_count in manifest}
+
+    previous = read_state(con, "load")
+    changed = {key for key, value in loaded.items() if previous.get(key) != value}
+    write_state(con, "load", {key: loaded[key] for key in changed})
+    # a month that's gone from the manifest (failed this time) is a change for its year too
+    gone = [key for key in previous if key not in loaded and min(years) <= key[1] <= max(years)]
+    if gone:
+        con.executemany(f"DELETE FROM {STATE_TABLE} WHERE stage = 'load' AND color = ? AND year = ? AND month = ?", gone)
+        changed |= set(gone)
+
+    print(f"load: {len(loaded)} months loaded, {len(changed)} changed since the last run")
+    logger.info(f"load: {len(loaded)} months loaded, {len(changed)} changed: {sorted(changed)}")
+    return loaded
+
+
+# ---- clean: (color, year) ----
+
+# per pickup (year, month) of a cleaned table: row count and an order-independent hash of its rows -
+# what transform compares to find the months that actually changed (duckdb's hash() is stable within a version,
+# a duckdb upgrade makes every partition look changed once)
+def month_fingerprints(con, table, columns):
+    pickup = columns[0]
+    rows = con.execute(f"""
+        SELECT year({pickup}), month({pickup}), COUNT(*), bit_xor(hash({', '.join(columns)}))
+        FROM {table}
+        WHERE {pickup} IS NOT NULL
+        GROUP BY ALL
+    """).fetchall()
+    return {f"{year}-{month:02d}": f"{count}:{digest}" for year, month, count, digest in rows}
+
+
+# the cleaned table still is what clean left behind (load puts source_month back when it reloads a year)
+def table_is_clean(con, table, columns, rows):
+    if not load.table_exists(con, table, "BASE TABLE") or load.table_columns(con, table) != columns:
+        return False
+    return str(con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]) == rows
+
+
+def run_clean(con, years, loaded, force):
+    previous = read_state(con, "clean")
+    results = {}
+    cleaned = []
+
+    for color, columns in CLEAN_COLUMNS.items():
+        for year in years:
+            table = f"{color}_{year}"
+            months = sorted((month, *loaded[(color, year, month)]) for month in range(1, 13) if (color, year, month) in loaded)
+            if not months:
+                continue
+            input_fp = fingerprint(months)
+
+            state = previous.get((color, year, 0))
+            if not force and state and state[0] == input_fp:
+                output = json.loads(state[1])
+                if table_is_clean(con, table, columns, output["rows"]):
+                    continue
+
+            if not clean.clean_table_fused(con, table, columns):
+                continue
+            rows = str(con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0])
+            output = {"rows": rows, "months": month_fingerprints(con, table, columns)}
+            results[(color, year, 0)] = (input_fp, json.dumps(output, sort_keys=True))
+            cleaned.append(table)
+
+    write_state(con, "clean", results)
+    if cleaned:
+        clean.tests(cleaned)
+
+    print(f"clean: {len(cleaned)} tables cleaned {cleaned}" if cleaned else "clean: every table up to date")
+    logger.info(f"clean: cleaned {cleaned}")
+    return {key: json.loads(output) for key, (_, output) in read_state(con, "clean").items()}
+
+
+# ---- transform: (color, pickup year, pickup month) ----
+
+# one fingerprint per pickup month, from every cleaned table of that color that has trips in it (a year table
+# holds a few trips picked up in other years too)
+def transform_inputs(cleaned, staged):
+    contributions = {}
+    for (color, table_year, _), output in cleaned.items():
+        # only the staged years' tables make it into data_transformation
+        if table_year not in staged:
+            continue
+        for year_month, month_fp in output["months"].items():
+            year, month = (int(part) for part in year_month.split("-"))
+            contributions.setdefault((color, year, month), []).append((table_year, month_fp))
+    return {key: fingerprint(sorted(parts)) for key, parts in contributions.items()}
+
+
+# every year with a {color}_{year} trip table, plus the years of this run, sorted - dbt always stages all of them, so a
+# run over a few years rebuilds just their partitions instead of building data_transformation from those years alone.
+# only years that are there: 2015 and 2024 loaded stages those two, not the 2016-2023 tables that don't exist
+def staged_years(con, years):
+    rows = con.execute("""
+        SELECT DISTINCT CAST(split_part(table_name, '_', 2) AS INTEGER)
+        FROM information_schema.tables
+        WHERE table_schema = 'main' AND regexp_matches(table_name, '^(yellow|green)_[0-9]{4}$')
+    """).fetchall()
+    return sorted({year for (year,) in rows} | set(years))
+
+
+# the dbt project's own files and the emissions lookup - any change here rebuilds everything
+def dbt_fingerprint(con):
+    paths = []
+    for name in DBT_INPUTS:
+        path = transform.DBT_DIR / name
+        paths += sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+    emissions = read_state(con, "load_emissions").get(ALL)
+    return fingerprint(file_hash(paths), emissions)
+
+
+# rows per (color, trip year, month) in data_transformation after a build - the transform output fingerprints
+def transform_outputs(con):
+    rows = con.execute("""
+        SELECT replace(CAST(vehicle_type AS VARCHAR), '_taxi', ''), trip_year, month_of_year, COUNT(*)
+        FROM data_transformation
+        GROUP BY ALL
+    """).fetchall()
+    return {(color, year, month): str(count) for color, year, month, count in rows}
+
+
+def run_transform(years, cleaned, force):
+    con = session.cursor()
+    try:
+        staged = staged_years(con, years)
+        project_fp = dbt_fingerprint(con)
+        project_state = read_state(con, "transform_project").get(ALL)
+        previous = read_state(con, "transform")
+    finally:
+        con.close()
+
+    dbt_vars = {"trip_years": staged}
+    inputs = transform_inputs(cleaned, staged)
+    stale = {key for key, input_fp in inputs.items() if previous.get(key, (None,))[0] != input_fp}
+    # partitions that had trips last time and have none now still need their rows deleted
+    stale |= {key for key in previous if key not in inputs}
+
+    if force or project_state is None or project_state[0] != project_fp:
+        print("transform: dbt project changed (or first run) - full refresh")
+        logger.info("transform: full refresh")
+        transform.run_dbt(full_refresh=True, dbt_vars=dbt_vars)
+    elif not stale:
+        print("transform: every partition up to date")
+        logger.info("transform: nothing stale")
+        return
+    elif any(not {year - 1, year, year + 1} & set(staged) for _, year, _ in stale):
+        # the scoped rebuild only reaches the staged models of a year and its neighbours (transform.staging_select) -
+        # stray pickups far from every staged year go through a full build
+        print(f"transform: {len(stale)} stale partitions, some far from the staged years {staged} - full build")
+        logger.info(f"transform: full build for {sorted(stale)}")
+        transform.run_dbt(dbt_vars=dbt_vars)
+    else:
+        # one scoped build over the union of the stale colors/years/months - can rebuild a few partitions that
+        # weren't stale (e.g. yellow 2024-03 + green 2023-07 also redoes yellow 2023-07), never misses one
+        colors = sorted({color for color, _, _ in stale})
+        stale_years = sorted({year for _, year, _ in stale})
+        months = sorted({month for _, _, month in stale})
+        print(f"transform: rebuilding {len(stale)} stale partitions (colors={colors} years={stale_years} months={months})")
+        logger.info(f"transform: scoped rebuild of {sorted(stale)}")
+        transform.run_dbt(years=stale_years, months=months, colors=colors, dbt_vars=dbt_vars)
+
+    # run_dbt exits on a failed build, so getting here means every partition is now built from its inputs
+    con = session.cursor()
+    try:
+        outputs = transform_outputs(con)
+        con.execute(f"DELETE FROM {STATE_TABLE} WHERE stage = 'transform'")
+        write_state(con, "transform", {key: (input_fp, outputs.get(key)) for key, input_fp in inputs.items()})
+        write_state(con, "transform_project", {ALL: (project_fp, None)})
+    finally:
+        con.close()
+
+
+# ---- analysis: the report over all the years ----
+
+# the report reads the dbt models, so their build ids (query_cache.db_fingerprint) plus the code that queries them
+def run_analysis(years, force):
+    code_fp = file_hash([PROJECT_DIR / "analysis.py", PROJECT_DIR / "columnar.py"])
+    input_fp = fingerprint(query_cache.db_fingerprint(session.DB_PATH), code_fp, list(years))
+
+    con = session.cursor()
+    try:
+        state = read_state(con, "analysis").get(ALL)
+    finally:
+        con.close()
+    if not force and state and state[0] == input_fp:
+        print("analysis: report up to date (python analysis.py prints it again)")
+        logger.info("analysis: nothing changed since the last report")
+        return
+
+    analysis.report(years)
+    # analysis.py saves the plot in the working directory
+    plot = Path("month_co2totals_yellow_green.png")
+    output_fp = file_sha256(plot) if plot.exists() else None
+
+    con = session.cursor()
+    try:
+        write_state(con, "analysis", {ALL: (input_fp, output_fp)})
+    finally:
+        con.close()
+
+
+def run_pipeline(years, force=False, mirror_ttl_hours=MIRROR_CHECK_TTL_HOURS):
+    timings = {}
+    mirror = ParquetMirror(check_ttl=mirror_ttl_hours * 3600)
+
+    con = session.cursor()
+    try:
+        create_state(con)
+        load.create_manifest(con)
+
+        started = time.perf_counter()
+        loaded = run_load(con, years, mirror, force)
+        timings["load"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        cleaned = run_clean(con, years, loaded, force)
+        timings["clean"] = time.perf_counter() - started
+    finally:
+        con.close()
+
+    # run_dbt closes the session connection, transform and analysis take their own cursors
+    started = time.perf_counter()
+    run_transform(years, cleaned, force)
+    timings["transform"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    run_analysis(years, force)
+    timings["analysis"] = time.perf_counter() - started
+
+    summary = ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in timings.items())
+    print(f"pipeline finished: {summary}")
+    logger.info(f"pipeline finished: {summary}")
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run load/clean/transform/analysis, skipping what's up to date")
+    parser.add_argument("--years", type=int, nargs=2, default=list(DEFAULT_YEARS), metavar=("FIRST", "LAST"))
+    parser.add_argument("--force", action="store_true", help="ignore the recorded state and redo every stage")
+    parser.add_argument("--mirror-ttl", type=float, default=MIRROR_CHECK_TTL_HOURS,
+                        help="hours a mirrored file is trusted without asking cloudfront again (0 = always ask)")
+    args = parser.parse_args()
+
+    run_pipeline(range(args.years[0], args.years[1] + 1), args.force, args.mirror_ttl)
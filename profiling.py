@@ -0,0 +1,398 @@
+import atexit
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # not on windows - peak rss is left out of the trace there
+    resource = None
+
+
+# no basicConfig here - profiling messages land in whichever stage log imported it
+logger = logging.getLogger(__name__)
+
+
+# opt-in trace of every sql statement a stage sends through session.cursor(), written as one json file per run:
+#   PIPELINE_PROFILE=on       wall time, rows scanned/returned, bytes read and peak memory (StepMemory) per statement
+#   PIPELINE_PROFILE=explain  the same plus duckdb's per-operator profile tree (what EXPLAIN ANALYZE prints),
+#                             read off the statement that actually ran rather than running it a second time
+# unset/off = cursors are handed out untouched, nothing is recorded
+PROFILE_MODE = os.environ.get("PIPELINE_PROFILE", "off").lower()
+ENABLED = PROFILE_MODE in ("on", "1", "true", "explain")
+EXPLAIN = PROFILE_MODE == "explain"
+PROFILE_DIR = Path(os.environ.get("PIPELINE_PROFILE_DIR", Path(__file__).resolve().parent / "profiles"))
+# load / clean / transform / analysis - whichever script was started
+STAGE = Path(sys.argv[0]).stem if sys.argv and sys.argv[0] not in ("", "-c", "-m") else "python"
+# longer statements are cut to this many characters in the trace
+SQL_CHARS = 2000
+
+# metrics kept per statement from duckdb's query profile -> name in the trace
+METRICS = {
+    "latency": "duckdb_seconds",
+    "cpu_time": "cpu_seconds",
+    "cumulative_rows_scanned": "rows_in",
+    "rows_returned": "rows_out",
+    "total_bytes_read": "bytes_read",
+    "total_bytes_written": "bytes_written",
+    # database-wide high-water marks since the database was opened, not this statement's own use
+    "system_peak_buffer_memory": "cumulative_peak_buffer_memory_bytes",
+    "system_peak_temp_dir_size": "cumulative_peak_temp_dir_bytes",
+}
+# cursor methods that read a whole result - duckdb only finishes a statement's profile once its result is consumed,
+# so a partial fetch reads the rest of the rows up front and hands them out of a buffer (ProfiledCursor._fetch)
+FULL_FETCHES = ("fetchall", "fetchnumpy", "fetchdf", "df", "fetch_df", "arrow", "fetch_arrow_table", "pl")
+PARTIAL_FETCHES = ("fetchone", "fetchmany")
+
+# frames from these modules are skipped when working out which function issued a statement
+_PLUMBING = {__name__, "session", "columnar"}
+
+_trace = None
+_lock = threading.Lock()
+
+
+# peak resident memory of this process so far, in bytes (linux reports ru_maxrss in KiB, macOS in bytes)
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# resident memory of this process right now, in bytes - linux only (/proc), None elsewhere
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# the peak resident memory of one step (a statement, a span, a benchmark step). ru_maxrss only ever goes up, so when
+# it rose during the step that new process peak is the step's; otherwise (an earlier step was heavier) the step's
+# peak is the highest rss a background thread sampled while it ran. None when neither is available (no /proc and
+# no new process peak)
+class StepMemory:
+    INTERVAL = 0.01
+
+    def __init__(self):
+        self.peak_before = peak_rss_bytes()
+        self.sampled = current_rss_bytes()
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        while not self._stop.wait(self.INTERVAL):
+            rss = current_rss_bytes()
+            if rss is not None:
+                self.sampled = max(self.sampled or 0, rss)
+
+    # the step's peak - later calls return the same figure
+    def stop(self):
+        if self._stop.is_set():
+            return self.peak
+        self._stop.set()
+        self._thread.join()
+        rss = current_rss_bytes()
+        if rss is not None:
+            self.sampled = max(self.sampled or 0, rss)
+        peak_after = peak_rss_bytes()
+        if peak_after is not None and self.peak_before is not None and peak_after > self.peak_before:
+            self.peak = peak_after
+        else:
+            self.peak = self.sampled
+        return self.peak
+
+
+# the stage function a statement came from, e.g. "clean.clean_table_fused"
+def calling_step():
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_globals.get("__name__") in _PLUMBING:
+        frame = frame.f_back
+    if frame is None:
+        return "unknown"
+    module = frame.f_globals.get("__name__", "")
+    if module == "__main__":
+        module = STAGE
+    return f"{module}.{frame.f_code.co_name}"
+
+
+# the run's trace, started when profiling is switched on (at import, end of this module) and written out when the
+# process exits - every offset_seconds is measured from that one start
+def current_trace():
+    global _trace
+    with _lock:
+        if _trace is None:
+            _trace = {
+                "run_id": uuid.uuid4().hex,
+                "stage": STAGE,
+                "argv": sys.argv,
+                "mode": PROFILE_MODE,
+                "started_at_utc": datetime.now(timezone.utc).isoformat(),
+                "pid": os.getpid(),
+                "started": time.perf_counter(),
+                "statements": [],
+                "spans": [],
+            }
+            atexit.register(write_trace)
+        return _trace
+
+
+def record(kind, entry):
+    trace = current_trace()
+    with _lock:
+        entry["seq"] = len(trace["statements"]) + len(trace["spans"])
+        trace[kind].append(entry)
+
+
+# a duckdb cursor that profiles every execute() - everything else goes straight to the real cursor, and execute()
+# returns the wrapper so con.execute(...).fetchall() chains still work.
+# a statement goes into the trace when it runs; duckdb's numbers for it are filled in once its result has been
+# read (or the next statement runs / the cursor closes), reading the profile any earlier gets an unfinished one.
+# fetchone/fetchmany read the whole result on their first call and serve the rows from _rows, so those statements
+# get their numbers too
+class ProfiledCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._pending = None
+        self._rows = None
+        self._memory = None
+        cursor.execute("SET enable_profiling = 'no_output'")
+
+
+    def execute(self, query, parameters=None):
+        self._finish_pending()
+        self._rows = None
+        step = calling_step()
+        started = time.perf_counter()
+        entry = {
+            "stage": STAGE,
+            "step": step,
+            "sql": " ".join(str(query).split())[:SQL_CHARS],
+            "offset_seconds": round(started - current_trace()["started"], 6),
+        }
+        # sampled from execute() until the result has been read (_finish_pending)
+        self._memory = StepMemory()
+        try:
+            if parameters is None:
+                self._cursor.execute(query)
+            else:
+                self._cursor.execute(query, parameters)
+        except Exception as e:
+            entry["error"] = str(e)
+            entry["peak_rss_bytes"] = self._memory.stop()
+            raise
+        finally:
+            entry["wall_seconds"] = round(time.perf_counter() - started, 6)
+            record("statements", entry)
+
+        entry["error"] = None
+        self._pending = entry
+        return self
+
+
+    def cursor(self):
+        return ProfiledCursor(self._cursor.cursor())
+
+
+    def close(self):
+        self._finish_pending()
+        self._rows = None
+        self._cursor.close()
+
+
+    # time a fetch into the statement it reads from, and collect the profile once the whole result is out
+    def _fetch(self, name):
+        method = getattr(self._cursor, name)
+
+        def fetch(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                if self._rows is None and name in PARTIAL_FETCHES and self._pending is not None:
+                    # read the rest now so duckdb finishes the statement - the caller still gets its rows one by one
+                    self._rows = collections.deque(self._cursor.fetchall())
+                if self._rows is not None:
+                    return self._buffered(name, *args, **kwargs)
+                return method(*args, **kwargs)
+            finally:
+                entry = self._pending
+                if entry is not None:
+                    entry["fetch_seconds"] = round(entry.get("fetch_seconds", 0.0) + time.perf_counter() - started, 6)
+                    entry["wall_seconds"] = round(entry["wall_seconds"] + time.perf_counter() - started, 6)
+                    if name in FULL_FETCHES or self._rows is not None:
+                        self._finish_pending(read=True)
+
+        return fetch
+
+
+    # the rest of a result already read into _rows, handed out the way the duckdb cursor would
+    def _buffered(self, name, size=1):
+        if name == "fetchone":
+            return self._rows.popleft() if self._rows else None
+        if name == "fetchmany":
+            return [self._rows.popleft() for _ in range(min(size, len(self._rows)))]
+        if name == "fetchall":
+            rows, self._rows = list(self._rows), collections.deque()
+            return rows
+        raise TypeError(f"{name}() after fetchone/fetchmany isn't supported on a profiled cursor, use fetchall()")
+
+
+    # read=True once the whole result has been fetched - otherwise the statement may not have finished running
+    def _finish_pending(self, read=False):
+        entry, self._pending = self._pending, None
+        if entry is None:
+            return
+        entry["peak_rss_bytes"] = self._memory.stop()
+        try:
+            profile = json.loads(self._cursor.get_profiling_information(format="json"))
+        except Exception as e:
+            logger.debug(f"no duckdb profile for statement in {entry['step']}: {e}")
+            return
+        # no profile: a result never read (execute() with no fetch - the rest of a query nobody asked for isn't run
+        # just to profile it), or one duckdb doesn't profile (transaction statements, pragmas, some aggregates
+        # answered from table statistics). the statement stays in the trace with the reason
+        if not profile.get("query_name"):
+            entry["profile_missing"] = "no duckdb profile" if read else "no duckdb profile, result not fetched"
+            logger.debug(f"no duckdb profile for statement in {entry['step']}: {entry['profile_missing']}")
+            return
+        for metric, name in METRICS.items():
+            entry[name] = profile.get(metric)
+        if EXPLAIN:
+            entry["profile"] = profile.get("children", [])
+
+
+    def __getattr__(self, name):
+        if name in FULL_FETCHES or name in PARTIAL_FETCHES:
+            return self._fetch(name)
+        return getattr(self._cursor, name)
+
+
+# session.cursor() hands every cursor through here - untouched unless PIPELINE_PROFILE is on
+def wrap(cursor):
+    if not ENABLED:
+        return cursor
+    return ProfiledCursor(cursor)
+
+
+# time a non-sql step (a dbt build, a download batch) into the same trace
+@contextmanager
+def span(name):
+    if not ENABLED:
+        yield
+        return
+
+    memory = StepMemory()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        record("spans", {
+            "stage": STAGE,
+            "step": name,
+            "offset_seconds": round(started - current_trace()["started"], 6),
+            "wall_seconds": round(time.perf_counter() - started, 6),
+            "peak_rss_bytes": memory.stop(),
+            "error": error,
+        })
+
+
+# wall time, statement count and rows/bytes per step, heaviest first
+def summarize(statements):
+    steps = {}
+    for entry in statements:
+        step = steps.setdefault(entry["step"], {
+            "step": entry["step"], "statements": 0, "wall_seconds": 0.0, "rows_in": 0, "rows_out": 0, "bytes_read": 0,
+        })
+        step["statements"] += 1
+        step["wall_seconds"] += entry["wall_seconds"]
+        for name in ("rows_in", "rows_out", "bytes_read"):
+            step[name] += entry.get(name) or 0
+    for step in steps.values():
+        step["wall_seconds"] = round(step["wall_seconds"], 6)
+    return sorted(steps.values(), key=lambda s: s["wall_seconds"], reverse=True)
+
+
+# write profiles/<stage>_<utc time>_<run id>.json - called at exit, safe to call earlier (it rewrites the same file)
+def write_trace():
+    with _lock:
+        if _trace is None:
+            return None
+        trace = dict(_trace)
+        started = trace.pop("started")
+        statements = list(trace["statements"])
+        spans = list(trace["spans"])
+
+    trace["finished_at_utc"] = datetime.now(timezone.utc).isoformat()
+    trace["wall_seconds"] = round(time.perf_counter() - started, 6)
+    # the whole process's peak, cumulative over the run - each statement/span has its own peak_rss_bytes
+    trace["process_peak_rss_bytes"] = peak_rss_bytes()
+    trace["statements"] = statements
+    trace["spans"] = spans
+    trace["steps"] = summarize(statements + spans)
+
+    stamp = trace["started_at_utc"][:19].replace(":", "").replace("-", "")
+    path = PROFILE_DIR / f"{trace['stage']}_{stamp}_{trace['run_id'][:8]}.json"
+    try:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(trace, f, indent=1, default=str)
+    except Exception as e:
+        logger.warning(f"couldn't write profile trace {path}: {e}")
+        return None
+
+    logger.info(f"profile trace for {len(statements)} statements written to {path}")
+    return path
+
+
+# side by side wall time per step of two traces (python profiling.py old.json new.json),
+# or the step table of one
+def compare(old_path, new_path=None):
+    with open(old_path) as f:
+        old = {s["step"]: s for s in json.load(f)["steps"]}
+    new = {}
+    if new_path:
+        with open(new_path) as f:
+            new = {s["step"]: s for s in json.load(f)["steps"]}
+
+    rows = []
+    for step in sorted(set(old) | set(new), key=lambda s: -max(old.get(s, {}).get("wall_seconds", 0),
+                                                              new.get(s, {}).get("wall_seconds", 0))):
+        old_wall = old.get(step, {}).get("wall_seconds")
+        new_wall = new.get(step, {}).get("wall_seconds")
+        rows.append((step, old_wall, new_wall))
+    return rows
+
+
+# start the trace now, not on the first statement, so nothing recorded can come before its start
+if ENABLED:
+    current_trace()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: python profiling.py trace.json [other_trace.json]")
+
+    other = sys.argv[2] if len(sys.argv) > 2 else None
+    for step, old_wall, new_wall in compare(sys.argv[1], other):
+        line = f"{step:<55} {old_wall if old_wall is not None else '-':>12}"
+        if other:
+            change = ""
+            if old_wall and new_wall is not None:
+                change = f" ({(new_wall - old_wall) / old_wall:+.1%})"
+            line += f" {new_wall if new_wall is not None else '-':>12}{change}"
+        print(line)
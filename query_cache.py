@@ -0,0 +1,256 @@
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import session
+
+
+# no basicConfig here - cache messages land in whichever stage log imported it (analysis.log)
+logger = logging.getLogger(__name__)
+
+
+# on-disk copy of analysis results so re-running a report against an unchanged emissions.duckdb is instant
+PROJECT_DIR = Path(__file__).resolve().parent
+CACHE_DIR = PROJECT_DIR / "query_cache"
+CACHE_BUDGET_BYTES = 256 * 1024 ** 2
+# QUERY_CACHE=off runs every query for real (and doesn't write anything)
+CACHE_ENABLED = os.environ.get("QUERY_CACHE", "on").lower() not in ("off", "0", "false")
+BUILD_INFO_TABLE = "build_info"
+
+
+# results/<key>.pkl holds one pickled result, index.json maps key -> size, created, last_used, function
+class QueryCache:
+    def __init__(self, root=CACHE_DIR, budget_bytes=CACHE_BUDGET_BYTES):
+        self.root = Path(root)
+        self.results_dir = self.root / "results"
+        self.index_path = self.root / "index.json"
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        self.entries = self._read_index()
+
+
+    # (True, value) on a hit, (False, None) on a miss or an unreadable entry
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+        if not entry:
+            return False, None
+
+        try:
+            with open(self.result_path(key), "rb") as f:
+                value = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"cached result {key[:12]} unreadable, dropping it: {e}")
+            with self._lock:
+                self.entries.pop(key, None)
+                self._write_index_locked()
+            return False, None
+
+        with self._lock:
+            if key in self.entries:
+                self.entries[key]["last_used"] = time.time()
+                self._write_index_locked()
+        return True, value
+
+
+    # pickle to a temp file and swap it in, then evict least recently used results down to the budget
+    def put(self, key, value, label=""):
+        tmp_path = self.results_dir / f"{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = tmp_path.stat().st_size
+            os.replace(tmp_path, self.result_path(key))
+        except Exception as e:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            logger.warning(f"couldn't cache result of {label}: {e}")
+            return
+
+        now = time.time()
+        with self._lock:
+            self.entries[key] = {"size": size, "created": now, "last_used": now, "function": label}
+            self._evict_locked(keep=key)
+            self._write_index_locked()
+
+
+    def result_path(self, key):
+        return self.results_dir / f"{key}.pkl"
+
+
+    def clear(self):
+        with self._lock:
+            for key in list(self.entries):
+                self._drop_locked(key)
+            self._write_index_locked()
+
+
+    def _evict_locked(self, keep=None):
+        total = sum(e["size"] for e in self.entries.values())
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.budget_bytes:
+                break
+            if key == keep:
+                continue
+            total -= entry["size"]
+            self._drop_locked(key)
+            logger.info(f"evicted cached {entry.get('function')} result {key[:12]}")
+
+
+    def _drop_locked(self, key):
+        self.entries.pop(key, None)
+        try:
+            self.result_path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+
+    def _read_index(self):
+        if not self.index_path.exists():
+            return {}
+        try:
+            with open(self.index_path) as f:
+                return json.load(f).get("entries", {})
+        except Exception as e:
+            logger.warning(f"query cache index unreadable, starting fresh: {e}")
+            return {}
+
+
+    def _write_index_locked(self):
+        tmp_path = self.index_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"entries": self.entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = QueryCache()
+        return _default_cache
+
+
+# what the database looks like right now - the dbt build id of every model and seed (written by the record_build
+# post-hook, so re-seeding the label lookups misses too),
+# or the file's size/mtime when dbt hasn't stamped it. None if the file isn't there at all
+def db_fingerprint(db_path):
+    path = Path(db_path).resolve()
+    if not path.exists():
+        return None
+
+    con = None
+    try:
+        con = session.cursor(path, read_only=True)
+        rows = con.execute(f"""
+            SELECT relation, invocation_id FROM {BUILD_INFO_TABLE} ORDER BY relation
+        """).fetchall()
+        if rows:
+            return "build:" + ",".join(f"{relation}={invocation_id}" for relation, invocation_id in rows)
+    except Exception:
+        # no build_info yet (or the db is locked by a writer) - fall back to the file itself
+        pass
+    finally:
+        if con:
+            con.close()
+
+    stat = path.stat()
+    wal = path.with_name(path.name + ".wal")
+    wal_part = f":{wal.stat().st_mtime_ns}" if wal.exists() else ""
+    return f"file:{stat.st_size}:{stat.st_mtime_ns}{wal_part}"
+
+
+# ranges/tuples -> lists so range(2024, 2025) and [2024] land on the same key
+def normalize_arg(value):
+    if isinstance(value, (range, tuple, list)):
+        return [normalize_arg(v) for v in value]
+    return value
+
+
+# the project's own source files a function depends on: the module it lives in plus every module of this project it
+# reaches through imports (modules and the modules of imported functions, e.g. columnar, storage_stats, query_cache,
+# and what those import in turn). third party libraries are left out, they don't change between two runs
+def source_files(func):
+    files = set()
+    pending = [inspect.getmodule(func)]
+    while pending:
+        module = pending.pop()
+        path = Path(module.__file__).resolve()
+        if path in files:
+            continue
+        files.add(path)
+        for value in vars(module).values():
+            used = value if inspect.ismodule(value) else inspect.getmodule(value)
+            used_path = getattr(used, "__file__", None)
+            if used_path and Path(used_path).resolve().parent == PROJECT_DIR:
+                pending.append(used)
+    return sorted(files)
+
+
+def source_hash(files):
+    digest = hashlib.sha256()
+    for path in files:
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+# decorator for analysis functions that take db_path (None = session.DB_PATH): results are keyed on the source of
+# the module the function lives in and the project modules it uses (source_files - so editing a query or a helper
+# it calls, in whichever module, invalidates), its arguments and db_fingerprint(db_path), so a dbt rebuild just
+# misses. None results (the error path) are never cached
+def cached_query(func):
+    signature = inspect.signature(func)
+    label = f"{Path(inspect.getsourcefile(func)).stem}.{func.__qualname__}"
+    # hashed on first call, once the function's module has finished importing everything it uses
+    hashed_sources = []
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not CACHE_ENABLED:
+            return func(*args, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        params = {name: normalize_arg(value) for name, value in bound.arguments.items()}
+
+        if "db_path" not in params:
+            return func(*args, **kwargs)
+        db_path = params["db_path"] or session.DB_PATH
+        fingerprint = db_fingerprint(db_path)
+        if fingerprint is None:
+            return func(*args, **kwargs)
+        params["db_path"] = str(Path(db_path).resolve())
+
+        if not hashed_sources:
+            hashed_sources.append(source_hash(source_files(func)))
+        key = hashlib.sha256(
+            json.dumps([label, hashed_sources[0], params, fingerprint], sort_keys=True, default=repr).encode()
+        ).hexdigest()
+
+        cache = default_cache()
+        hit, value = cache.get(key)
+        if hit:
+            logger.info(f"query cache hit for {label}")
+            return value
+
+        value = func(*args, **kwargs)
+        if value is not None:
+            cache.put(key, value, label)
+        return value
+
+    return wrapper
@@ -0,0 +1,86 @@
+import atexit
+import duckdb
+import logging
+import os
+import threading
+from pathlib import Path
+
+import profiling
+
+
+# no basicConfig here - session messages land in whichever stage log imported it
+logger = logging.getLogger(__name__)
+
+
+# one duckdb connection per database file for the whole process, so load -> clean -> analysis steps run in one
+# python process share duckdb's buffer manager and parquet metadata cache instead of starting cold every function.
+# stages take cursors off it (session.cursor()) and close those, never the connection itself
+PROJECT_DIR = Path(__file__).resolve().parent
+# EMISSIONS_DB=/some/other.duckdb points every stage (and dbt, see dbt/profiles.yml) at another database
+DB_PATH = Path(os.environ.get("EMISSIONS_DB", PROJECT_DIR / "emissions.duckdb")).resolve()
+
+# duckdb settings applied to every connection - unset = duckdb's own defaults
+# (DUCKDB_THREADS=8, DUCKDB_MEMORY_LIMIT=8GB, DUCKDB_TEMP_DIRECTORY=/big/disk/tmp)
+SETTINGS_ENV = {
+    "threads": "DUCKDB_THREADS",
+    "memory_limit": "DUCKDB_MEMORY_LIMIT",
+    "temp_directory": "DUCKDB_TEMP_DIRECTORY",
+}
+
+_connections = {}
+_read_only = {}
+_lock = threading.Lock()
+
+
+def settings():
+    config = {}
+    for setting, env_name in SETTINGS_ENV.items():
+        value = os.environ.get(env_name)
+        if value:
+            config[setting] = int(value) if setting == "threads" else value
+    return config
+
+
+# the shared connection for db_path, opened (and configured) on first use.
+# a read-only request is happy with an already open read-write connection; asking for read-write when only a
+# read-only one is open closes it and reopens (cursors taken off the old one stop working)
+def connect(db_path=None, read_only=False):
+    path = Path(db_path or DB_PATH).resolve()
+    key = str(path)
+
+    with _lock:
+        con = _connections.get(key)
+        if con is not None and _read_only[key] and not read_only:
+            logger.info(f"reopening {path.name} read-write")
+            con.close()
+            con = None
+
+        if con is None:
+            config = settings()
+            con = duckdb.connect(database=key, read_only=read_only, config=config)
+            _connections[key] = con
+            _read_only[key] = read_only
+            logger.info(f"opened {path.name} ({'read-only' if read_only else 'read-write'}) settings={config}")
+
+        return con
+
+
+# a cursor on the shared connection - close it when done, the connection (and its caches) stays open.
+# with PIPELINE_PROFILE on, every statement run on it goes into the run's profile trace (profiling.py)
+def cursor(db_path=None, read_only=False):
+    return profiling.wrap(connect(db_path, read_only).cursor())
+
+
+# close the shared connection(s) - needed before something outside this process (dbt) writes to the file
+def close(db_path=None):
+    with _lock:
+        keys = list(_connections) if db_path is None else [str(Path(db_path).resolve())]
+        for key in keys:
+            con = _connections.pop(key, None)
+            _read_only.pop(key, None)
+            if con is not None:
+                con.close()
+                logger.info(f"closed {Path(key).name}")
+
+
+atexit.register(close)
@@ -0,0 +1,93 @@
+import logging
+import re
+
+
+# no basicConfig here - row group reports land in whichever stage log imported it (analysis.log)
+logger = logging.getLogger(__name__)
+
+
+# "[Min: 2015-01-01 01:34:00, Max: 2017-12-31 13:13:00][Has Null: false, ...]" from pragma_storage_info
+STATS_PATTERN = re.compile(r"\[Min: (.*?), Max: (.*?)[,\]]")
+# duckdb keeps only this many leading bytes of a VARCHAR in its min/max stats
+STRING_STATS_PREFIX = 8
+
+
+# {row_group_id: (min, max)} for one column - the zonemap duckdb checks a filter against before reading a row group.
+# a row group with a segment that has no usable stats gets None (it can never be skipped)
+def row_group_ranges(con, table, column):
+    rows = con.execute("""
+        SELECT row_group_id, stats
+        FROM pragma_storage_info(?)
+        WHERE column_name = ? AND segment_type <> 'VALIDITY'
+    """, [table, column]).fetchall()
+
+    ranges = {}
+    for row_group_id, stats in rows:
+        match = STATS_PATTERN.search(stats or "")
+        if row_group_id in ranges and ranges[row_group_id] is None:
+            continue
+        if not match:
+            ranges[row_group_id] = None
+            continue
+        seg_min, seg_max = match.groups()
+        if row_group_id not in ranges:
+            ranges[row_group_id] = (seg_min, seg_max)
+        else:
+            rg_min, rg_max = ranges[row_group_id]
+            ranges[row_group_id] = (min(rg_min, seg_min), max(rg_max, seg_max))
+    return ranges
+
+
+# key to compare vehicle_type stats with - an ENUM orders by its position in the type, a VARCHAR by its prefix
+def vehicle_type_key(data_type):
+    if data_type.upper().startswith("ENUM"):
+        labels = re.findall(r"'((?:[^']|'')*)'", data_type)
+        order = {label: i for i, label in enumerate(labels)}
+        return lambda value: order.get(value)
+    return lambda value: value[:STRING_STATS_PREFIX]
+
+
+# how many of table's row groups a "vehicle_type IN (...) AND pickup_ts in [start_year, end_year)" filter can skip
+# on their min/max alone. returns (row groups, skippable row groups)
+def skippable_row_groups(con, table, vehicle_types, start_year, end_year):
+    data_type = con.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = 'main' AND table_name = ? AND column_name = 'vehicle_type'
+    """, [table]).fetchone()[0]
+    key = vehicle_type_key(data_type)
+    wanted = [key(v) for v in vehicle_types]
+
+    ts_ranges = row_group_ranges(con, table, "pickup_ts")
+    vt_ranges = row_group_ranges(con, table, "vehicle_type")
+    start_ts = f"{start_year}-01-01 00:00:00"
+    end_ts = f"{end_year}-01-01 00:00:00"
+
+    skipped = 0
+    for row_group_id, ts_range in ts_ranges.items():
+        if ts_range is not None and (ts_range[1] < start_ts or ts_range[0] >= end_ts):
+            skipped += 1
+            continue
+
+        vt_range = vt_ranges.get(row_group_id)
+        if vt_range is None or any(w is None for w in wanted):
+            continue
+        vt_min, vt_max = key(vt_range[0]), key(vt_range[1])
+        if vt_min is None or vt_max is None:
+            continue
+        if not any(vt_min <= w <= vt_max for w in wanted):
+            skipped += 1
+
+    return len(ts_ranges), skipped
+
+
+# log the zonemap skip estimate for one analysis query over a trip table (never fails the query itself)
+def log_row_group_skips(con, label, table, vehicle_types, start_year, end_year):
+    try:
+        total, skipped = skippable_row_groups(con, table, vehicle_types, start_year, end_year)
+    except Exception as e:
+        logger.warning(f"[{label}] couldn't read row group stats for {table}: {e}")
+        return None
+
+    logger.info(f"[{label}] {table}: {skipped} of {total} row groups skipped by zonemaps "
+                f"(vehicle_type in {list(vehicle_types)}, years {start_year}-{end_year - 1})")
+    return total, skipped
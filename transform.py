@@ -1,9 +1,16 @@
 import duckdb
+import importlib.util
+import json
 import logging
+import os
 import subprocess
 import sys
 from pathlib import Path
 
+import lake
+import profiling
+import session
+
 # CHOSE TO DO DBT METHOD - THIS IS LOADING THE COMMAND AND USING IT
 # NO USE OF DUCKDB SCRIPT UNLESS YOU'RE TESTING WITH qa_print() OR export() METHODS COMMENTED OUT BELOW 
 
@@ -18,18 +25,187 @@ logger = logging.getLogger(__name__)
 # wonky file stuff
 PROJECT_DIR = Path(__file__).resolve().parent
 DBT_DIR = PROJECT_DIR / "dbt"   
-DB_PATH = PROJECT_DIR / "emissions.duckdb"
+DB_PATH = session.DB_PATH
+
+# +data_transformation+ also builds the marts on top of it (co2_rollup, top_co2_trips),
+# path:seeds the label lookups (also pulled in through dim_calendar)
+FULL_SELECT = ["+data_transformation+", "path:seeds"]
+# a scoped rebuild only needs the staging union and the incremental models after it (data_transformation applies the
+# scope filter), plus the per color-year staging models that can hold scoped trips (staging_select)
+SCOPED_SELECT = ["stg_aggre_yellow_green", "data_transformation+"]
+SCOPE_VARS = ("rebuild_years", "rebuild_months", "rebuild_colors")
+
+# one stg_trips_{color}_{year} model per staged color-year - dbt needs a file per model. 2015-2024 are checked in under
+# models/staging/trips/, write_staging_models puts any other staged year's files under generated_models/ (git ignored,
+# listed in model-paths), so a run over other years never touches the tracked project
+STAGING_TRIPS_DIR = DBT_DIR / "models" / "staging" / "trips"
+GENERATED_TRIPS_DIR = DBT_DIR / "generated_models" / "staging" / "trips"
+STAGING_COLORS = ("yellow", "green")
+# trip_start_year / trip_end_year defaults, same as dbt_project.yml
+TRIP_YEARS = (2015, 2024)
+STAGING_MODEL = """-- {color} taxi trips for {year} (written by transform.write_staging_models, body in macros/stg_trips.sql)
+{{{{ config(enabled=trip_year_enabled({year})) }}}}
+
+{{{{ stg_trips('{color}', {year}) }}}}
+"""
+
+# parsed dbt project kept between in-process runs, keyed on the vars that can change model configs
+_manifests = {}
+
+
+# the years a run stages - the trip_years list when given, else trip_start_year..trip_end_year (dbt's trip_years macro)
+def staged_trip_years(dbt_vars):
+    if dbt_vars.get("trip_years") is not None:
+        return sorted(int(year) for year in dbt_vars["trip_years"])
+    start_year = dbt_vars.get("trip_start_year", TRIP_YEARS[0])
+    end_year = dbt_vars.get("trip_end_year", TRIP_YEARS[1])
+    return list(range(start_year, end_year + 1))
+
+
+# write generated_models/ files for the staged years without a checked-in model, and remove the ones left over from
+# an earlier run over other years
+def write_staging_models(years=range(TRIP_YEARS[0], TRIP_YEARS[1] + 1)):
+    GENERATED_TRIPS_DIR.mkdir(parents=True, exist_ok=True)
+    wanted = set()
+    written = []
+    for color in STAGING_COLORS:
+        for year in years:
+            name = f"stg_trips_{color}_{year}.sql"
+            if (STAGING_TRIPS_DIR / name).exists():
+                continue
+            wanted.add(name)
+            path = GENERATED_TRIPS_DIR / name
+            if not path.exists():
+                path.write_text(STAGING_MODEL.format(color=color, year=year))
+                written.append(name)
+
+    removed = sorted(p.name for p in GENERATED_TRIPS_DIR.glob("stg_trips_*.sql") if p.name not in wanted)
+    for name in removed:
+        (GENERATED_TRIPS_DIR / name).unlink()
+    if written or removed:
+        logger.info(f"staging models: wrote {written}, removed {removed}")
+    return written
+
+
+# the stg_trips_{color}_{year} models that can hold trips picked up in the scoped years - those years and their
+# neighbours (a year table has a few trips from the year before/after). unscoped colors/years are wildcards
+# (dbt matches node names with fnmatch)
+def staging_select(years=None, colors=None):
+    year_patterns = ["*"] if years is None else sorted({str(y + d) for y in years for d in (-1, 0, 1)})
+    color_patterns = ["*"] if colors is None else list(colors)
+    return [f"stg_trips_{color}_{year}" for color in color_patterns for year in year_patterns]
+
+
+# the dbt build arguments for a run - years/months/colors turn into the rebuild_* vars so only those
+# (vehicle_type, trip_year, month_of_year) partitions get rebuilt (see dbt/macros/rebuild_scope.sql)
+def dbt_build_args(years=None, months=None, colors=None, full_refresh=False, dbt_vars=None):
+    dbt_vars = dict(dbt_vars or {})
+    # absolute, so read_parquet finds the lake whichever directory dbt/duckdb resolves relative paths against
+    dbt_vars.setdefault("lake_dir", str(lake.LAKE_DIR))
+    # profiles.yml takes the database path from this var, so dbt builds the same file the python stages use
+    # without EMISSIONS_DB having to be set for the whole process
+    dbt_vars.setdefault("emissions_db", str(DB_PATH))
+    # the staged years as an explicit list, so a gap between loaded years never stages a table that isn't there
+    dbt_vars["trip_years"] = staged_trip_years(dbt_vars)
+    for name, value in zip(SCOPE_VARS, (years, months, colors)):
+        if value is not None:
+            dbt_vars[name] = [int(v) for v in value] if name != "rebuild_colors" else [str(v) for v in value]
+
+    scoped = any(name in dbt_vars for name in SCOPE_VARS)
+    if scoped:
+        select = SCOPED_SELECT + staging_select(dbt_vars.get("rebuild_years"), dbt_vars.get("rebuild_colors"))
+    else:
+        select = FULL_SELECT
+    args = ["build", "-s", *select, "--profiles-dir", "."]
+    if dbt_vars:
+        args += ["--vars", json.dumps(dbt_vars)]
+    if full_refresh:
+        args.append("--full-refresh")
+    return args, dbt_vars
+
 
 # subprocess document to call CLI: https://stackoverflow.com/questions/4364087/python-subprocess-using-import-subprocess
 # call the dbt command (might be the same neal and the TA uses?)
-def run_dbt():
-    cmd = ["dbt", "build", "-s", "+data_transformation", "--profiles-dir", "."]
+# e.g. run_dbt(years=[2024], months=[3], colors=["yellow"]) after load.py reloaded one month
+def run_dbt(years=None, months=None, colors=None, full_refresh=False, dbt_vars=None, in_process=True):
+    args, dbt_vars = dbt_build_args(years, months, colors, full_refresh, dbt_vars)
+    write_staging_models(dbt_vars["trip_years"])
+    # dbt needs the write lock on the file - let go of this process's connection first
+    session.close()
+
+    # dbt's python entry point - run in this process when it's installed here, otherwise fall back to the CLI.
+    # dbt's own statements don't go through session, the profile trace times the build as one step
+    with profiling.span("transform.dbt_build"):
+        if in_process and importlib.util.find_spec("dbt.cli") is not None:
+            run_dbt_in_process(args, dbt_vars)
+        else:
+            run_dbt_subprocess(args)
+
+
+# dbt's programmatic runner: no interpreter startup, and after the first run no project parse either
+def run_dbt_in_process(args, dbt_vars):
+    # imported here, importing dbt sets up a root log handler that would swallow transform.log's basicConfig
+    from dbt.cli.main import dbtRunner
+
+    # profiles.yml is relative to the dbt project, same as running the CLI from dbt/
+    previous_dir = os.getcwd()
+    os.chdir(DBT_DIR)
+    try:
+        manifest_key = json.dumps({k: v for k, v in dbt_vars.items() if k not in SCOPE_VARS}, sort_keys=True)
+        manifest = _manifests.get(manifest_key)
+        if manifest is None:
+            parse_args = ["parse", "--profiles-dir", "."]
+            if dbt_vars:
+                parse_args += ["--vars", json.dumps(dbt_vars)]
+            parsed = dbtRunner().invoke(parse_args)
+            if not parsed.success:
+                sys.exit(f"dbt parse failed: {parsed.exception}")
+            manifest = parsed.result
+            _manifests[manifest_key] = manifest
+            logger.info("parsed dbt project, manifest kept for the next run")
+
+        result = dbtRunner(manifest=manifest).invoke(args)
+    finally:
+        os.chdir(previous_dir)
+        release_dbt_connection()
+
+    if not result.success:
+        logger.warning(f"DBT build failed: {result.exception}")
+        sys.exit(f"dbt build failed: {result.exception or 'see dbt/logs/dbt.log'}")
+    logger.info(f"dbt ran in process with 'dbt {' '.join(args)}'")
+
+
+# dbt-duckdb keeps its connection to emissions.duckdb open for the life of the process - close it so the
+# session (and anything else in this process) can open the file again afterwards
+def release_dbt_connection():
+    try:
+        from dbt.adapters.duckdb.connections import DuckDBConnectionManager
+    except ImportError:
+        return
+    # _ENV is dbt-duckdb's private handle on the open database (None when nothing is open) - a release that renames
+    # or reshapes it shouldn't fail a build that already succeeded, but the file stays locked, so say so: the next
+    # session.cursor() lock error then has a visible cause
+    env = getattr(DuckDBConnectionManager, "_ENV", None)
+    close_env = getattr(env, "close", None)
+    if not hasattr(DuckDBConnectionManager, "_ENV") or (env is not None and not callable(close_env)):
+        logger.warning("couldn't release dbt-duckdb's database handle (no DuckDBConnectionManager._ENV.close), "
+                       f"{DB_PATH} may stay locked until this process exits")
+    try:
+        if callable(close_env):
+            close_env()
+        DuckDBConnectionManager.close_all_connections()
+    except Exception as e:
+        logger.warning(f"couldn't close dbt's duckdb connection: {e}")
+
+
+def run_dbt_subprocess(args):
+    cmd = ["dbt", *args]
     try:
         subprocess.run(cmd, check=True, cwd=str(DBT_DIR))
-        logger.info("subprocess worked! DBT ran with transform command 'dbt build --profiles-dir .'")
+        logger.info(f"subprocess worked! DBT ran with transform command '{' '.join(cmd)}'")
     except subprocess.CalledProcessError as e:
-        sys.exit(f"dbt build failed: {e}")
         logger.warning(f"DBT build failed: {e}")
+        sys.exit(f"dbt build failed: {e}")
 
 
 # testing nulls of mph and co2 columns
@@ -70,7 +246,8 @@ def run_dbt():
 
 # Call all methods from transform.py here
 if __name__ == "__main__":
-    run_dbt() # runs "dbt build -s +data_transformation --profiles-dir ."
+    run_dbt() # runs "dbt build -s +data_transformation+ path:seeds --profiles-dir ."
+    # run_dbt(years=[2024], months=[3]) # only rebuild march 2024 after reloading it
 
     # testing transform worked
     # qa_print()
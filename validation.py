@@ -0,0 +1,226 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import session
+
+
+# no basicConfig here - validation messages land in the stage log that runs it (clean.log)
+logger = logging.getLogger(__name__)
+
+
+MAX_WORKERS = 4
+
+
+# one check on one table - bad_rows is how many rows break it (0 means it passed)
+@dataclass
+class CheckResult:
+    table: str
+    check: str
+    bad_rows: int
+    message: str
+
+    @property
+    def passed(self):
+        return self.bad_rows == 0
+
+
+# every check for one table, all from a single aggregate scan timed as a whole
+@dataclass
+class TableValidation:
+    table: str
+    row_count: int = 0
+    checks: list = field(default_factory=list)
+    scan_seconds: float = 0.0
+    error: str = None
+
+    @property
+    def passed(self):
+        return self.error is None and all(c.passed for c in self.checks)
+
+
+@dataclass
+class ValidationReport:
+    tables: list = field(default_factory=list)
+    total_seconds: float = 0.0
+
+    @property
+    def passed(self):
+        return all(t.passed for t in self.tables)
+
+    # same "[table] ..." strings clean.tests() used to collect in its failures list
+    def failures(self):
+        failed = []
+        for t in self.tables:
+            if t.error is not None:
+                failed.append(f"[{t.table}] missing or unreadable: {t.error}")
+                continue
+            failed.extend(c.message for c in t.checks if not c.passed)
+        return failed
+
+    def check(self, table, check):
+        for t in self.tables:
+            if t.table == table:
+                for c in t.checks:
+                    if c.check == check:
+                        return c
+        return None
+
+
+# run every check on every table - one scan per table, tables spread over a thread pool
+# (each thread gets its own cursor off the shared session connection)
+def validate_tables(tables, db_path=None, include_vehicle_emissions=True, max_workers=MAX_WORKERS):
+    start = time.perf_counter()
+    report = ValidationReport()
+    con = session.cursor(db_path, read_only=True)
+
+    try:
+        jobs = [(table, validate_trip_table) for table in tables]
+        if include_vehicle_emissions:
+            jobs.append(("vehicle_emissions", validate_vehicle_emissions))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(run_on_cursor, con, validator, table) for table, validator in jobs]
+            report.tables = [f.result() for f in futures]
+
+    finally:
+        con.close()
+
+    report.total_seconds = time.perf_counter() - start
+    return report
+
+
+def run_on_cursor(con, validator, table):
+    cur = con.cursor()
+    try:
+        return validator(cur, table)
+    finally:
+        cur.close()
+
+
+# yellow/green trip table: duplicates, passengers, distance, duplicate keys, null timestamps, duration
+def validate_trip_table(con, table):
+    result = TableValidation(table)
+
+    try:
+        cols = [r[1] for r in con.execute(f"PRAGMA table_info('{table}')").fetchall()]
+    except Exception as e:
+        result.error = str(e)
+        logger.warning(f"{table} is missing or unreadable: {e}")
+        return result
+
+    pickup, dropoff = None, None
+    if "tpep_pickup_datetime" in cols and "tpep_dropoff_datetime" in cols:
+        pickup, dropoff = "tpep_pickup_datetime", "tpep_dropoff_datetime"
+    elif "lpep_pickup_datetime" in cols and "lpep_dropoff_datetime" in cols:
+        pickup, dropoff = "lpep_pickup_datetime", "lpep_dropoff_datetime"
+
+    time_aggs = ""
+    if pickup and dropoff:
+        time_aggs = f""",
+            COUNT(DISTINCT ({pickup}, {dropoff}, passenger_count, trip_distance)) AS distinct_keys,
+            COUNT(*) FILTER (WHERE {pickup} IS NULL OR {dropoff} IS NULL) AS null_ts,
+            COUNT(*) FILTER (
+                WHERE {pickup} IS NOT NULL
+                    AND {dropoff} IS NOT NULL
+                    AND (
+                        date_diff('second', {pickup}, {dropoff}) <= 0
+                        OR date_diff('second', {pickup}, {dropoff}) > {24*3600}
+                    )
+            ) AS bad_time"""
+
+    scan_start = time.perf_counter()
+    try:
+        row = con.execute(f"""
+            SELECT
+                COUNT(*) AS total_rows,
+                COUNT(DISTINCT t) AS distinct_rows,
+                COUNT(*) FILTER (WHERE passenger_count IS NULL OR passenger_count <= 0) AS bad_passenger,
+                COUNT(*) FILTER (WHERE trip_distance IS NULL OR trip_distance <= 0 OR trip_distance > 100) AS bad_distance
+                {time_aggs}
+            FROM {table} t
+        """).fetchone()
+    except Exception as e:
+        result.error = str(e)
+        logger.warning(f"{table} is missing or unreadable: {e}")
+        return result
+    result.scan_seconds = time.perf_counter() - scan_start
+
+    total_rows, distinct_rows, bad_passenger, bad_distance = row[:4]
+    result.row_count = total_rows
+    result.checks = [
+        CheckResult(table, "duplicates", total_rows - distinct_rows,
+                    f"[{table}] duplicates remain: total={total_rows}, distinct={distinct_rows}"),
+        CheckResult(table, "passenger_count", bad_passenger,
+                    f"[{table}] passenger_count <= 0 rows: {bad_passenger}"),
+        CheckResult(table, "trip_distance", bad_distance,
+                    f"[{table}] out-of-bounds trip_distance rows: {bad_distance}"),
+    ]
+
+    if pickup and dropoff:
+        distinct_keys, null_ts, bad_time = row[4:]
+        # the scan only tells us whether any key repeats - the failure message reports the number of duplicated
+        # key groups like the old check did, which takes one more GROUP BY only when there are any
+        dup_groups = 0
+        if total_rows > distinct_keys:
+            dup_groups = con.execute(f"""
+                SELECT COUNT(*) FROM (
+                    SELECT 1 FROM {table}
+                    GROUP BY {pickup}, {dropoff}, passenger_count, trip_distance
+                    HAVING COUNT(*) > 1
+                )
+            """).fetchone()[0]
+        result.checks.append(CheckResult(table, "duplicate_keys", dup_groups,
+                                         f"[{table}] duplicate groups by key: {dup_groups}"))
+        result.checks.append(CheckResult(table, "duration", bad_time,
+                                         f"[{table}] out-of-bounds duration rows: {bad_time}"))
+        # null timestamps were only ever a warning, not a failure
+        if null_ts:
+            logger.warning(f"[{table}] rows with NULL {pickup}/{dropoff}: {null_ts}")
+
+    log_table_result(result)
+    return result
+
+
+# vehicle_emissions lookup: duplicates, negative co2, out of range vehicle years
+def validate_vehicle_emissions(con, table="vehicle_emissions"):
+    result = TableValidation(table)
+
+    scan_start = time.perf_counter()
+    try:
+        total_rows, distinct_rows, neg_co2, unreasonable_years = con.execute(f"""
+            SELECT
+                COUNT(*),
+                COUNT(DISTINCT t),
+                COUNT(*) FILTER (WHERE co2_grams_per_mile < 0),
+                COUNT(*) FILTER (WHERE vehicle_year_avg IS NULL OR vehicle_year_avg < 1980 OR vehicle_year_avg > 2035)
+            FROM {table} t
+        """).fetchone()
+    except Exception as e:
+        result.error = str(e)
+        logger.warning(f"{table} is missing or unreadable")
+        return result
+    result.scan_seconds = time.perf_counter() - scan_start
+
+    result.row_count = total_rows
+    result.checks = [
+        CheckResult(table, "duplicates", total_rows - distinct_rows,
+                    f"[{table}] duplicates remain: total={total_rows}, distinct={distinct_rows}"),
+        CheckResult(table, "co2_grams_per_mile", neg_co2,
+                    f"[{table}] negative co2_grams_per_mile rows: {neg_co2}"),
+        CheckResult(table, "vehicle_year_avg", unreasonable_years,
+                    f"[{table}] out-of-range/NULL vehicle_year_avg rows: {unreasonable_years}"),
+    ]
+
+    log_table_result(result)
+    return result
+
+
+def log_table_result(result):
+    for c in result.checks:
+        if c.passed:
+            logger.info(f"{result.table}: {c.check} check passed")
+        else:
+            logger.warning(f"issue arose in {result.table}: {c.message}")
+    logger.info(f"[{result.table}] {len(result.checks)} checks in one scan of {result.row_count} rows, {result.scan_seconds:.2f}s")